@@ -7,12 +7,27 @@
 void initWifi();
 void printMacString(const uint8_t *mac);
 void espNowDataReceivedCallback(const uint8_t *srcMac, const uint8_t *incomingData, int len);
+void printPacketText(const uint8_t *monitorMac, const uint8_t *targetMac, int rssi);
+void writePacketFrame(const uint8_t *monitorMac, const uint8_t *targetMac, int rssi);
+uint16_t crc16(const uint8_t *data, size_t len);
 
 /*
   CONST VARIABLES
 */
 const int WIFI_CHANNEL = 1;
 
+// 1: send packets as binary frames (decoded by serial_reader.py on the PC)
+// 0: print packets as text lines "<monitor>_<target>:<rssi>"
+#define USE_BINARY_FRAMES 0
+
+// sync (2) | length (1) | monitor mac (6) | target mac (6) | rssi (1) | sequence (2) | timestamp in ms (4) | crc16 (2)
+const uint8_t FRAME_SYNC_0 = 0xA5;
+const uint8_t FRAME_SYNC_1 = 0x5A;
+const uint8_t FRAME_PAYLOAD_LEN = 19;
+const size_t FRAME_LEN = 2 + 1 + FRAME_PAYLOAD_LEN + 2;
+
+uint16_t frameSequence = 0;
+
 // !!!!!!!!!!!!!!!!!!!!
 // THIS DEVICES MAC IS
 // 24:62:AB:FB:15:A8
@@ -43,12 +58,57 @@ void espNowDataReceivedCallback(const esp_now_recv_info_t *esp_now_info, const u
   memcpy(targetMac, incomingData, 6);
   rssi = -incomingData[6]; // RSSI is transmitted as signed byte
 
-  printMacString(esp_now_info->src_addr);
+#if USE_BINARY_FRAMES
+  writePacketFrame(esp_now_info->src_addr, targetMac, rssi);
+#else
+  printPacketText(esp_now_info->src_addr, targetMac, rssi);
+#endif
+}
+
+void printPacketText(const uint8_t *monitorMac, const uint8_t *targetMac, int rssi) {
+  printMacString(monitorMac);
   Serial.print("_");
   printMacString(targetMac);
   Serial.printf(":%d\n", rssi);
 }
 
+uint16_t crc16(const uint8_t *data, size_t len) {
+  // CRC-16/CCITT with init 0xFFFF (same as binascii.crc_hqx on the PC)
+  uint16_t crc = 0xFFFF;
+  for (size_t i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void writePacketFrame(const uint8_t *monitorMac, const uint8_t *targetMac, int rssi) {
+  uint8_t frame[FRAME_LEN];
+  uint32_t timestamp = millis();
+
+  frame[0] = FRAME_SYNC_0;
+  frame[1] = FRAME_SYNC_1;
+  frame[2] = FRAME_PAYLOAD_LEN;
+  memcpy(&frame[3], monitorMac, 6);
+  memcpy(&frame[9], targetMac, 6);
+  frame[15] = (uint8_t)(int8_t)rssi;
+  frame[16] = frameSequence & 0xFF;
+  frame[17] = frameSequence >> 8;
+  frame[18] = timestamp & 0xFF;
+  frame[19] = (timestamp >> 8) & 0xFF;
+  frame[20] = (timestamp >> 16) & 0xFF;
+  frame[21] = (timestamp >> 24) & 0xFF;
+
+  uint16_t crc = crc16(&frame[2], 1 + FRAME_PAYLOAD_LEN);
+  frame[22] = crc & 0xFF;
+  frame[23] = crc >> 8;
+
+  frameSequence++;
+  Serial.write(frame, FRAME_LEN);
+}
+
 
 void setup() {
   Serial.begin(115200);
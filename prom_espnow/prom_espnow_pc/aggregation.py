@@ -1,9 +1,12 @@
 from abc import ABC, abstractmethod
 import numpy as np
 from collections import deque
+import math
+import random
 import time
 
 DEFAULT_LEN_RSSI_QUEUE = 10  # store at most 10 RSSI values per target and per monitor
+DEFAULT_AGGREGATION_MAX_AGE = 2.0  # s, older RSSIs do not describe the current position of a target
 
 class PacketItem:
     identification: int
@@ -30,7 +33,11 @@ class PacketAggregation(ABC):
         pass
     
     @abstractmethod
-    def get_packet(self):
+    def get_packet(self, now=None):
+        pass
+
+    def release(self):
+        # called when the target is forgotten, for aggregations that hold shared resources
         pass
         
 class MostRecentPacketAggregation(PacketAggregation):
@@ -38,7 +45,7 @@ class MostRecentPacketAggregation(PacketAggregation):
     def add_packet(self, packetItem):
         self.item = packetItem
     
-    def get_packet(self):
+    def get_packet(self, now=None):
         return self.item
 
 class MeanPacketAggregation(PacketAggregation):
@@ -49,10 +56,10 @@ class MeanPacketAggregation(PacketAggregation):
     def add_packet(self, packetItem):
         self.queue.appendleft(packetItem)
     
-    def get_packet(self):
+    def get_packet(self, now=None):
         items = list(self.queue)
         mean_rssi = np.mean([item.rssi for item in items])
-        timestamp = time.time()
+        timestamp = time.time() if now is None else now
         return PacketItem(0, timestamp, mean_rssi)
 
 class MedianPacketAggregation(PacketAggregation):
@@ -63,10 +70,10 @@ class MedianPacketAggregation(PacketAggregation):
     def add_packet(self, packetItem):
         self.queue.appendleft(packetItem)
     
-    def get_packet(self):
+    def get_packet(self, now=None):
         items = list(self.queue)
         mean_rssi = np.median([item.rssi for item in items])
-        timestamp = time.time()
+        timestamp = time.time() if now is None else now
         return PacketItem(0, timestamp, mean_rssi)
 
 class KalmanFilter:
@@ -82,14 +89,331 @@ class KalmanFilter:
         self.error_estimate = (1.0 - kalman_gain) * self.error_estimate + abs(self.estimated_measurement) * self.process_variance
         return self.estimated_measurement
 
+DEFAULT_PROCESS_VARIANCE = 1e-3
+DEFAULT_MEASUREMENT_VARIANCE = 10.0
+DEFAULT_ERROR_ESTIMATE = 1.0
+DEFAULT_NUM_STREAMS = 256
+
+class KalmanFilterBank:
+    # the scalar KalmanFilter for many streams at once, every stream starts at its first measurement
+
+    def __init__(
+            self,
+            num_streams=DEFAULT_NUM_STREAMS,
+            process_variance=DEFAULT_PROCESS_VARIANCE,
+            measurement_variance=DEFAULT_MEASUREMENT_VARIANCE,
+            error_estimate=DEFAULT_ERROR_ESTIMATE
+        ):
+        self.default_process_variance = process_variance
+        self.default_measurement_variance = measurement_variance
+        self.default_error_estimate = error_estimate
+
+        self.estimated_measurements = np.full(num_streams, np.nan)
+        self.error_estimates = np.full(num_streams, error_estimate)
+        self.process_variances = np.full(num_streams, process_variance)
+        self.measurement_variances = np.full(num_streams, measurement_variance)
+        self.initialized = np.zeros(num_streams, dtype=bool)
+        self.num_allocated = 0  # ids handed out by allocate()
+        self.free_ids = []
+
+    def __len__(self):
+        return len(self.estimated_measurements)
+
+    def ensure_capacity(self, num_streams):
+        if num_streams <= len(self):
+            return
+        capacity = max(len(self), 1)
+        while capacity < num_streams:
+            capacity *= 2
+
+        grow_by = capacity - len(self)
+        self.estimated_measurements = np.append(self.estimated_measurements, np.full(grow_by, np.nan))
+        self.error_estimates = np.append(self.error_estimates, np.full(grow_by, self.default_error_estimate))
+        self.process_variances = np.append(self.process_variances, np.full(grow_by, self.default_process_variance))
+        self.measurement_variances = np.append(self.measurement_variances, np.full(grow_by, self.default_measurement_variance))
+        self.initialized = np.append(self.initialized, np.zeros(grow_by, dtype=bool))
+
+    def set_variances(self, stream_ids, process_variance=None, measurement_variance=None):
+        stream_ids = np.asarray(stream_ids, dtype=np.intp)
+        self.ensure_capacity(int(stream_ids.max()) + 1)
+        if process_variance is not None:
+            self.process_variances[stream_ids] = process_variance
+        if measurement_variance is not None:
+            self.measurement_variances[stream_ids] = measurement_variance
+
+    def reset(self, stream_ids):
+        self.estimated_measurements[stream_ids] = np.nan
+        self.error_estimates[stream_ids] = self.default_error_estimate
+        self.initialized[stream_ids] = False
+
+    def allocate(self):
+        # id of a new stream for users that share the bank, released ids are reused
+        if self.free_ids:
+            return self.free_ids.pop()
+        stream_id = self.num_allocated
+        self.num_allocated += 1
+        self.ensure_capacity(self.num_allocated)
+        return stream_id
+
+    def release(self, stream_id):
+        self.reset([stream_id])
+        self.process_variances[stream_id] = self.default_process_variance
+        self.measurement_variances[stream_id] = self.default_measurement_variance
+        self.free_ids.append(stream_id)
+
+    def update_unique(self, stream_ids, measurements):
+        # stream_ids must not contain duplicates
+        new_streams = ~self.initialized[stream_ids]
+        if new_streams.any():
+            self.estimated_measurements[stream_ids[new_streams]] = measurements[new_streams]
+            self.initialized[stream_ids[new_streams]] = True
+
+        estimated_measurements = self.estimated_measurements[stream_ids]
+        error_estimates = self.error_estimates[stream_ids]
+
+        kalman_gains = error_estimates / (error_estimates + self.measurement_variances[stream_ids])
+        estimated_measurements += kalman_gains * (measurements - estimated_measurements)
+        error_estimates = (1.0 - kalman_gains) * error_estimates + np.abs(estimated_measurements) * self.process_variances[stream_ids]
+
+        self.estimated_measurements[stream_ids] = estimated_measurements
+        self.error_estimates[stream_ids] = error_estimates
+
+    def update(self, stream_ids, measurements):
+        stream_ids = np.asarray(stream_ids, dtype=np.intp)
+        measurements = np.asarray(measurements, dtype=np.float64)
+        if len(stream_ids) == 0:
+            return measurements
+        self.ensure_capacity(int(stream_ids.max()) + 1)
+        if len(stream_ids) == 1:
+            self.update_unique(stream_ids, measurements)
+            return self.estimated_measurements[stream_ids]
+
+        # packets of the same stream have to be applied one after the other, so the batch is split
+        # into rounds where every stream occurs at most once (first packet of each stream, second, ...)
+        order = np.argsort(stream_ids, kind='stable')
+        sorted_ids = stream_ids[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(sorted_ids)])
+        ranks = np.arange(len(sorted_ids)) - np.repeat(group_starts, group_sizes)
+
+        for rank in range(group_sizes.max()):
+            selected = order[ranks == rank]
+            self.update_unique(stream_ids[selected], measurements[selected])
+
+        return self.estimated_measurements[stream_ids]
+
+    def get_estimates(self, stream_ids=None):
+        if stream_ids is None:
+            return self.estimated_measurements
+        return self.estimated_measurements[stream_ids]
+
 class KalmanFilterPacketAggregation(PacketAggregation):
+    # one stream of a KalmanFilterBank, starts at the first RSSI; aggregations that share a bank
+    # can also be updated together with KalmanFilterBank.update()
 
-    def __init__(self):
-        self.kalman_filter = KalmanFilter(process_variance=1e-3, measurement_variance=10.0, estimated_measurement=-50.0)
+    def __init__(self, bank=None, process_variance=DEFAULT_PROCESS_VARIANCE, measurement_variance=DEFAULT_MEASUREMENT_VARIANCE):
+        self.bank = bank if bank is not None else KalmanFilterBank(num_streams=1)
+        self.stream_id = self.bank.allocate()
+        self.bank.set_variances([self.stream_id], process_variance, measurement_variance)
 
     def add_packet(self, packetItem):
-        self.filtered_rssi = self.kalman_filter.update(packetItem.rssi)  # Smooth the adjusted RSSI value
+        self.bank.update_unique(np.array([self.stream_id]), np.array([packetItem.rssi], dtype=np.float64))  # Smooth the adjusted RSSI value
     
-    def get_packet(self):
-        timestamp = time.time()
-        return PacketItem(0, timestamp, self.filtered_rssi)
\ No newline at end of file
+    def get_packet(self, now=None):
+        if not self.bank.initialized[self.stream_id]:
+            return None
+        timestamp = time.time() if now is None else now
+        return PacketItem(0, timestamp, float(self.bank.estimated_measurements[self.stream_id]))
+
+    def release(self):
+        self.bank.release(self.stream_id)
+
+class SkiplistNode:
+    __slots__ = ('value', 'next', 'width', 'sums')
+
+    def __init__(self, value, next, width, sums):
+        self.value = value
+        self.next = next
+        self.width = width
+        self.sums = sums  # per level the sum of the values skipped by the link, including the node it points to
+
+SKIPLIST_END = SkiplistNode(math.inf, [], [], [])  # sentinel that is greater than every RSSI
+
+class IndexableSkiplist:
+    # sorted multiset with O(log n) insert, remove, access by rank and sum over a rank range
+
+    def __init__(self, expected_size=100):
+        self.size = 0
+        self.max_levels = max(1, int(math.log2(max(expected_size, 2))) + 1)
+        self.head = SkiplistNode('HEAD', [SKIPLIST_END] * self.max_levels, [1] * self.max_levels, [0.0] * self.max_levels)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        node = self.head
+        i += 1
+        for level in reversed(range(self.max_levels)):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        return node.value
+
+    def prefix_sum(self, k):
+        # sum of the k smallest values
+        node = self.head
+        total = 0.0
+        for level in reversed(range(self.max_levels)):
+            while node.width[level] <= k:
+                k -= node.width[level]
+                total += node.sums[level]
+                node = node.next[level]
+        return total
+
+    def range_sum(self, start, stop):
+        return self.prefix_sum(stop) - self.prefix_sum(start)
+
+    def __iter__(self):
+        node = self.head.next[0]
+        while node is not SKIPLIST_END:
+            yield node.value
+            node = node.next[0]
+
+    def insert(self, value):
+        # find the last node at each level that is smaller than the new value
+        chain = [None] * self.max_levels
+        steps_at_level = [0] * self.max_levels
+        sum_at_level = [0.0] * self.max_levels
+        node = self.head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level].value <= value:
+                steps_at_level[level] += node.width[level]
+                sum_at_level[level] += node.sums[level]
+                node = node.next[level]
+            chain[level] = node
+
+        # insert a link to the new node at each level
+        d = min(self.max_levels, 1 - int(math.log2(random.random())))
+        new_node = SkiplistNode(value, [None] * d, [None] * d, [None] * d)
+        steps = 0
+        skipped_sum = 0.0
+        for level in range(d):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            new_node.sums[level] = prev_node.sums[level] - skipped_sum
+            prev_node.sums[level] = skipped_sum + value
+            steps += steps_at_level[level]
+            skipped_sum += sum_at_level[level]
+        for level in range(d, self.max_levels):
+            chain[level].width[level] += 1
+            chain[level].sums[level] += value
+        self.size += 1
+
+    def remove(self, value):
+        # find the first node at each level with a value of at least the given one
+        chain = [None] * self.max_levels
+        node = self.head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+        if value != chain[0].next[0].value:
+            raise KeyError('Not found')
+
+        # remove one link at each level
+        d = len(chain[0].next[0].next)
+        for level in range(d):
+            prev_node = chain[level]
+            prev_node.width[level] += prev_node.next[level].width[level] - 1
+            prev_node.sums[level] += prev_node.next[level].sums[level] - value
+            prev_node.next[level] = prev_node.next[level].next[level]
+        for level in range(d, self.max_levels):
+            chain[level].width[level] -= 1
+            chain[level].sums[level] -= value
+        self.size -= 1
+
+class SortedWindowPacketAggregation(PacketAggregation):
+    # keeps the last window_size RSSIs (optionally only those of the last max_age seconds) sorted,
+    # the aggregate is updated with every packet
+
+    def __init__(self, window_size=DEFAULT_LEN_RSSI_QUEUE, max_age=None):
+        self.window_size = window_size
+        self.max_age = max_age
+        self.queue = deque()
+        self.sorted_rssis = IndexableSkiplist(window_size)
+        self.aggregated_rssi = None
+
+    def add_packet(self, packetItem):
+        if len(self.queue) == self.window_size:
+            self.sorted_rssis.remove(self.queue.popleft().rssi)
+        self.queue.append(packetItem)
+        self.sorted_rssis.insert(packetItem.rssi)
+        self.expire(packetItem.timestamp)
+        self.aggregated_rssi = self.aggregate()
+
+    def expire(self, now):
+        if self.max_age is None:
+            return False
+
+        expired = False
+        while self.queue and self.queue[0].timestamp < now - self.max_age:
+            self.sorted_rssis.remove(self.queue.popleft().rssi)
+            expired = True
+        return expired
+
+    @abstractmethod
+    def aggregate(self):
+        pass
+
+    def percentile(self, percentile):
+        # linear interpolation between the closest ranks like np.percentile
+        position = percentile / 100.0 * (len(self.sorted_rssis) - 1)
+        lower = int(math.floor(position))
+        upper = int(math.ceil(position))
+        lower_rssi = self.sorted_rssis[lower]
+        if lower == upper:
+            return lower_rssi
+        return lower_rssi + (self.sorted_rssis[upper] - lower_rssi) * (position - lower)
+
+    def get_packet(self, now=None):
+        # None if all packets of the window are older than max_age
+        timestamp = time.time() if now is None else now
+        if self.expire(timestamp):
+            self.aggregated_rssi = self.aggregate() if self.queue else None
+        if not self.queue:
+            return None
+        return PacketItem(0, timestamp, self.aggregated_rssi)
+
+class SlidingMedianPacketAggregation(SortedWindowPacketAggregation):
+
+    def aggregate(self):
+        n = len(self.sorted_rssis)
+        if n % 2 == 1:
+            return self.sorted_rssis[n // 2]
+        return (self.sorted_rssis[n // 2 - 1] + self.sorted_rssis[n // 2]) / 2.0
+
+class SlidingPercentilePacketAggregation(SortedWindowPacketAggregation):
+
+    def __init__(self, percentile=50.0, window_size=DEFAULT_LEN_RSSI_QUEUE, max_age=None):
+        super().__init__(window_size, max_age)
+        self.percentile_value = percentile
+
+    def aggregate(self):
+        return self.percentile(self.percentile_value)
+
+class SlidingTrimmedMeanPacketAggregation(SortedWindowPacketAggregation):
+
+    def __init__(self, trim=0.1, window_size=DEFAULT_LEN_RSSI_QUEUE, max_age=None):
+        super().__init__(window_size, max_age)
+        self.trim = trim  # fraction cut off at each end like scipy.stats.trim_mean
+
+    def aggregate(self):
+        n = len(self.sorted_rssis)
+        cut = int(self.trim * n)
+        if 2 * cut >= n:
+            return self.sorted_rssis[n // 2]
+        # O(log n) from the link sums of the skiplist
+        return self.sorted_rssis.range_sum(cut, n - cut) / (n - 2 * cut)
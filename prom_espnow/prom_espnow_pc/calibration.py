@@ -1,56 +1,43 @@
 import serial
-import re
 import threading
-import time
 import pandas as pd
 from datetime import datetime
+from serial_reader import *
+from recorder import *
 
 try:
     nodeSerial = serial.Serial('COM6', 115200, timeout=1)
 except:
     print("Error opening serial port")
 
-pattern = re.compile("^([0-9A-Fa-f]{12})_([0-9A-Fa-f]{12}):(-?[0-9]+\.?[0-9]*)$")
+packet_reader = SerialPacketReader(nodeSerial)
 
 current_distance = None
-    
-timestamps = []
-monitor_macs = []
-distances = []
-rssis = []
+
+export_csv = True # also write the .csv next to the .pkl at the end
+
+filename = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+filepath = "./calibrations/" + filename
+
+# streamed to disk in chunks, the session directory stays readable with read_session() even after a crash
+recorder = ChunkedRecorder(filepath, CALIBRATION_COLUMNS)
 
 def message_handler_func():
-    global current_distance, timestamps, monitor_macs, distances, rssis
+    global current_distance
     
-    while True:
-        #read data from serial port
-        line = nodeSerial.readline()
-        
+    for packets in packet_reader.batches():
         if current_distance is None:
-            continue # ignore this line
-
-        #if there is smth do smth
-        if len(line) >= 1:
-            try:
-                timestamp = time.time()
-                line_decoded = line.decode("utf-8")
-                print(line_decoded)
-                match = pattern.match(line_decoded)
-                if match:
-                    monitor_mac = match.group(1)
-                    target_mac = match.group(2)
-                    rssi = float(match.group(3))
-                    print("Received: " + str(monitor_mac) + " "  + str(target_mac) + " "  + str(rssi))
-                    
-                    timestamps.append(timestamp)
-                    monitor_macs.append(monitor_mac)
-                    distances.append(current_distance)
-                    rssis.append(rssi)
-                else:
-                    print("No match")
-            except Exception as e: 
-                print(e)
-                print("could not decode")
+            continue # ignore these packets
+
+        for packet in packets:
+            print("Received: " + str(packet.monitor_mac) + " "  + str(packet.target_mac) + " "  + str(packet.rssi))
+            
+            recorder.append(
+                timestamp=packet.timestamp,
+                monitor_mac=packet.monitor_mac,
+                distance=current_distance,
+                rssi=packet.rssi,
+            )
 
 message_thread = threading.Thread(target=message_handler_func, daemon=True)
 message_thread.start()
@@ -62,17 +49,7 @@ try:
         current_distance = None
 except KeyboardInterrupt:
     print("Done!")
-    print("Converting to Pandas Dataframe...")
-
-df = pd.DataFrame({
-    'timestamp': timestamps,
-    'monitor_mac': monitor_macs,
-    'distance': distances,
-    'rssi': rssis,
-})
-
-filename = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-filepath = "./calibrations/" + filename
 
-df.to_pickle(filepath + ".pkl")
-df.to_csv(filepath + ".csv", index=False)
\ No newline at end of file
+recorder.close()
+print("Exporting " + str(recorder.total_rows) + " samples...")
+export_session(filepath, filepath, csv=export_csv)
\ No newline at end of file
@@ -0,0 +1,204 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from file_util import file_hash
+from path_loss import *
+
+# fits the path loss models of all calibration recordings (headless), the result is loaded with PathLossRegistry.load()
+
+DEFAULT_CALIBRATIONS_DIR = "./calibrations"
+DEFAULT_NUM_BOOTSTRAP = 1000
+DEFAULT_CONFIDENCE = 0.95
+CALIBRATION_VERSION = 1
+
+
+def design_matrix(model, distances):
+    # both models are linear in their parameters: log: rssi = l0 + exp * (-10 log10(d)), linear: rssi = intercept + slope * d
+    distances = np.asarray(distances, dtype=np.float64)
+    if model == MODEL_LOG:
+        return np.column_stack((np.ones(len(distances)), -10.0 * np.log10(distances)))
+    return np.column_stack((np.ones(len(distances)), distances))
+
+def fit_parameters(model, distances, means, weights=None):
+    # least squares on the mean RSSI per distance (as calibration_visualization.py), means can be (n_bootstrap x n_distances),
+    # weights (n_bootstrap x n_distances) count how often every point is in a resample
+    X = design_matrix(model, distances)
+    if weights is None:
+        solution = np.linalg.pinv(X) @ np.atleast_2d(means).T
+    else:
+        weights = np.atleast_2d(weights)
+        normal_matrices = np.einsum('bn,ni,nj->bij', weights, X, X)
+        right_sides = np.einsum('bn,ni,bn->bi', weights, X, np.atleast_2d(means))
+        solution = (np.linalg.pinv(normal_matrices) @ right_sides[:, :, None])[:, :, 0].T
+    if model == MODEL_LOG:
+        return {'l0': solution[0], 'exp': solution[1]}
+    return {'intercept': solution[0], 'slope': solution[1]}
+
+def fit_with_confidence(model, distances, means, bootstrap_means, confidence=DEFAULT_CONFIDENCE, bootstrap_weights=None):
+    fit = {name: float(value[0]) for name, value in fit_parameters(model, distances, means).items()}
+    bootstrap_fits = fit_parameters(model, distances, bootstrap_means, bootstrap_weights)
+    alpha = (1.0 - confidence) / 2.0
+    result = {'model': model, **fit}
+    for name, values in bootstrap_fits.items():
+        result[name + '_ci'] = [float(np.quantile(values, alpha)), float(np.quantile(values, 1.0 - alpha))]
+    return result
+
+def fit_models(distances, means, bootstrap_means, confidence=DEFAULT_CONFIDENCE, bootstrap_weights=None):
+    if len(distances) < 2:
+        return {}  # the distance is not identifiable from a single calibration distance
+    return {model: fit_with_confidence(model, distances, means, bootstrap_means, confidence, bootstrap_weights) for model in (MODEL_LOG, MODEL_LINEAR)}
+
+def read_calibration(file_path):
+    # only the needed columns with fixed dtypes, the C parser does the work
+    df = pd.read_csv(file_path, usecols=['monitor_mac', 'distance', 'rssi'], dtype={'monitor_mac': str, 'distance': np.float64, 'rssi': np.float64})
+    return df['monitor_mac'].to_numpy(), df['distance'].to_numpy(), df['rssi'].to_numpy()
+
+def process_calibration(file_path, sha256, num_bootstrap=DEFAULT_NUM_BOOTSTRAP, confidence=DEFAULT_CONFIDENCE):
+    # worker: per monitor the RSSI statistics per distance and the fits with nonparametric bootstrap intervals,
+    # the samples are resampled within every distance
+    monitor_macs, distances, rssis = read_calibration(file_path)
+    rng = np.random.default_rng(int(sha256[:16], 16))
+
+    monitors = {}
+    for monitor_mac in np.unique(monitor_macs):
+        selected = monitor_macs == monitor_mac
+        monitor_distances = distances[selected]
+        monitor_rssis = rssis[selected]
+
+        unique_distances = np.unique(monitor_distances[monitor_distances > 0.0])
+        stats = {'distances': [], 'counts': [], 'means': [], 'stds': []}
+        bootstrap_means = []
+        for distance in unique_distances:
+            samples = monitor_rssis[monitor_distances == distance]
+            stats['distances'].append(float(distance))
+            stats['counts'].append(int(len(samples)))
+            stats['means'].append(float(np.mean(samples)))
+            stats['stds'].append(float(np.std(samples, ddof=1)) if len(samples) > 1 else 0.0)
+            bootstrap_means.append(np.mean(samples[rng.integers(0, len(samples), size=(num_bootstrap, len(samples)))], axis=1))
+
+        bootstrap_means = np.column_stack(bootstrap_means) if bootstrap_means else np.zeros((num_bootstrap, 0))
+        monitors[str(monitor_mac)] = {
+            'statistics': stats,
+            'fits': fit_models(stats['distances'], stats['means'], bootstrap_means, confidence),
+        }
+
+    return {'sha256': sha256, 'num_samples': int(len(rssis)), 'monitors': monitors}
+
+def pooled_fits(statistics, num_bootstrap, confidence, seed=0):
+    # fit over the per distance means of several files (one statistics dict per file); samples of one recording
+    # share its setup (orientation, room, interference), so the bootstrap resamples whole files and only within a
+    # resampled file redraws the mean of every distance from N(mean, std / sqrt(count)), the raw samples are not kept
+    distances = np.concatenate([stats['distances'] for stats in statistics])
+    means = np.concatenate([stats['means'] for stats in statistics])
+    stds = np.concatenate([stats['stds'] for stats in statistics])
+    counts = np.concatenate([stats['counts'] for stats in statistics])
+    file_indices = np.repeat(np.arange(len(statistics)), [len(stats['distances']) for stats in statistics])
+    if len(np.unique(distances)) < 2:
+        return {}
+
+    rng = np.random.default_rng(seed)
+    bootstrap_means = means + rng.standard_normal((num_bootstrap, len(means))) * (stds / np.sqrt(counts))
+    file_weights = np.zeros((num_bootstrap, len(statistics)))
+    np.add.at(file_weights, (np.arange(num_bootstrap)[:, None], rng.integers(0, len(statistics), size=(num_bootstrap, len(statistics)))), 1.0)
+    fits = fit_models(distances, means, bootstrap_means, confidence, file_weights[:, file_indices])
+    for fit in fits.values():
+        # with a single file the intervals only cover the noise of its means, not the variation between recordings
+        fit['num_files'] = len(statistics)
+    return fits
+
+def load_parameters(output_path):
+    if not os.path.exists(output_path):
+        return {}
+    with open(output_path, 'r') as f:
+        parameters = json.load(f)
+    if parameters.get('version') != CALIBRATION_VERSION:
+        return {}
+    return parameters
+
+def run_calibration(calibrations_dir=DEFAULT_CALIBRATIONS_DIR, output_path=DEFAULT_PATH_LOSS_PARAMETERS, num_bootstrap=DEFAULT_NUM_BOOTSTRAP, confidence=DEFAULT_CONFIDENCE, max_workers=None):
+    previous_files = load_parameters(output_path).get('files', {})
+
+    file_paths = sorted(glob.glob(os.path.join(calibrations_dir, '*.csv')))
+    hashes = {os.path.basename(file_path): file_hash(file_path) for file_path in file_paths}
+
+    # files with unchanged content keep their previous results
+    files = {}
+    changed = []
+    for file_path in file_paths:
+        file_name = os.path.basename(file_path)
+        previous = previous_files.get(file_name)
+        if previous is not None and previous['sha256'] == hashes[file_name] and previous.get('num_bootstrap') == num_bootstrap and previous.get('confidence') == confidence:
+            files[file_name] = previous
+        else:
+            changed.append(file_path)
+
+    print(f"{len(file_paths)} calibration files, {len(changed)} new or changed")
+    start = time.perf_counter()
+    if changed:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                process_calibration,
+                changed,
+                [hashes[os.path.basename(file_path)] for file_path in changed],
+                [num_bootstrap] * len(changed),
+                [confidence] * len(changed),
+            )
+            for file_path, result in zip(changed, results):
+                result['num_bootstrap'] = num_bootstrap
+                result['confidence'] = confidence
+                files[os.path.basename(file_path)] = result
+    print(f"processed in {time.perf_counter() - start:.2f}s")
+
+    # per monitor over all files, and over all monitors for the default model
+    monitor_statistics = {}
+    for file_name in sorted(files.keys()):
+        for monitor_mac, monitor in files[file_name]['monitors'].items():
+            monitor_statistics.setdefault(monitor_mac, []).append(monitor['statistics'])
+    monitors = {monitor_mac: pooled_fits(statistics, num_bootstrap, confidence) for monitor_mac, statistics in sorted(monitor_statistics.items())}
+    monitors = {monitor_mac: fits for monitor_mac, fits in monitors.items() if fits}
+    default = pooled_fits([stats for statistics in monitor_statistics.values() for stats in statistics], num_bootstrap, confidence)
+
+    parameters = {
+        'version': CALIBRATION_VERSION,
+        'confidence': confidence,
+        'default': default,
+        'monitors': monitors,
+        'files': {file_name: files[file_name] for file_name in sorted(files.keys())},
+    }
+
+    # written to a temporary file first, the runtime never sees a half written parameter file
+    tmp_output_path = output_path + '.tmp'
+    with open(tmp_output_path, 'w') as f:
+        json.dump(parameters, f, indent=2)
+    os.replace(tmp_output_path, output_path)
+
+    return parameters
+
+def print_parameters(parameters):
+    for monitor_mac, fits in [('default', parameters['default'])] + list(parameters['monitors'].items()):
+        if fits and next(iter(fits.values()))['num_files'] < 2:
+            print(f"{monitor_mac}: only one calibration file, the intervals do not include the variation between recordings")
+        if MODEL_LOG in fits:
+            fit = fits[MODEL_LOG]
+            print(f"{monitor_mac}: L0 {fit['l0']:.2f} [{fit['l0_ci'][0]:.2f}, {fit['l0_ci'][1]:.2f}]  EXP {fit['exp']:.3f} [{fit['exp_ci'][0]:.3f}, {fit['exp_ci'][1]:.3f}]")
+        if MODEL_LINEAR in fits:
+            fit = fits[MODEL_LINEAR]
+            print(f"{monitor_mac}: slope {fit['slope']:.3f} [{fit['slope_ci'][0]:.3f}, {fit['slope_ci'][1]:.3f}]  intercept {fit['intercept']:.2f} [{fit['intercept_ci'][0]:.2f}, {fit['intercept_ci'][1]:.2f}]")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit the path loss models of all calibration recordings")
+    parser.add_argument('--calibrations-dir', default=DEFAULT_CALIBRATIONS_DIR)
+    parser.add_argument('--output', default=DEFAULT_PATH_LOSS_PARAMETERS)
+    parser.add_argument('--bootstrap', type=int, default=DEFAULT_NUM_BOOTSTRAP)
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    parameters = run_calibration(args.calibrations_dir, args.output, args.bootstrap, args.confidence, args.workers)
+    print_parameters(parameters)
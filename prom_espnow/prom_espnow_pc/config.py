@@ -1,3 +1,4 @@
+import numpy as np
 from PIL import Image
 
 ENVIRONMENTS = {
@@ -11,27 +12,69 @@ CURRENT_ENV = "flat"
 PATH_LOSS_L0 = -50.0 # -45.0
 PATH_LOSS_EXP = 3.5 # 3.0
 
+class Environment:
+    # one entry of ENVIRONMENTS, the background is read from disk once and everything derived from it is kept
+
+    def __init__(self, name):
+        self.name = name
+        (self.background_filename, self.width_in_m) = ENVIRONMENTS[name]
+        self._background = None
+        self._scaled_background = None
+
+    @property
+    def background(self):
+        if self._background is None:
+            background = Image.open(self.background_filename)
+            background.load() # read the pixels now and release the file
+            self._background = background
+        return self._background
+
+    @property
+    def size_px(self):
+        return self.background.size
+
+    @property
+    def px_per_m(self):
+        return self.size_px[0] / self.width_in_m
+
+    def to_px(self, dims_in_m):
+        # scalars or whole arrays of coordinates / lengths
+        return np.multiply(dims_in_m, self.px_per_m)
+
+    def to_m(self, dims_in_px):
+        return np.multiply(dims_in_px, 1.0 / self.px_per_m)
+
+    @property
+    def scaled_background(self):
+        # scaled so that 1px = 1cm
+        if self._scaled_background is None:
+            background = self.background
+            new_size = (int(background.size[0] * self.to_m(100)), int(background.size[1] * self.to_m(100)))
+            self._scaled_background = background.resize(new_size, Image.LANCZOS)
+        return self._scaled_background
+
+environments = {}
+
+def get_environment(name=None):
+    # every environment is loaded once and stays loaded, so several floors can be used side by side
+    name = CURRENT_ENV if name is None else name
+    environment = environments.get(name)
+    if environment is None:
+        environment = Environment(name)
+        environments[name] = environment
+    return environment
+
 def get_env_background_filename():
-    (filename, _) = ENVIRONMENTS[CURRENT_ENV]
-    return filename
+    return get_environment().background_filename
     
 def get_env_background_image():
-    return Image.open(get_env_background_filename())
+    return get_environment().background
 
 def env_to_px(dim_in_m):
-    (_, width_in_m) = ENVIRONMENTS[CURRENT_ENV]
-    background = get_env_background_image()
-    (width_in_px, _) = background.size
-    return width_in_px / width_in_m * dim_in_m
+    return get_environment().to_px(dim_in_m)
 
 def env_to_m(dim_in_px):
-    (_, width_in_m) = ENVIRONMENTS[CURRENT_ENV]
-    background = get_env_background_image()
-    (width_in_px, _) = background.size
-    return width_in_m / width_in_px * dim_in_px
+    return get_environment().to_m(dim_in_px)
 
 def get_scaled_env_background_image():
-    background = get_env_background_image()
-    # scale so that 1px = 1cm
-    new_size = (int(background.size[0] * env_to_m(100)), int(background.size[1] * env_to_m(100)))
-    return background.resize(new_size, Image.LANCZOS)
\ No newline at end of file
+    return get_environment().scaled_background
@@ -1,13 +1,13 @@
 import serial
-import re
-import time
-from collections import defaultdict
 import numpy as np
 from plot import *
 from util import *
 from simulation import *
 from localization import *
+from tracking import *
 from aggregation import *
+from serial_reader import *
+from receiver_pipeline import *
 
 import matplotlib.style as mplstyle
 mplstyle.use('fast')
@@ -33,7 +33,7 @@ anchors = {
 # sim_target_position = (1.0, 1.0)
 # simulator = ESPositionMainNodeSimulator(anchors, "100000000000", sim_target_position, True, True, 100, True)
 
-# playback = ESPositionMainNodePlayback("342eb61ec446", "./recordings/2024_09_05_17_50_22_walk_through_flat.csv")
+# playback = ESPositionMainNodePlayback("342eb61ec446", "./recordings/2024_09_05_17_50_22_walk_through_flat.csv", speed=PLAYBACK_REAL_TIME)
 # anchors = playback.get_anchors()
 
 # plot_monitors(anchors.values())
@@ -51,85 +51,29 @@ print(rssis)
 plot_results([(env_to_m(x), env_to_m(y)) for (x, y) in anchors.values()], distances_in_m, target_position_in_m)
 '''
 
-pattern = re.compile("^([0-9A-Fa-f]{12})_([0-9A-Fa-f]{12}):(-?[0-9]+\.?[0-9]*)$")
-
-monitor_dict = defaultdict(dict)
-
-
-import time
-import datetime as dt
-
-
-def message_handler_func():    
-    while True:
-        #read data from serial port
-        line = nodeSerial.readline()
-        print(nodeSerial.in_waiting)
-        # line = simulator.readline()
-        # line = playback.readline()
-
-        #if there is smth do smth
-        if len(line) >= 1:
-            try:
-                timestamp = time.time()
-                line_decoded = line.decode("utf-8")
-                # print(line_decoded)
-                match = pattern.match(line_decoded)
-                if match:
-                    monitor_mac = match.group(1)
-                    target_mac = match.group(2)
-                    rssi = float(match.group(3))
-                    # print("Received: " + str(monitor_mac) + " "  + str(target_mac) + " "  + str(rssi))
-                    
-                    item = PacketItem(0, timestamp, rssi)
-                    
-                    try:
-                        _ = monitor_dict[target_mac][monitor_mac]
-                    except KeyError:
-                        monitor_dict[target_mac][monitor_mac] = MedianPacketAggregation(50)
-                    
-                    monitor_dict[target_mac][monitor_mac].add_packet(item)
-                    
-                    # plot_graph(monitor_mac, rssi)
-                    # plot_graph(monitor_mac + "_filtered", monitor_dict[target_mac][monitor_mac].get_packet().rssi)
-                    
-                    # print(monitor_dict)
-                else:
-                    print("No match")
-            except Exception as e: 
-                print(e)
-                print("could not decode")
-
-message_thread = threading.Thread(target=message_handler_func, daemon=True)
-message_thread.start()
-
+packet_reader = SerialPacketReader(nodeSerial)
+# packet_reader = SerialPacketReader(simulator)
+# packet_reader = playback # hands parsed records to the pipeline directly
 
 
 plotter = RealtimePlotter()
 
-tlsl = TrilaterationLeastSquaresLocalization(anchors, plotter=plotter)
-twcl = TrilaterationWeightedCentroidLocalization(anchors, plotter=plotter)
-fpl = FingerprintingLocalization("./fingerprint_maps/2024_11_06_22_12_16.csv", plotter.background.size, plotter=plotter)
-
-def localization_update():
-    while True:
-        # to prevent starvation of the message thread
-        # python threading is weird
-        while nodeSerial.in_waiting > 0:
-            time.sleep(0.01)
-    
-        for target_mac in monitor_dict:
-            if len(monitor_dict[target_mac].keys()) < 4: # TODO: 3
-                continue
-            
-            rssis = {monitor_mac: monitor_dict[target_mac][monitor_mac].get_packet().rssi for monitor_mac in monitor_dict[target_mac].keys()}
-            
-            tlsl.localize(rssis)
-            twcl.localize(rssis)
-            fpl.localize(rssis)
-
-localization_thread = threading.Thread(target=localization_update, daemon=True)
-localization_thread.start()
+state = TargetStateStore() # per target estimates of all localizers
+path_loss = PathLossRegistry.load_or_default() # fitted per monitor models if calibrated, config.py values otherwise
+
+tlsl = TrilaterationLeastSquaresLocalization(anchors, plotter=plotter, state=state, path_loss=path_loss)
+twcl = TrilaterationWeightedCentroidLocalization(anchors, plotter=plotter, state=state, path_loss=path_loss)
+fpl = FingerprintingLocalization("./fingerprint_maps/2024_11_06_22_12_16.csv", plotter.background.size, plotter=plotter, state=state)
+pf = ParticleFilterTracker(PathLossLikelihood(anchors, plotter.background.size, path_loss=path_loss), plotter=plotter, state=state)
+# pf = ParticleFilterTracker(FingerprintLikelihood(fpl), plotter=plotter, state=state)
+
+# tracked_targets = ["342eb61ec446"]
+tracked_targets = None # all targets
+# plotter.tracked_target = "342eb61ec446"
+target_table = TargetTable(max_targets=256, ttl=60.0, allowlist=tracked_targets, packet_store=RingBufferPacketStore(window_size=50), max_age=DEFAULT_AGGREGATION_MAX_AGE)
+scheduler = LocalizationScheduler(min_monitors=4, min_fresh_monitors=1, min_localization_interval=0.1, max_age=DEFAULT_AGGREGATION_MAX_AGE) # TODO: 3
+pipeline = ReceiverPipeline(packet_reader, [tlsl, twcl, fpl, pf], target_table=target_table, scheduler=scheduler, state=state)
+pipeline.start()
 
 # fpl.start_plot()
-plotter.start_plotting()
\ No newline at end of file
+plotter.start_plotting()
@@ -28,12 +28,11 @@ plotter = RealtimePlotter()
 
 tlsl = TrilaterationLeastSquaresLocalization(anchors, smooth=False, plotter=plotter)
 twcl = TrilaterationWeightedCentroidLocalization(anchors, smooth=False, plotter=plotter)
-fpl = FingerprintingLocalization("./fingerprint_maps/2024_11_06_22_12_16.csv", plotter.background.size, smooth=False, plotter=plotter)
+fingerprints_file_path = "./fingerprint_maps/2024_11_06_22_12_16.pkl"
+fpl = FingerprintingLocalization(fingerprints_file_path, plotter.background.size, smooth=False, plotter=plotter)
 
 def localization_update():
-    df = pd.read_csv("./fingerprint_maps/2024_11_06_22_12_16.csv", index_col=False)
-    df_mean = df.groupby(['monitor_mac', 'target_position_x', 'target_position_y', 'anchor_position_x', 'anchor_position_y'], as_index=False).agg({'rssi':['median']})
-    df_mean.columns = ['monitor_mac', 'target_position_x', 'target_position_y', 'anchor_position_x', 'anchor_position_y', 'rssi_median']
+    df_mean = load_session(fingerprints_file_path).survey_medians()
     df_mean['target_position'] = df_mean[['target_position_x', 'target_position_y']].apply(tuple, axis=1)
     
     target_positions = df_mean['target_position'].unique()
@@ -0,0 +1,12 @@
+import hashlib
+
+# helpers for the scripts that cache results per input file
+
+
+def file_hash(file_path):
+    # sha256 of the content, read in blocks so that large recordings are not loaded at once
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
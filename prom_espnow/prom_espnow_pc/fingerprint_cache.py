@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from file_util import file_hash
+
+DEFAULT_FINGERPRINT_CACHE_DIR = "./fingerprint_maps/cache"
+FINGERPRINT_CACHE_VERSION = 2
+
+MEDIAN_COLUMNS = ['monitor_mac', 'target_position_x', 'target_position_y', 'anchor_position_x', 'anchor_position_y', 'rssi_median']
+
+
+def fingerprint_cache_key(fingerprints_file_path, **settings):
+    # content of the survey plus everything that influences the interpolated maps
+    key = {
+        'version': FINGERPRINT_CACHE_VERSION,
+        'file': file_hash(fingerprints_file_path),
+        'settings': settings,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+class FingerprintMapCache:
+    # one directory per key: grids.npy (cells x monitors float32, memory mapped when loading), axes, medians and a meta file
+
+    def __init__(self, cache_dir=DEFAULT_FINGERPRINT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        entry_dir = self.entry_dir(key)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            grids = np.load(os.path.join(entry_dir, 'grids.npy'), mmap_mode='r')
+            with np.load(os.path.join(entry_dir, 'axes.npz')) as axes:
+                pos_lookup_x = axes['pos_lookup_x']
+                pos_lookup_y = axes['pos_lookup_y']
+            with np.load(os.path.join(entry_dir, 'medians.npz'), allow_pickle=False) as medians:
+                df_mean = pd.DataFrame({column: medians[column] for column in MEDIAN_COLUMNS})
+        except (OSError, ValueError, KeyError) as e:
+            print("Ignoring broken fingerprint cache entry " + entry_dir + ": " + str(e))
+            return None
+
+        return meta['monitor_macs'], grids, pos_lookup_x, pos_lookup_y, df_mean
+
+    def save(self, key, monitor_macs, fingerprints, pos_lookup_x, pos_lookup_y, df_mean):
+        entry_dir = self.entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        monitor_macs = list(monitor_macs)
+        grids = np.ascontiguousarray(fingerprints, dtype=np.float32)
+
+        # meta.json is written last, an entry without it is incomplete and gets rebuilt
+        np.save(os.path.join(entry_dir, 'grids.npy'), grids)
+        np.savez(os.path.join(entry_dir, 'axes.npz'), pos_lookup_x=pos_lookup_x, pos_lookup_y=pos_lookup_y)
+        np.savez(
+            os.path.join(entry_dir, 'medians.npz'),
+            **{column: df_mean[column].to_numpy(dtype=str if column == 'monitor_mac' else np.float64) for column in MEDIAN_COLUMNS}
+        )
+
+        tmp_meta_path = os.path.join(entry_dir, 'meta.json.tmp')
+        with open(tmp_meta_path, 'w') as f:
+            json.dump({'monitor_macs': monitor_macs, 'shape': list(grids.shape)}, f)
+        os.replace(tmp_meta_path, os.path.join(entry_dir, 'meta.json'))
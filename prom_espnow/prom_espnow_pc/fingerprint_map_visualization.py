@@ -6,27 +6,20 @@ from PIL import Image
 from config import *
 from matplotlib.ticker import MultipleLocator
 import matplotlib.pyplot as pp
-from scipy.interpolate import Rbf
+from interpolation import *
+from session_format import *
 import matplotlib.cm as cm
 import matplotlib
 
 current_file = "2024_11_06_22_12_16.csv"
+interpolation = get_interpolation('rbf') # see INTERPOLATION_BACKENDS
 filepath = "./fingerprint_maps/" + current_file
 
-df = pd.read_csv(filepath, index_col=False)
-df_mean = df.groupby(['monitor_mac', 'target_position_x', 'target_position_y', 'anchor_position_x', 'anchor_position_y'], as_index=False).agg({'rssi':['median']})
-
-print(df_mean)
-
-
-df_mean.columns = ['monitor_mac', 'target_position_x', 'target_position_y', 'anchor_position_x', 'anchor_position_y', 'rssi_median']
+df_mean = load_session(filepath).survey_medians()
 print(df_mean)
 
 
-background = get_env_background_image()
-# scale so that 1px = 1cm
-new_size = (int(background.size[0] * env_to_m(100)), int(background.size[1] * env_to_m(100)))
-background = background.resize(new_size, Image.LANCZOS)
+background = get_scaled_env_background_image() # 1px = 1cm
 
 monitor_macs = df_mean['monitor_mac'].unique()
 for monitor_mac in monitor_macs:
@@ -60,8 +53,7 @@ for monitor_mac in monitor_macs:
     gx, gy = np.meshgrid(x, y)
     gx, gy = gx.flatten(), gy.flatten()
     
-    rbf = Rbf(target_positions_x, target_positions_y, rssi_medians, function='linear')
-    z = rbf(gx, gy)
+    z = interpolation.interpolate(target_positions_x, target_positions_y, rssi_medians, gx, gy)
     z = z.reshape((num_y, num_x))
     
     cmap = pp.get_cmap('RdYlBu_r')
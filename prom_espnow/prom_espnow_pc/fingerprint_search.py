@@ -0,0 +1,106 @@
+import numpy as np
+
+SEARCH_EXACT = 'exact'
+SEARCH_APPROXIMATE = 'approximate'
+
+DEFAULT_BLOCK_FACTOR = 4       # every coarser level merges 4x4 cells
+DEFAULT_MAX_COARSE_CELLS = 256  # the top level has at most this many blocks
+DEFAULT_BEAM_WIDTH = 8         # blocks refined per level in the approximate mode
+DEFAULT_NUM_UPPER_BOUNDS = 4   # exact costs evaluated per level to tighten the pruning bound
+
+
+class FingerprintPyramidSearch:
+    # resolution pyramid over interpolated fingerprint maps (num_y x num_x x num_monitors),
+    # every coarse block stores the per monitor minimum and maximum of the cells it covers
+
+    def __init__(self, fingerprints, block_factor=DEFAULT_BLOCK_FACTOR, max_coarse_cells=DEFAULT_MAX_COARSE_CELLS):
+        self.fingerprints = fingerprints
+        self.block_factor = block_factor
+        self.shape = fingerprints.shape[:2]
+
+        self.levels_min = [fingerprints]
+        self.levels_max = [fingerprints]
+        while self.levels_min[-1].shape[0] * self.levels_min[-1].shape[1] > max_coarse_cells and max(self.levels_min[-1].shape[:2]) > 1:
+            self.levels_min.append(self.pool(self.levels_min[-1], np.min))
+            self.levels_max.append(self.pool(self.levels_max[-1], np.max))
+
+    def pool(self, level, reduce):
+        # pads with the border cells, duplicates do not change the min/max of a block
+        f = self.block_factor
+        (num_y, num_x, num_monitors) = level.shape
+        pad_y = -num_y % f
+        pad_x = -num_x % f
+        padded = np.pad(level, ((0, pad_y), (0, pad_x), (0, 0)), mode='edge')
+        blocks = padded.reshape((num_y + pad_y) // f, f, (num_x + pad_x) // f, f, num_monitors)
+        return reduce(blocks, axis=(1, 3))
+
+    @property
+    def num_levels(self):
+        return len(self.levels_min)
+
+    def lower_bounds(self, level, cells_y, cells_x, rssis, monitor_indices):
+        # no cell inside a block can be closer than the distance of the query to the [min, max] interval per monitor
+        block_min = self.levels_min[level][cells_y, cells_x][:, monitor_indices]
+        block_max = self.levels_max[level][cells_y, cells_x][:, monitor_indices]
+        distance = np.maximum(np.maximum(block_min - rssis, rssis - block_max), 0.0)
+        return np.sum(distance**2, axis=1)
+
+    def costs(self, cells_y, cells_x, rssis, monitor_indices):
+        diff = self.fingerprints[cells_y, cells_x][:, monitor_indices] - rssis
+        return np.sum(diff**2, axis=1)
+
+    def representative_cells(self, level, cells_y, cells_x):
+        # center cell of a block, clipped to the map
+        size = self.block_factor**level
+        cells_y = np.minimum(cells_y * size + size // 2, self.shape[0] - 1)
+        cells_x = np.minimum(cells_x * size + size // 2, self.shape[1] - 1)
+        return cells_y, cells_x
+
+    def children(self, level, cells_y, cells_x):
+        f = self.block_factor
+        offsets_y, offsets_x = np.meshgrid(np.arange(f), np.arange(f), indexing='ij')
+        children_y = (cells_y[:, None] * f + offsets_y.ravel()[None, :]).ravel()
+        children_x = (cells_x[:, None] * f + offsets_x.ravel()[None, :]).ravel()
+        (num_y, num_x) = self.levels_min[level - 1].shape[:2]
+        inside = (children_y < num_y) & (children_x < num_x)
+        return children_y[inside], children_x[inside]
+
+    def neighbors(self, level, cells_y, cells_x):
+        (num_y, num_x) = self.levels_min[level].shape[:2]
+        offsets_y, offsets_x = np.meshgrid(np.arange(-1, 2), np.arange(-1, 2), indexing='ij')
+        neighbors_y = np.clip((cells_y[:, None] + offsets_y.ravel()[None, :]).ravel(), 0, num_y - 1)
+        neighbors_x = np.clip((cells_x[:, None] + offsets_x.ravel()[None, :]).ravel(), 0, num_x - 1)
+        unique = np.unique(neighbors_y * num_x + neighbors_x)
+        return unique // num_x, unique % num_x
+
+    def search(self, rssis, monitor_indices, mode=SEARCH_EXACT, beam_width=DEFAULT_BEAM_WIDTH):
+        # returns the (y, x) grid cell with the smallest euclidean distance to the query and that distance,
+        # SEARCH_EXACT prunes only blocks whose lower bound exceeds a known cost (same result as the full search)
+        rssis = np.asarray(rssis, dtype=np.float64)
+        monitor_indices = np.asarray(monitor_indices, dtype=np.intp)
+
+        top = self.num_levels - 1
+        (num_y, num_x) = self.levels_min[top].shape[:2]
+        cells_y, cells_x = np.divmod(np.arange(num_y * num_x), num_x)
+        upper_bound = np.inf
+
+        for level in range(top, 0, -1):
+            bounds = self.lower_bounds(level, cells_y, cells_x, rssis, monitor_indices)
+
+            if mode == SEARCH_EXACT:
+                # the real cost of any cell is an upper bound for the optimum
+                best = np.argsort(bounds)[:DEFAULT_NUM_UPPER_BOUNDS]
+                representative_y, representative_x = self.representative_cells(level, cells_y[best], cells_x[best])
+                upper_bound = min(upper_bound, np.min(self.costs(representative_y, representative_x, rssis, monitor_indices)))
+                keep = bounds <= upper_bound
+                cells_y, cells_x = cells_y[keep], cells_x[keep]
+            else:
+                # refine the neighborhoods of the most promising blocks only
+                best = np.argsort(bounds)[:beam_width]
+                cells_y, cells_x = self.neighbors(level, cells_y[best], cells_x[best])
+
+            cells_y, cells_x = self.children(level, cells_y, cells_x)
+
+        costs = self.costs(cells_y, cells_x, rssis, monitor_indices)
+        best = np.argmin(costs)
+        return (cells_y[best], cells_x[best]), np.sqrt(costs[best])
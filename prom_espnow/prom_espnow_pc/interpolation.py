@@ -0,0 +1,154 @@
+from abc import ABC, abstractmethod
+import time
+import numpy as np
+from scipy.interpolate import Rbf, RBFInterpolator, griddata
+from scipy.spatial import cKDTree
+
+DEFAULT_RBF_NEIGHBORS = 32
+DEFAULT_IDW_NEIGHBORS = 8
+DEFAULT_IDW_POWER = 2.0
+
+
+class FingerprintInterpolation(ABC):
+    # interpolates the median RSSIs of the survey points of one monitor onto the grid points
+
+    name = None
+
+    @abstractmethod
+    def interpolate(self, points_x, points_y, values, grid_x, grid_y):
+        pass
+
+    def settings(self):
+        # everything that changes the result, used for the fingerprint map cache key
+        return {'name': self.name}
+
+class RbfInterpolation(FingerprintInterpolation):
+    # the legacy global scipy Rbf, solves a dense system over all survey points
+
+    name = 'rbf'
+
+    def __init__(self, function='linear'):
+        self.function = function
+
+    def interpolate(self, points_x, points_y, values, grid_x, grid_y):
+        # from https://github.com/jantman/python-wifi-survey-heatmap/blob/master/wifi_survey_heatmap/heatmap.py
+        rbf = Rbf(points_x, points_y, values, function=self.function)
+        return rbf(grid_x, grid_y)
+
+    def settings(self):
+        return {'name': self.name, 'function': self.function}
+
+class LocalRbfInterpolation(FingerprintInterpolation):
+    # every grid point only uses its nearest survey points
+
+    name = 'local_rbf'
+
+    def __init__(self, neighbors=DEFAULT_RBF_NEIGHBORS, kernel='linear'):
+        self.neighbors = neighbors
+        self.kernel = kernel
+
+    def interpolate(self, points_x, points_y, values, grid_x, grid_y):
+        points = np.column_stack((points_x, points_y))
+        neighbors = min(self.neighbors, len(points))
+        rbf = RBFInterpolator(points, np.asarray(values, dtype=np.float64), neighbors=neighbors, kernel=self.kernel)
+        return rbf(np.column_stack((grid_x, grid_y)))
+
+    def settings(self):
+        return {'name': self.name, 'neighbors': self.neighbors, 'kernel': self.kernel}
+
+class IdwInterpolation(FingerprintInterpolation):
+    # inverse distance weighting over the k nearest survey points found with a k-d tree
+
+    name = 'idw'
+
+    def __init__(self, neighbors=DEFAULT_IDW_NEIGHBORS, power=DEFAULT_IDW_POWER):
+        self.neighbors = neighbors
+        self.power = power
+
+    def interpolate(self, points_x, points_y, values, grid_x, grid_y):
+        values = np.asarray(values, dtype=np.float64)
+        tree = cKDTree(np.column_stack((points_x, points_y)))
+        neighbors = min(self.neighbors, len(values))
+        distances, indices = tree.query(np.column_stack((grid_x, grid_y)), k=neighbors)
+        distances = distances.reshape(len(grid_x), neighbors)
+        indices = indices.reshape(len(grid_x), neighbors)
+
+        with np.errstate(divide='ignore'):
+            weights = 1.0 / distances**self.power
+        # grid points on top of a survey point take its value
+        exact = np.isinf(weights)
+        weights = np.where(exact.any(axis=1, keepdims=True), exact.astype(np.float64), weights)
+
+        return np.sum(weights * values[indices], axis=1) / np.sum(weights, axis=1)
+
+    def settings(self):
+        return {'name': self.name, 'neighbors': self.neighbors, 'power': self.power}
+
+class GridLinearInterpolation(FingerprintInterpolation):
+    # piecewise linear on the Delaunay triangulation, nearest survey point outside of its hull
+
+    name = 'grid_linear'
+
+    def interpolate(self, points_x, points_y, values, grid_x, grid_y):
+        points = np.column_stack((points_x, points_y))
+        grid = np.column_stack((grid_x, grid_y))
+        values = np.asarray(values, dtype=np.float64)
+
+        if len(values) < 3:
+            return griddata(points, values, grid, method='nearest')
+
+        z = griddata(points, values, grid, method='linear')
+        outside = np.isnan(z)
+        if outside.any():
+            z[outside] = griddata(points, values, grid[outside], method='nearest')
+        return z
+
+INTERPOLATION_BACKENDS = {
+    RbfInterpolation.name: RbfInterpolation,
+    LocalRbfInterpolation.name: LocalRbfInterpolation,
+    IdwInterpolation.name: IdwInterpolation,
+    GridLinearInterpolation.name: GridLinearInterpolation,
+}
+
+def get_interpolation(interpolation):
+    # accepts a backend name or an already configured backend
+    if isinstance(interpolation, FingerprintInterpolation):
+        return interpolation
+    return INTERPOLATION_BACKENDS[interpolation]()
+
+def evaluate_interpolation(interpolation, df_mean, grid_x, grid_y, holdout_fraction=0.2, seed=0):
+    # per monitor: time to generate the full map and the error on held-out survey points
+    interpolation = get_interpolation(interpolation)
+    rng = np.random.default_rng(seed)
+    results = {}
+
+    for monitor_mac in df_mean['monitor_mac'].unique():
+        monitor_rows = df_mean[df_mean['monitor_mac'] == monitor_mac]
+        points_x = monitor_rows['target_position_x'].to_numpy()
+        points_y = monitor_rows['target_position_y'].to_numpy()
+        values = monitor_rows['rssi_median'].to_numpy()
+
+        start = time.perf_counter()
+        interpolation.interpolate(points_x, points_y, values, grid_x, grid_y)
+        map_time = time.perf_counter() - start
+
+        num_holdout = int(round(holdout_fraction * len(values)))
+        rmse = np.nan
+        mae = np.nan
+        if num_holdout > 0 and len(values) - num_holdout >= 3:
+            holdout = np.zeros(len(values), dtype=bool)
+            holdout[rng.choice(len(values), num_holdout, replace=False)] = True
+            predicted = interpolation.interpolate(points_x[~holdout], points_y[~holdout], values[~holdout], points_x[holdout], points_y[holdout])
+            errors = predicted - values[holdout]
+            rmse = float(np.sqrt(np.mean(errors**2)))
+            mae = float(np.mean(np.abs(errors)))
+
+        results[monitor_mac] = {
+            'map_time': map_time,
+            'rmse': rmse,
+            'mae': mae,
+            'num_points': len(values),
+            'num_holdout': num_holdout,
+        }
+
+    return results
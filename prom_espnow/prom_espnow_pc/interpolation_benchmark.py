@@ -0,0 +1,43 @@
+import pandas as pd
+import numpy as np
+from config import *
+from interpolation import *
+from session_format import load_session
+
+# compares the interpolation backends for the fingerprint maps (headless)
+
+current_file = "2024_11_06_22_12_16.pkl"
+filepath = "./fingerprint_maps/" + current_file
+heatmap_resolution = 5.0 # cm
+holdout_fraction = 0.2
+
+backends = [
+    RbfInterpolation(),
+    LocalRbfInterpolation(neighbors=16),
+    LocalRbfInterpolation(neighbors=32),
+    IdwInterpolation(neighbors=8),
+    GridLinearInterpolation(),
+]
+
+df_mean = load_session(filepath).survey_medians()  # the medians FingerprintingLocalization interpolates
+
+background_size = get_scaled_env_background_image().size
+x = np.append(np.arange(0, background_size[0], heatmap_resolution), background_size[0])
+y = np.append(np.arange(0, background_size[1], heatmap_resolution), background_size[1])
+gx, gy = np.meshgrid(x, y)
+gx, gy = gx.flatten(), gy.flatten()
+
+print(f"{len(df_mean)} survey medians, {len(gx)} grid points, holding out {holdout_fraction * 100:.0f}% of the points")
+
+rows = []
+for backend in backends:
+    results = evaluate_interpolation(backend, df_mean, gx, gy, holdout_fraction=holdout_fraction)
+    for monitor_mac, result in results.items():
+        rows.append({'backend': str(backend.settings()), 'monitor_mac': monitor_mac, **result})
+
+df_results = pd.DataFrame(rows)
+print(df_results.to_string(index=False))
+
+df_summary = df_results.groupby('backend', sort=False).agg({'map_time': 'sum', 'rmse': 'mean', 'mae': 'mean'})
+df_summary.columns = ['map_time_total_s', 'rmse_mean_db', 'mae_mean_db']
+print(df_summary.to_string())
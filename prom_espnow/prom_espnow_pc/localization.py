@@ -1,86 +1,198 @@
 from abc import ABC, abstractmethod
+import glob
+import types
 import numpy as np
 import pandas as pd
-from scipy.interpolate import Rbf
+from scipy.spatial import cKDTree
 from util import *
+from fingerprint_search import *
+from fingerprint_cache import *
+from interpolation import *
+from target_state import *
+from path_loss import *
+from session_format import *
+
+def anchor_matrix(anchor_positions, monitor_macs, rssis, mask=None):
+    # batched localize_many() input: rssis is a (n_targets x n_monitors) matrix with the columns in the order of monitor_macs,
+    # mask marks the valid entries (default: all non-NaN)
+    # returns the anchor positions in column order and the mask restricted to monitors with a known position
+    rssis = np.atleast_2d(np.asarray(rssis, dtype=np.float64))
+    if mask is None:
+        mask = ~np.isnan(rssis)
+    mask = np.asarray(mask, dtype=bool)
+    
+    known = np.array([monitor_mac in anchor_positions for monitor_mac in monitor_macs], dtype=bool)
+    positions = np.array([anchor_positions.get(monitor_mac, (0.0, 0.0)) for monitor_mac in monitor_macs], dtype=np.float64).reshape(-1, 2)
+    mask = mask & known[None, :]
+    rssis = np.where(mask, rssis, 0.0)
+    
+    return positions, rssis, mask
 
 class AbstractLocalization(ABC):
 
-    def __init__(self, smooth=True):
-        self.position = np.array((0.0, 0.0))
+    name = None # key of the estimates in the target state store and the plotter
+
+    def __init__(self, smooth=True, state=None):
+        self.position = np.array((0.0, 0.0)) # last estimate, of whichever target was localized last
         self.smooth = smooth
+        self.state = state if state is not None else TargetStateStore() # can be shared by several localizers
 
     @abstractmethod
-    def localize(self, rssis):
+    def localize(self, rssis, target_mac=None):
         pass
     
-    def set_position(self, position):
-        if self.smooth:
-            self.position = 0.99 * self.position + 0.01 * np.array(position)
-        else:
-            self.position = position
+    def set_position(self, position, target_mac=None):
+        # smoothed per target, so the estimates of one target never leak into another;
+        # the unsmoothed fix goes into the fused track of the target
+        target_id = self.state.target_id(target_mac)
+        self.position = self.state.set_estimates(self.name, [target_id], [position], self.smooth)[0]
+        if target_mac is not None:
+            self.state.update_track(target_id, position)
         return self.position
+    
+    def set_positions(self, target_macs, positions):
+        # batched set_position() for localize_many(), without targets the raw estimates are returned
+        if target_macs is None:
+            return positions
+        target_ids = self.state.target_ids(target_macs)
+        self.state.update_tracks(target_ids, positions)
+        return self.state.set_estimates(self.name, target_ids, positions, self.smooth)
+    
+    def plots(self, target_mac):
+        return self.plotter is not None and self.plotter.tracked_target in (None, target_mac)
 
 class TrilaterationLeastSquaresLocalization(AbstractLocalization):
-    def __init__(self, anchor_positions, smooth=True, plotter=None):
-        super().__init__(smooth)
+    name = "tri_ls"
+    
+    def __init__(self, anchor_positions, smooth=True, plotter=None, state=None, path_loss=None):
+        super().__init__(smooth, state)
         
+        self.path_loss = path_loss if path_loss is not None else PathLossRegistry()
         self.anchor_positions = anchor_positions
         self.plotter = plotter
     
-    def localize(self, rssis):
-        monitor_macs_intersec = self.anchor_positions.keys() & rssis.keys()
-        anchor_positions_intersec = [self.anchor_positions[monitor_mac] for monitor_mac in monitor_macs_intersec]
-        rssis_intersec = [rssis[monitor_mac] for monitor_mac in monitor_macs_intersec]
-        
-        positions = anchor_positions_intersec
-        distances = [inverse_path_loss_model(rssi) * 100.0 for rssi in rssis_intersec] # m to cm
-        
-        
-        # Number of known positions
-        n = len(positions)
+    @property
+    def anchor_positions(self):
+        # read only, anchors change through the setter or set_anchor_position() so that the derived arrays follow
+        return types.MappingProxyType(self._anchor_positions)
+    
+    @anchor_positions.setter
+    def anchor_positions(self, anchor_positions):
+        # the cached solvers only depend on the anchors, so (re)loading them drops the cache
+        self._anchor_positions = dict(anchor_positions)
+        self.anchor_macs = list(self._anchor_positions.keys())
+        self.anchor_indices = {monitor_mac: idx for idx, monitor_mac in enumerate(self.anchor_macs)}
+        self.anchor_array = np.array([self._anchor_positions[monitor_mac] for monitor_mac in self.anchor_macs], dtype=np.float64).reshape(-1, 2)
+        self.anchor_rows_key = None
+        self.solver_cache = {}
+    
+    @property
+    def anchor_rows(self):
+        # table rows of the anchors, looked up again once the registry got a model for a new monitor
+        key = (self.path_loss, self.path_loss.version)
+        if self.anchor_rows_key != key:
+            self._anchor_rows = self.path_loss.rows(self.anchor_macs)
+            self.anchor_rows_key = key
+        return self._anchor_rows
+    
+    def set_anchor_position(self, monitor_mac, position):
+        anchor_positions = dict(self.anchor_positions)
+        anchor_positions[monitor_mac] = position
+        self.anchor_positions = anchor_positions
+    
+    def get_solver(self, visible_mask):
+        # visible_mask: bitmask over self.anchor_macs, the last visible anchor is the reference
+        solver = self.solver_cache.get(visible_mask)
+        if solver is None:
+            indices = np.array([idx for idx in range(len(self.anchor_macs)) if visible_mask >> idx & 1], dtype=np.intp)
+            positions = self.anchor_array[indices]
+            
+            if len(indices) < 2:
+                pinv = np.zeros((2, 0))
+                b_const = np.zeros(0)
+                solvable = False
+            else:
+                reference = positions[-1]
+                A = 2.0 * (positions[:-1] - reference)
+                b_const = np.sum(positions[:-1]**2, axis=1) - np.sum(reference**2)
+                pinv = np.linalg.pinv(A)
+                solvable = np.linalg.matrix_rank(A) == 2
+            
+            solver = (indices, pinv, b_const, solvable)
+            self.solver_cache[visible_mask] = solver
+        return solver
+    
+    def localize(self, rssis, target_mac=None):
+        visible_mask = 0
+        for monitor_mac in rssis.keys():
+            idx = self.anchor_indices.get(monitor_mac)
+            if idx is not None:
+                visible_mask |= 1 << idx
+        indices, pinv, b_const, solvable = self.get_solver(visible_mask)
+        if not solvable:
+            return self.position # fewer than 3 (non collinear) anchors visible, like localize_many() no fix
         
-        # Build the A matrix and b vector
-        A = []
-        b = []
+        positions = [self.anchor_positions[self.anchor_macs[idx]] for idx in indices]
+        distances = self.path_loss.distances(self.anchor_rows[indices], [rssis[self.anchor_macs[idx]] for idx in indices]) * 100.0 # m to cm
         
-        x_n, y_n = positions[n-1]
-        d_n = distances[n-1]
-        for i in range(n - 1):
-            x_i, y_i = positions[i]
-            d_i = distances[i]
-            A.append([2*(x_i - x_n), 2*(y_i - y_n)])
-            b.append(x_i**2 + y_i**2 - x_n**2 - y_n**2 - d_i**2 + d_n**2)
-        A = np.array(A)
-        b = np.array(b)
-
-        # Compute the least squares solution using the normal equation: x = (A^T A)^(-1) A^T b
-        x, residuals, rank, s = np.linalg.lstsq(A, b, rcond=None)
+        # b_i = x_i^2 + y_i^2 - x_n^2 - y_n^2 - d_i^2 + d_n^2, the positions part is cached with the pseudo-inverse of A
+        b = b_const - distances[:-1]**2 + distances[-1]**2
+        x = pinv @ b
         
-        super().set_position(x)
+        super().set_position(x, target_mac)
         
-        if self.plotter is not None:
+        if self.plots(target_mac):
             self.plotter.target_estimation["tri_ls"] = self.position
             self.plotter.anchor_positions = positions
-            self.plotter.anchor_distances = distances
+            self.plotter.anchor_distances = list(distances)
             self.plotter.new_data_available = True
         
         return self.position
+    
+    def localize_many(self, monitor_macs, rssis, mask=None, target_macs=None):
+        _, rssis, mask = anchor_matrix(self.anchor_positions, monitor_macs, rssis, mask)
+        
+        # reorder the columns to the anchor order of the cached solvers
+        columns = np.full(len(self.anchor_macs), -1, dtype=np.intp)
+        for column, monitor_mac in enumerate(monitor_macs):
+            if monitor_mac in self.anchor_indices:
+                columns[self.anchor_indices[monitor_mac]] = column
+        present = columns >= 0
+        anchor_mask = np.zeros((rssis.shape[0], len(self.anchor_macs)), dtype=bool)
+        anchor_mask[:, present] = mask[:, columns[present]]
+        distances = np.zeros(anchor_mask.shape)
+        distances[:, present] = self.path_loss.distances(self.anchor_rows[present], rssis[:, columns[present]]) * 100.0 # m to cm
+        
+        # one matrix product per group of targets that see the same anchors
+        visible_masks = anchor_mask.astype(np.int64) @ (1 << np.arange(len(self.anchor_macs), dtype=np.int64))
+        positions = np.full((rssis.shape[0], 2), np.nan)
+        for visible_mask in np.unique(visible_masks):
+            indices, pinv, b_const, solvable = self.get_solver(int(visible_mask))
+            if not solvable:
+                continue
+            rows = np.flatnonzero(visible_masks == visible_mask)
+            group_distances = distances[rows][:, indices]
+            b = b_const[None, :] - group_distances[:, :-1]**2 + group_distances[:, -1:]**2
+            positions[rows] = b @ pinv.T
+        return self.set_positions(target_macs, positions)
 
 class TrilaterationWeightedCentroidLocalization(AbstractLocalization):
-    def __init__(self, anchor_positions, smooth=True, plotter=None):
-        super().__init__(smooth)
+    name = "tri_wcl"
+    
+    def __init__(self, anchor_positions, smooth=True, plotter=None, state=None, path_loss=None):
+        super().__init__(smooth, state)
         
+        self.path_loss = path_loss if path_loss is not None else PathLossRegistry()
         self.anchor_positions = anchor_positions
         self.plotter = plotter
     
-    def localize(self, rssis):
+    def localize(self, rssis, target_mac=None):
         monitor_macs_intersec = self.anchor_positions.keys() & rssis.keys()
         anchor_positions_intersec = [self.anchor_positions[monitor_mac] for monitor_mac in monitor_macs_intersec]
         rssis_intersec = [rssis[monitor_mac] for monitor_mac in monitor_macs_intersec]
         
         positions = anchor_positions_intersec
-        distances = [inverse_path_loss_model(rssi) * 100.0 for rssi in rssis_intersec] # m to cm
+        distances = list(self.path_loss.distances(self.path_loss.rows(monitor_macs_intersec), rssis_intersec) * 100.0) # m to cm
         
         positions_np = np.array(positions)
         distances_np = np.array(distances)
@@ -95,71 +207,483 @@ class TrilaterationWeightedCentroidLocalization(AbstractLocalization):
         x = np.sum([w * pos[0] for w, pos in zip(weights, positions_np)])
         y = np.sum([w * pos[1] for w, pos in zip(weights, positions_np)])
         
-        super().set_position((x, y))
+        super().set_position((x, y), target_mac)
         
-        if self.plotter is not None:
+        if self.plots(target_mac):
             self.plotter.target_estimation["tri_wcl"] = self.position
             self.plotter.anchor_positions = positions
             self.plotter.anchor_distances = distances
             self.plotter.new_data_available = True
         
         return self.position
+    
+    def localize_many(self, monitor_macs, rssis, mask=None, target_macs=None):
+        anchor_positions, rssis, mask = anchor_matrix(self.anchor_positions, monitor_macs, rssis, mask)
+        distances = self.path_loss.distances(self.path_loss.rows(monitor_macs), rssis) * 100.0 # m to cm
+        
+        weights = np.where(mask, 1.0 / distances, 0.0)
+        weight_sums = np.sum(weights, axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            positions = (weights @ anchor_positions) / weight_sums
+        return self.set_positions(target_macs, positions)
+
+DEFAULT_GN_ITERATIONS = 5
+DEFAULT_GN_TOLERANCE = 1.0      # cm, stop once no target moves further in one iteration
+DEFAULT_GN_MAX_STEP_HALVINGS = 4
+DEFAULT_SHADOWING_STD = 4.0     # dB, log-normal shadowing of the RSSI around the path loss model
+
+class GaussNewtonMultilaterationLocalization(AbstractLocalization):
+    name = "gn"
+    start_key = "gn_start"
+    
+    # nonlinear weighted least squares on the range residuals |p - a_i| - d_i,
+    # warm started from the previous estimate of the target (weighted centroid for new targets)
+    def __init__(self, anchor_positions, smooth=True, plotter=None, num_iterations=DEFAULT_GN_ITERATIONS, tolerance=DEFAULT_GN_TOLERANCE, shadowing_std=DEFAULT_SHADOWING_STD, state=None, path_loss=None):
+        super().__init__(smooth, state)
+        
+        self.path_loss = path_loss if path_loss is not None else PathLossRegistry()
+        self.anchor_positions = anchor_positions
+        self.plotter = plotter
+        self.num_iterations = num_iterations
+        self.tolerance = tolerance
+        self.shadowing_std = shadowing_std
+    
+    def distance_weights(self, rows, rssis):
+        # a shadowing std of sigma dB gives std(d) = sigma * |dd/drssi| of the monitor's model (d * ln(10) * sigma / (10 n) for the log model)
+        distance_std = self.path_loss.distance_stds(rows, rssis, self.shadowing_std) * 100.0 # m to cm
+        return 1.0 / np.maximum(distance_std, 1e-6)**2
+    
+    def costs(self, anchor_positions, distances, weights, positions):
+        ranges = np.linalg.norm(positions[:, None, :] - anchor_positions[None, :, :], axis=2)
+        return np.sum(weights * (ranges - distances)**2, axis=1)
+    
+    def solve(self, anchor_positions, distances, weights, initial_positions):
+        # anchor_positions: (m x 2), distances/weights: (n x m) with zero weights for invisible anchors, initial_positions: (n x 2)
+        positions = np.array(initial_positions, dtype=np.float64)
+        active = np.flatnonzero(np.ones(len(positions), dtype=bool))
+        
+        for _ in range(self.num_iterations):
+            p = positions[active]
+            d = distances[active]
+            w = weights[active]
+            
+            offsets = p[:, None, :] - anchor_positions[None, :, :]
+            ranges = np.maximum(np.linalg.norm(offsets, axis=2), 1e-6)
+            J = offsets / ranges[:, :, None]
+            residuals = ranges - d
+            
+            JTWJ = np.einsum('nm,nmi,nmj->nij', w, J, J)
+            JTWr = np.einsum('nm,nmi,nm->ni', w, J, residuals)
+            # a little damping keeps the normal equations solvable on top of an anchor or with collinear anchors
+            JTWJ += 1e-9 * np.trace(JTWJ, axis1=1, axis2=2)[:, None, None] * np.eye(2)
+            steps = np.linalg.solve(JTWJ, -JTWr[:, :, None])[:, :, 0]
+            
+            # halve the steps that increase the cost, far from the optimum a full step can overshoot
+            costs = np.sum(w * residuals**2, axis=1)
+            scale = np.ones(len(active))
+            for _ in range(DEFAULT_GN_MAX_STEP_HALVINGS):
+                worse = self.costs(anchor_positions, d, w, p + scale[:, None] * steps) > costs
+                if not worse.any():
+                    break
+                scale[worse] *= 0.5
+            else:
+                scale[self.costs(anchor_positions, d, w, p + scale[:, None] * steps) > costs] = 0.0
+            steps *= scale[:, None]
+            
+            positions[active] = p + steps
+            active = active[np.linalg.norm(steps, axis=1) >= self.tolerance]
+            if len(active) == 0:
+                break
+        
+        return positions
+    
+    def localize(self, rssis, target_mac=None):
+        monitor_macs = [monitor_mac for monitor_mac in rssis.keys() if monitor_mac in self.anchor_positions]
+        if len(monitor_macs) < 3:
+            return self.position
+        
+        positions = np.array([self.anchor_positions[monitor_mac] for monitor_mac in monitor_macs], dtype=np.float64)
+        rows = self.path_loss.rows(monitor_macs)
+        monitor_rssis = [rssis[monitor_mac] for monitor_mac in monitor_macs]
+        distances = self.path_loss.distances(rows, monitor_rssis) * 100.0 # m to cm
+        weights = self.distance_weights(rows, monitor_rssis)
+        
+        # the last unsmoothed estimate of the target is the start of the next solve,
+        # without a target there is nothing to continue from (like localize_many() without target_macs)
+        initial_position = np.full(2, np.nan)
+        if target_mac is not None:
+            target_id = self.state.target_id(target_mac)
+            initial_position = self.state.estimate_array(self.start_key)[target_id]
+        if np.isnan(initial_position).any():
+            initial_position = (1.0 / distances) @ positions / np.sum(1.0 / distances)
+        x = self.solve(positions, distances[None, :], weights[None, :], np.array(initial_position)[None, :])[0]
+        if target_mac is not None:
+            self.state.set_estimates(self.start_key, [target_id], [x], smooth=False)
+        
+        super().set_position(x, target_mac)
+        
+        if self.plots(target_mac):
+            self.plotter.target_estimation["gn"] = self.position
+            self.plotter.anchor_positions = list(positions)
+            self.plotter.anchor_distances = list(distances)
+            self.plotter.new_data_available = True
+        
+        return self.position
+    
+    def localize_many(self, monitor_macs, rssis, mask=None, target_macs=None):
+        anchor_positions, rssis, mask = anchor_matrix(self.anchor_positions, monitor_macs, rssis, mask)
+        rows = self.path_loss.rows(monitor_macs)
+        distances = self.path_loss.distances(rows, rssis) * 100.0 # m to cm
+        weights = np.where(mask, self.distance_weights(rows, rssis), 0.0)
+        solvable = np.sum(mask, axis=1) >= 3
+        
+        # weighted centroid for targets without a previous estimate
+        initial_positions = np.zeros((rssis.shape[0], 2))
+        centroid_weights = np.where(mask, 1.0 / distances, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            initial_positions[solvable] = (centroid_weights[solvable] @ anchor_positions) / np.sum(centroid_weights[solvable], axis=1, keepdims=True)
+        if target_macs is not None:
+            target_ids = self.state.target_ids(target_macs)
+            starts = self.state.estimate_array(self.start_key)[target_ids]
+            warm = ~np.isnan(starts).any(axis=1)
+            initial_positions[warm] = starts[warm]
+        
+        positions = np.full((rssis.shape[0], 2), np.nan)
+        positions[solvable] = self.solve(anchor_positions, distances[solvable], weights[solvable], initial_positions[solvable])
+        
+        if target_macs is not None:
+            # a target that briefly sees too few monitors keeps its warm start
+            self.state.set_estimates(self.start_key, target_ids[solvable], positions[solvable], smooth=False)
+        return self.set_positions(target_macs, positions)
+
+DEFAULT_CHUNK_CELLS = 16384 # grid cells per block of the streaming distance computation
 
 class FingerprintingLocalization(AbstractLocalization):
-    def __init__(self, fingerprints_file_path, background_size, heatmap_resolution=5.0, smooth=True, plotter=None): # every 5cm
-        super().__init__(smooth)
+    name = "fp"
+    
+    def __init__(self, fingerprints_file_path, background_size, heatmap_resolution=5.0, smooth=True, plotter=None, search_mode=None, cache_dir=DEFAULT_FINGERPRINT_CACHE_DIR, interpolation='rbf', quantize=False, state=None): # every 5cm
+        super().__init__(smooth, state)
         
         self.plotter = plotter
+        self.search_mode = search_mode # None: full grid, SEARCH_EXACT / SEARCH_APPROXIMATE: coarse-to-fine
+        self.interpolation = get_interpolation(interpolation)
+        
+        # the interpolated maps only depend on the survey and these settings, so they are cached on disk (cache_dir=None disables it)
+        cache = FingerprintMapCache(cache_dir) if cache_dir is not None else None
+        cache_key = None
+        cached = None
+        if cache is not None:
+            cache_key = fingerprint_cache_key(fingerprints_file_path, background_size=tuple(background_size), heatmap_resolution=heatmap_resolution, interpolation=self.interpolation.settings())
+            cached = cache.load(cache_key)
         
+        if cached is not None:
+            monitor_macs, fingerprints, self.pos_lookup_x, self.pos_lookup_y, self.fingerprint_medians = cached
+        else:
+            monitor_macs, fingerprints = self.generate_interpolated_fingerprints(fingerprints_file_path, background_size, heatmap_resolution)
+            if cache is not None:
+                cache.save(cache_key, monitor_macs, fingerprints, self.pos_lookup_x, self.pos_lookup_y, self.fingerprint_medians)
+        
+        num_x = len(self.pos_lookup_x)
+        num_y = len(self.pos_lookup_y)
+        self.interpolated_fingerprints_shape = (num_y, num_x)
+        self.monitor_macs = list(monitor_macs)
+        self.monitor_indices = {monitor_mac: idx for idx, monitor_mac in enumerate(self.monitor_macs)}
+        
+        # all maps in one (cells x monitors) tensor, float32 or int8 with a linear scale: value = scale * q + offset
+        self.fingerprint_scale = np.float32(1.0)
+        self.fingerprint_offset = np.float32(0.0)
+        if quantize:
+            low = float(np.min(fingerprints))
+            high = float(np.max(fingerprints))
+            self.fingerprint_scale = np.float32(max(high - low, 1e-6) / 254.0)
+            self.fingerprint_offset = np.float32((high + low) / 2.0)
+            self.fingerprints = np.rint((fingerprints - self.fingerprint_offset) / self.fingerprint_scale).astype(np.int8)
+        else:
+            self.fingerprints = fingerprints
+        
+        self.search = None
+        if search_mode is not None:
+            # the pyramid works in the stored units, the queries are transformed instead of the maps
+            self.search = FingerprintPyramidSearch(self.fingerprints.reshape(num_y, num_x, len(self.monitor_macs)))
+    
+    def generate_interpolated_fingerprints(self, fingerprints_file_path, background_size, heatmap_resolution):
         x = np.arange(0, background_size[0], heatmap_resolution)
         y = np.arange(0, background_size[1], heatmap_resolution)
         self.pos_lookup_x = np.append(x, background_size[0]) # include boundary
         self.pos_lookup_y = np.append(y, background_size[1])
-        num_x = len(self.pos_lookup_x)
-        num_y = len(self.pos_lookup_y)
             
         gx, gy = np.meshgrid(self.pos_lookup_x, self.pos_lookup_y)
         gx, gy = gx.flatten(), gy.flatten()
         
         
-        df = pd.read_csv(fingerprints_file_path, index_col=False)
-        df_mean = df.groupby(['monitor_mac', 'target_position_x', 'target_position_y', 'anchor_position_x', 'anchor_position_y'], as_index=False).agg({'rssi':['median']})
-        df_mean.columns = ['monitor_mac', 'target_position_x', 'target_position_y', 'anchor_position_x', 'anchor_position_y', 'rssi_median']
+        df_mean = load_session(fingerprints_file_path).survey_medians()
+        self.fingerprint_medians = df_mean
         
-        def generate_interpolated_fingerprint_map(monitor_mac):
+        monitor_macs = list(df_mean['monitor_mac'].unique())
+        fingerprints = np.empty((len(gx), len(monitor_macs)), dtype=np.float32)
+        
+        for idx, monitor_mac in enumerate(monitor_macs):
             monitor_rows = df_mean[df_mean['monitor_mac'] == monitor_mac]
             
             target_positions_x = monitor_rows['target_position_x'].to_list()
             target_positions_y = monitor_rows['target_position_y'].to_list()
             rssi_medians = monitor_rows['rssi_median'].to_list()
             
-            
-            # from https://github.com/jantman/python-wifi-survey-heatmap/blob/master/wifi_survey_heatmap/heatmap.py
-            
-            rbf = Rbf(target_positions_x, target_positions_y, rssi_medians, function='linear')
-            z = rbf(gx, gy)
-            z = z.reshape((num_y, num_x))
-            
-            return z
+            fingerprints[:, idx] = self.interpolation.interpolate(target_positions_x, target_positions_y, rssi_medians, gx, gy)
         
-        monitor_macs = df_mean['monitor_mac'].unique()
-        self.interpolated_fingerprints = {monitor_mac: generate_interpolated_fingerprint_map(monitor_mac) for monitor_mac in monitor_macs}
+        return monitor_macs, fingerprints
+    
+    def fingerprint_map(self, monitor_mac):
+        # (num_y x num_x) map of one monitor in dBm, a strided view unless the tensor is quantized
+        values = self.fingerprints[:, self.monitor_indices[monitor_mac]]
+        if self.fingerprints.dtype == np.int8:
+            values = values.astype(np.float32) * self.fingerprint_scale + self.fingerprint_offset
+        return values.reshape(self.interpolated_fingerprints_shape)
+    
+    @property
+    def interpolated_fingerprints(self):
+        return {monitor_mac: self.fingerprint_map(monitor_mac) for monitor_mac in self.monitor_macs}
     
-    def localize(self, rssis):
-        monitor_macs_intersection = self.interpolated_fingerprints.keys() & rssis.keys()
-        interpolated_fingerprints_intersection = np.array([self.interpolated_fingerprints[monitor_mac] for monitor_mac in monitor_macs_intersection])
-        rssis_intersection = np.array([rssis[monitor_mac] for monitor_mac in monitor_macs_intersection])
+    def query_vectors(self, rssis):
+        # the query in the stored units and the mask of the monitors it contains, both over all monitors of the tensor
+        query = np.zeros(len(self.monitor_macs), dtype=np.float32)
+        mask = np.zeros(len(self.monitor_macs), dtype=np.float32)
+        for monitor_mac, rssi in rssis.items():
+            idx = self.monitor_indices.get(monitor_mac)
+            if idx is not None:
+                query[idx] = (rssi - self.fingerprint_offset) / self.fingerprint_scale
+                mask[idx] = 1.0
+        return query, mask
+    
+    def squared_distances(self, query, mask, start=0, stop=None):
+        # masked columns contribute nothing, so no monitor subset of the grid is ever gathered
+        diff = self.fingerprints[start:stop].astype(np.float32, copy=False) - query
+        return (diff * diff) @ mask
+    
+    def nearest_cell(self, query, mask, chunk_cells=DEFAULT_CHUNK_CELLS):
+        # streaming argmin over blocks of cells, the full distance array is never materialized
+        best_cell = 0
+        best_distance = np.inf
+        for start in range(0, len(self.fingerprints), chunk_cells):
+            distances = self.squared_distances(query, mask, start, start + chunk_cells)
+            cell = int(np.argmin(distances))
+            if distances[cell] < best_distance:
+                best_cell = start + cell
+                best_distance = distances[cell]
+        return best_cell, best_distance
+    
+    def localize(self, rssis, target_mac=None):
+        if self.search is not None:
+            return self.localize_pyramid(rssis, target_mac)
         
-        diff = np.moveaxis(interpolated_fingerprints_intersection, 0, -1) - rssis_intersection        
-        norm = np.linalg.norm(diff, axis=2)
-        min_pos_heatmap = np.unravel_index(np.argmin(norm, axis=None), norm.shape)        
-        min_pos = (self.pos_lookup_x[min_pos_heatmap[1]], self.pos_lookup_y[min_pos_heatmap[0]])
+        query, mask = self.query_vectors(rssis)
+        if self.plots(target_mac):
+            # the plot needs every distance anyway
+            norm = np.sqrt(self.squared_distances(query, mask)).reshape(self.interpolated_fingerprints_shape) * self.fingerprint_scale
+            cell = int(np.argmin(norm))
+        else:
+            cell, _ = self.nearest_cell(query, mask)
+        (min_y, min_x) = np.unravel_index(cell, self.interpolated_fingerprints_shape)
+        min_pos = (self.pos_lookup_x[min_x], self.pos_lookup_y[min_y])
         
-        super().set_position(min_pos)
+        super().set_position(min_pos, target_mac)
         
-        if self.plotter is not None:
+        if self.plots(target_mac):
             self.plotter.heatmap = norm
             self.plotter.target_estimation["fp"] = self.position
             self.plotter.new_data_available = True
         
-        return self.position
\ No newline at end of file
+        return self.position
+    
+    def localize_pyramid(self, rssis, target_mac=None):
+        monitor_macs_intersection = [monitor_mac for monitor_mac in rssis.keys() if monitor_mac in self.monitor_indices]
+        monitor_indices = [self.monitor_indices[monitor_mac] for monitor_mac in monitor_macs_intersection]
+        rssis_intersection = [(rssis[monitor_mac] - self.fingerprint_offset) / self.fingerprint_scale for monitor_mac in monitor_macs_intersection]
+        
+        (min_y, min_x), _ = self.search.search(rssis_intersection, monitor_indices, self.search_mode)
+        min_pos = (self.pos_lookup_x[min_x], self.pos_lookup_y[min_y])
+        
+        super().set_position(min_pos, target_mac)
+        
+        # there is no full heatmap in this mode
+        if self.plots(target_mac):
+            self.plotter.target_estimation["fp"] = self.position
+            self.plotter.new_data_available = True
+        
+        return self.position
+    
+    def localize_many(self, monitor_macs, rssis, mask=None, chunk_size=64, chunk_cells=DEFAULT_CHUNK_CELLS, target_macs=None):
+        rssis = np.atleast_2d(np.asarray(rssis, dtype=np.float64))
+        if mask is None:
+            mask = ~np.isnan(rssis)
+        mask = np.asarray(mask, dtype=bool)
+        
+        # reorder the columns to the monitor order of the tensor, only monitors with a fingerprint map take part
+        queries = np.zeros((rssis.shape[0], len(self.monitor_macs)), dtype=np.float32)
+        masks = np.zeros(queries.shape, dtype=np.float32)
+        for column, monitor_mac in enumerate(monitor_macs):
+            idx = self.monitor_indices.get(monitor_mac)
+            if idx is not None:
+                masks[:, idx] = mask[:, column]
+                queries[:, idx] = np.where(mask[:, column], (rssis[:, column] - self.fingerprint_offset) / self.fingerprint_scale, 0.0)
+        
+        # sum over the visible monitors of (f - r)^2 = f^2 . m - 2 f . (m * r) + (m * r) . r,
+        # reduced block by block over the cells with a running minimum per target
+        positions = np.full((rssis.shape[0], 2), np.nan)
+        for start in range(0, rssis.shape[0], chunk_size):
+            chunk_mask = masks[start:start + chunk_size]
+            chunk_queries = queries[start:start + chunk_size]
+            query_norms = np.sum(chunk_queries**2, axis=1)
+            best_cells = np.zeros(len(chunk_mask), dtype=np.intp)
+            best_distances = np.full(len(chunk_mask), np.inf, dtype=np.float32)
+            
+            for cell_start in range(0, len(self.fingerprints), chunk_cells):
+                fingerprints = self.fingerprints[cell_start:cell_start + chunk_cells].astype(np.float32, copy=False)
+                sq_norms = (fingerprints**2) @ chunk_mask.T - 2.0 * fingerprints @ chunk_queries.T + query_norms[None, :]
+                cells = np.argmin(sq_norms, axis=0)
+                distances = sq_norms[cells, np.arange(len(cells))]
+                better = distances < best_distances
+                best_cells[better] = cell_start + cells[better]
+                best_distances[better] = distances[better]
+            
+            (cell_y, cell_x) = np.unravel_index(best_cells, self.interpolated_fingerprints_shape)
+            positions[start:start + chunk_size, 0] = self.pos_lookup_x[cell_x]
+            positions[start:start + chunk_size, 1] = self.pos_lookup_y[cell_y]
+        
+        positions[~masks.any(axis=1)] = np.nan
+        return self.set_positions(target_macs, positions)
+
+
+DEFAULT_WKNN_NEIGHBORS = 3
+DEFAULT_WKNN_SURVEYS = "./fingerprint_maps/*.csv"
+DEFAULT_WKNN_MIN_COMMON_MONITORS = 2 # survey points that share fewer monitors with the query are not candidates
+
+def survey_file_paths(fingerprints_file_paths):
+    # a glob pattern, a single file or a list of them
+    if isinstance(fingerprints_file_paths, str):
+        fingerprints_file_paths = [fingerprints_file_paths]
+    file_paths = []
+    for pattern in fingerprints_file_paths:
+        file_paths += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    if not file_paths:
+        raise ValueError("No survey files: " + str(fingerprints_file_paths))
+    return file_paths
+
+class WKNNFingerprintingLocalization(AbstractLocalization):
+    name = "wknn"
+    
+    # weighted k nearest neighbors in RSSI space over the survey points of all surveys, without interpolated grid;
+    # the distance only covers the monitors both the query and the survey point have, as root mean square over them
+    # so that survey points with fewer monitors are not closer just because fewer terms are summed
+    def __init__(self, fingerprints_file_paths=DEFAULT_WKNN_SURVEYS, k=DEFAULT_WKNN_NEIGHBORS, smooth=True, plotter=None, min_common_monitors=DEFAULT_WKNN_MIN_COMMON_MONITORS, state=None):
+        super().__init__(smooth, state)
+        
+        self.k = k
+        self.plotter = plotter
+        self.min_common_monitors = min_common_monitors
+        
+        self.file_paths = survey_file_paths(fingerprints_file_paths)
+        df_mean = pd.concat([load_session(file_path).survey_medians().assign(survey=idx) for idx, file_path in enumerate(self.file_paths)], ignore_index=True)
+        
+        # one row per survey point (of every survey), one column per monitor, NaN where the point has no median of the monitor
+        df_pivot = df_mean.pivot_table(index=['survey', 'target_position_x', 'target_position_y'], columns='monitor_mac', values='rssi_median', aggfunc='median')
+        self.monitor_macs = list(df_pivot.columns)
+        self.monitor_indices = {monitor_mac: idx for idx, monitor_mac in enumerate(self.monitor_macs)}
+        self.survey_positions = df_pivot.index.to_frame()[['target_position_x', 'target_position_y']].to_numpy(dtype=np.float64)
+        self.survey_fingerprints = df_pivot.to_numpy(dtype=np.float64, na_value=np.nan)
+        
+        # survey points grouped by the monitors they have
+        available = ~np.isnan(self.survey_fingerprints)
+        point_masks = available.astype(np.int64) @ (1 << np.arange(len(self.monitor_macs), dtype=np.int64))
+        self.survey_groups = {int(point_mask): np.flatnonzero(point_masks == point_mask) for point_mask in np.unique(point_masks)}
+        
+        self.trees = {} # visible monitor bitmask -> [(common columns, survey rows, k-d tree over those columns)]
+    
+    def get_trees(self, visible_mask):
+        # one tree per group of survey points, over the monitors the group has in common with the query
+        trees = self.trees.get(visible_mask)
+        if trees is None:
+            min_common = min(self.min_common_monitors, bin(visible_mask).count('1'))
+            trees = []
+            for point_mask, rows in self.survey_groups.items():
+                columns = np.array([idx for idx in range(len(self.monitor_macs)) if (visible_mask & point_mask) >> idx & 1], dtype=np.intp)
+                if len(columns) == 0 or len(columns) < min_common:
+                    continue
+                trees.append((columns, rows, cKDTree(self.survey_fingerprints[np.ix_(rows, columns)])))
+            self.trees[visible_mask] = trees
+        return trees
+    
+    def query(self, visible_mask, rssis):
+        # rssis: (n x monitors) in the column order of the survey, only the visible columns are read
+        trees = self.get_trees(visible_mask)
+        if not trees:
+            return np.full((len(rssis), 2), np.nan)
+        
+        # the k nearest of every group, then the k nearest of those
+        candidate_distances = []
+        candidate_rows = []
+        for columns, rows, tree in trees:
+            k = min(self.k, len(rows))
+            distances, indices = tree.query(rssis[:, columns], k=k)
+            candidate_distances.append(distances.reshape(len(rssis), k) / np.sqrt(len(columns)))
+            candidate_rows.append(rows[indices.reshape(len(rssis), k)])
+        distances = np.concatenate(candidate_distances, axis=1)
+        rows = np.concatenate(candidate_rows, axis=1)
+        
+        k = min(self.k, distances.shape[1])
+        nearest = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        distances = np.take_along_axis(distances, nearest, axis=1)
+        rows = np.take_along_axis(rows, nearest, axis=1)
+        
+        weights = 1.0 / np.maximum(distances, 1e-6)
+        weights /= np.sum(weights, axis=1, keepdims=True)
+        return np.einsum('nk,nkd->nd', weights, self.survey_positions[rows])
+    
+    def localize(self, rssis, target_mac=None):
+        visible_mask = 0
+        query_rssis = np.zeros((1, len(self.monitor_macs)))
+        for monitor_mac, rssi in rssis.items():
+            idx = self.monitor_indices.get(monitor_mac)
+            if idx is not None:
+                visible_mask |= 1 << idx
+                query_rssis[0, idx] = rssi
+        
+        position = self.query(visible_mask, query_rssis)[0] if visible_mask != 0 else None
+        if position is None or np.isnan(position).any():
+            return self.position # no survey point shares enough monitors with the query
+        
+        super().set_position(position, target_mac)
+        
+        if self.plots(target_mac):
+            self.plotter.target_estimation["wknn"] = self.position
+            self.plotter.new_data_available = True
+        
+        return self.position
+    
+    def localize_many(self, monitor_macs, rssis, mask=None, target_macs=None):
+        rssis = np.atleast_2d(np.asarray(rssis, dtype=np.float64))
+        if mask is None:
+            mask = ~np.isnan(rssis)
+        mask = np.asarray(mask, dtype=bool)
+        
+        # reorder the columns to the monitor order of the survey
+        columns = np.full(len(self.monitor_macs), -1, dtype=np.intp)
+        for column, monitor_mac in enumerate(monitor_macs):
+            if monitor_mac in self.monitor_indices:
+                columns[self.monitor_indices[monitor_mac]] = column
+        present = columns >= 0
+        survey_mask = np.zeros((rssis.shape[0], len(self.monitor_macs)), dtype=bool)
+        survey_mask[:, present] = mask[:, columns[present]]
+        survey_rssis = np.zeros(survey_mask.shape)
+        survey_rssis[:, present] = rssis[:, columns[present]]
+        survey_rssis[~survey_mask] = 0.0
+        
+        # one batched query per group of targets that see the same monitors
+        visible_masks = survey_mask.astype(np.int64) @ (1 << np.arange(len(self.monitor_macs), dtype=np.int64))
+        positions = np.full((rssis.shape[0], 2), np.nan)
+        for visible_mask in np.unique(visible_masks):
+            if visible_mask == 0:
+                continue
+            rows = np.flatnonzero(visible_masks == visible_mask)
+            positions[rows] = self.query(int(visible_mask), survey_rssis[rows])
+        return self.set_positions(target_macs, positions)
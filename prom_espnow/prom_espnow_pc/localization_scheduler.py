@@ -0,0 +1,94 @@
+from collections import defaultdict
+from aggregation import DEFAULT_AGGREGATION_MAX_AGE
+
+DEFAULT_MIN_MONITORS = 4
+DEFAULT_MIN_FRESH_MONITORS = 1
+DEFAULT_MIN_LOCALIZATION_INTERVAL = 0.1  # localize every target at most every 100ms
+
+
+class LocalizationScheduler:
+
+    def __init__(
+            self,
+            min_monitors=DEFAULT_MIN_MONITORS,
+            min_fresh_monitors=DEFAULT_MIN_FRESH_MONITORS,
+            min_localization_interval=DEFAULT_MIN_LOCALIZATION_INTERVAL,
+            max_age=DEFAULT_AGGREGATION_MAX_AGE
+        ):
+        self.min_monitors = min_monitors
+        self.min_fresh_monitors = min_fresh_monitors
+        self.min_localization_interval = min_localization_interval
+        self.max_age = max_age  # cached RSSIs of monitors without packets for longer are dropped, None keeps them
+
+        self.dirty = defaultdict(set)         # target mac -> monitor macs with packets since the last localization
+        self.waiting = {}                     # same for targets seen by too few monitors, not scanned until a packet completes them
+        self.rssis = defaultdict(dict)        # target mac -> monitor mac -> last aggregated rssi
+        self.updated = defaultdict(dict)      # target mac -> monitor mac -> time of the last aggregated rssi
+        self.last_localization = {}
+
+    def mark_dirty(self, target_mac, monitor_mac):
+        waiting = self.waiting.get(target_mac)
+        if waiting is None:
+            self.dirty[target_mac].add(monitor_mac)
+            return
+
+        waiting.add(monitor_mac)
+        if len(self.rssis.get(target_mac, {}).keys() | waiting) >= self.min_monitors:
+            del self.waiting[target_mac]
+            self.dirty[target_mac] |= waiting
+
+    def forget(self, target_mac):
+        self.dirty.pop(target_mac, None)
+        self.waiting.pop(target_mac, None)
+        self.rssis.pop(target_mac, None)
+        self.updated.pop(target_mac, None)
+        self.last_localization.pop(target_mac, None)
+
+    def due_targets(self, now):
+        # returns the targets to localize now and the earliest time a rate limited target becomes due
+        due = []
+        next_due = None
+        incomplete = []
+
+        for target_mac, fresh_monitors in self.dirty.items():
+            if len(fresh_monitors) < self.min_fresh_monitors:
+                continue
+            if len(self.rssis.get(target_mac, {}).keys() | fresh_monitors) < self.min_monitors:
+                incomplete.append(target_mac)
+                continue
+
+            due_time = self.last_localization.get(target_mac, float('-inf')) + self.min_localization_interval
+            if now < due_time:
+                next_due = due_time if next_due is None else min(next_due, due_time)
+                continue
+
+            due.append(target_mac)
+
+        # parked until mark_dirty() sees enough monitors, so they are not scanned on every pass
+        for target_mac in incomplete:
+            self.waiting[target_mac] = self.dirty.pop(target_mac)
+
+        return due, next_due
+
+    def collect_rssis(self, target_mac, target_aggregations, now):
+        # only the aggregations that received packets are evaluated again, the others come from the cache
+        # returns None if not enough monitors with recent data are left
+        rssis = self.rssis[target_mac]
+        updated = self.updated[target_mac]
+        for monitor_mac in self.dirty.pop(target_mac, ()):
+            packet = target_aggregations[monitor_mac].get_packet(now)
+            if packet is None:
+                rssis.pop(monitor_mac, None)
+                continue
+            rssis[monitor_mac] = packet.rssi
+            updated[monitor_mac] = now
+
+        if self.max_age is not None:
+            for monitor_mac in [monitor_mac for monitor_mac, t in updated.items() if now - t > self.max_age]:
+                del rssis[monitor_mac]
+                del updated[monitor_mac]
+
+        self.last_localization[target_mac] = now
+        if len(rssis) < self.min_monitors:
+            return None
+        return dict(rssis)
@@ -0,0 +1,188 @@
+import time
+import warnings
+import numpy as np
+
+DEFAULT_WINDOW_SIZE = 50
+DEFAULT_INITIAL_TARGETS = 64
+DEFAULT_INITIAL_MONITORS = 8
+
+
+class MacInterner:
+
+    def __init__(self):
+        self.ids = {}
+        self.macs = []
+        self.free_ids = []  # released ids, reused before new ones are appended
+
+    def __len__(self):
+        # the number of ids handed out so far (the capacity arrays indexed by id need), not of live MACs
+        return len(self.macs)
+
+    def __contains__(self, mac):
+        return mac in self.ids
+
+    def intern(self, mac):
+        mac_id = self.ids.get(mac)
+        if mac_id is None:
+            if self.free_ids:
+                mac_id = self.free_ids.pop()
+                self.macs[mac_id] = mac
+            else:
+                mac_id = len(self.macs)
+                self.macs.append(mac)
+            self.ids[mac] = mac_id
+        return mac_id
+
+    def intern_many(self, macs):
+        return np.fromiter((self.intern(mac) for mac in macs), dtype=np.intp, count=len(macs))
+
+    def release(self, mac):
+        # the id may be handed to another MAC afterwards, returns it (None if the MAC was not interned)
+        mac_id = self.ids.pop(mac, None)
+        if mac_id is not None:
+            self.macs[mac_id] = None
+            self.free_ids.append(mac_id)
+        return mac_id
+
+    def lookup(self, mac):
+        return self.ids.get(mac)
+
+    def mac(self, mac_id):
+        return self.macs[mac_id]
+
+
+class RingBufferPacketStore:
+
+    def __init__(self, window_size=DEFAULT_WINDOW_SIZE, initial_targets=DEFAULT_INITIAL_TARGETS, initial_monitors=DEFAULT_INITIAL_MONITORS):
+        self.window_size = window_size
+        self.targets = MacInterner()
+        self.monitors = MacInterner()
+
+        # one ring per (target, monitor), 8 + 4 bytes per stored packet
+        self.timestamps = np.zeros((initial_targets, initial_monitors, window_size), dtype=np.float64)
+        self.rssis = np.full((initial_targets, initial_monitors, window_size), np.nan, dtype=np.float32)
+        self.counts = np.zeros((initial_targets, initial_monitors), dtype=np.int64)  # packets ever written, the write position is count % window_size
+
+    @property
+    def shape(self):
+        return (len(self.targets), len(self.monitors))
+
+    def ensure_capacity(self, num_targets, num_monitors):
+        (capacity_targets, capacity_monitors) = self.counts.shape
+        if num_targets <= capacity_targets and num_monitors <= capacity_monitors:
+            return
+
+        # grow by doubling, views handed out before are no longer updated afterwards
+        while capacity_targets < num_targets:
+            capacity_targets *= 2
+        while capacity_monitors < num_monitors:
+            capacity_monitors *= 2
+
+        (old_targets, old_monitors) = self.counts.shape
+        timestamps = np.zeros((capacity_targets, capacity_monitors, self.window_size), dtype=np.float64)
+        rssis = np.full((capacity_targets, capacity_monitors, self.window_size), np.nan, dtype=np.float32)
+        counts = np.zeros((capacity_targets, capacity_monitors), dtype=np.int64)
+        timestamps[:old_targets, :old_monitors] = self.timestamps
+        rssis[:old_targets, :old_monitors] = self.rssis
+        counts[:old_targets, :old_monitors] = self.counts
+
+        self.timestamps = timestamps
+        self.rssis = rssis
+        self.counts = counts
+
+    def add_packet(self, target_mac, monitor_mac, timestamp, rssi):
+        target_id = self.targets.intern(target_mac)
+        monitor_id = self.monitors.intern(monitor_mac)
+        self.ensure_capacity(target_id + 1, monitor_id + 1)
+
+        pos = self.counts[target_id, monitor_id] % self.window_size
+        self.timestamps[target_id, monitor_id, pos] = timestamp
+        self.rssis[target_id, monitor_id, pos] = rssi
+        self.counts[target_id, monitor_id] += 1
+
+        return target_id, monitor_id
+
+    def add_packets(self, packets):
+        if not packets:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+        target_ids = self.targets.intern_many([packet.target_mac for packet in packets])
+        monitor_ids = self.monitors.intern_many([packet.monitor_mac for packet in packets])
+        timestamps = np.fromiter((packet.timestamp for packet in packets), dtype=np.float64, count=len(packets))
+        rssis = np.fromiter((packet.rssi for packet in packets), dtype=np.float32, count=len(packets))
+
+        self.add_arrays(target_ids, monitor_ids, timestamps, rssis)
+        return target_ids, monitor_ids
+
+    def add_arrays(self, target_ids, monitor_ids, timestamps, rssis):
+        self.ensure_capacity(int(target_ids.max()) + 1, int(monitor_ids.max()) + 1)
+
+        # rank of every packet within its (target, monitor) pair, keeping the batch order
+        num_monitors = self.counts.shape[1]
+        pair_ids = target_ids * num_monitors + monitor_ids
+        order = np.argsort(pair_ids, kind='stable')
+        sorted_pairs = pair_ids[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_pairs[1:] != sorted_pairs[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(sorted_pairs)])
+        ranks = np.arange(len(sorted_pairs)) - np.repeat(group_starts, group_sizes)
+
+        # only the newest window_size packets of a pair survive, so every slot is written at most once
+        keep = ranks >= np.repeat(group_sizes, group_sizes) - self.window_size
+        order = order[keep]
+        ranks = ranks[keep]
+
+        t = target_ids[order]
+        m = monitor_ids[order]
+        positions = (self.counts[t, m] + ranks) % self.window_size
+        self.timestamps[t, m, positions] = timestamps[order]
+        self.rssis[t, m, positions] = rssis[order]
+
+        np.add.at(self.counts, (target_ids, monitor_ids), 1)
+
+    def forget(self, target_mac):
+        # releases the rings of the target, a new target reuses them; returns the released id (or None)
+        target_id = self.targets.release(target_mac)
+        if target_id is not None:
+            self.timestamps[target_id] = 0.0
+            self.rssis[target_id] = np.nan
+            self.counts[target_id] = 0
+        return target_id
+
+    def window(self, target_id, monitor_id):
+        # views of the filled slots in ring order (not sorted by time), no copy
+        num = min(self.counts[target_id, monitor_id], self.window_size)
+        return self.timestamps[target_id, monitor_id, :num], self.rssis[target_id, monitor_id, :num]
+
+    def windows(self):
+        # views over all known pairs, unfilled slots are NaN
+        (num_targets, num_monitors) = self.shape
+        return self.timestamps[:num_targets, :num_monitors], self.rssis[:num_targets, :num_monitors]
+
+    def aggregate(self, func=np.nanmedian, max_age=None, now=None):
+        # one vectorized aggregation over all (target, monitor) pairs, NaN where a pair has no (recent) packets
+        timestamps, rssis = self.windows()
+        if max_age is not None:
+            now = time.time() if now is None else now
+            rssis = np.where(timestamps >= now - max_age, rssis, np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)  # all-NaN slices of unseen pairs
+            return func(rssis, axis=2)
+
+    def aggregate_window(self, target_id, monitor_id, func=np.median, max_age=None, now=None):
+        # aggregate of a single pair over its packets of the last max_age seconds, None if there are none
+        timestamps, rssis = self.window(target_id, monitor_id)
+        if max_age is not None:
+            now = time.time() if now is None else now
+            rssis = rssis[timestamps >= now - max_age]
+        if len(rssis) == 0:
+            return None
+        return float(func(rssis))
+
+    def get_rssis(self, target_mac, func=np.nanmedian):
+        target_id = self.targets.lookup(target_mac)
+        if target_id is None:
+            return {}
+
+        seen = np.flatnonzero(self.counts[target_id, :len(self.monitors)] > 0)
+        aggregated = func(self.rssis[target_id, seen], axis=1)
+        return {self.monitors.mac(monitor_id): float(rssi) for monitor_id, rssi in zip(seen, aggregated)}
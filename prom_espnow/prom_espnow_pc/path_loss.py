@@ -0,0 +1,154 @@
+import json
+import os
+import numpy as np
+from config import *
+
+MODEL_LOG = 'log'
+MODEL_LINEAR = 'linear'
+
+RSSI_MIN = -128  # the RSSI arrives as int8 dBm
+RSSI_MAX = 127
+
+DEFAULT_PATH_LOSS_PARAMETERS = "./calibrations/path_loss_parameters.json"
+MIN_DISTANCE = 0.01  # m, the linear model reaches zero and below for strong signals
+
+
+class LogPathLossModel:
+    # rssi = L0 - 10 * EXP * log10(d)
+
+    name = MODEL_LOG
+
+    def __init__(self, l0=PATH_LOSS_L0, exp=PATH_LOSS_EXP):
+        self.l0 = l0
+        self.exp = exp
+
+    def rssi(self, distance):
+        return self.l0 - 10.0 * self.exp * np.log10(distance)
+
+    def distance(self, rssi):
+        return np.power(10.0, (self.l0 - rssi) / (10.0 * self.exp))
+
+    def parameters(self):
+        return {'model': self.name, 'l0': self.l0, 'exp': self.exp}
+
+class LinearPathLossModel:
+    # rssi = slope * d + intercept
+
+    name = MODEL_LINEAR
+
+    def __init__(self, slope=-4.009, intercept=-49.59):
+        self.slope = slope
+        self.intercept = intercept
+
+    def rssi(self, distance):
+        return self.slope * distance + self.intercept
+
+    def distance(self, rssi):
+        return (rssi - self.intercept) / self.slope
+
+    def parameters(self):
+        return {'model': self.name, 'slope': self.slope, 'intercept': self.intercept}
+
+def path_loss_model_from_parameters(parameters):
+    if parameters['model'] == MODEL_LOG:
+        return LogPathLossModel(parameters['l0'], parameters['exp'])
+    if parameters['model'] == MODEL_LINEAR:
+        return LinearPathLossModel(parameters['slope'], parameters['intercept'])
+    raise ValueError("Unknown path loss model: " + str(parameters['model']))
+
+
+class PathLossRegistry:
+    # path loss model per monitor (default model for the others) with a (monitors x RSSI) distance table,
+    # row 0 is the default model, column i holds the distance in m for RSSI_MIN + i dBm
+
+    def __init__(self, default_model=None, models=None):
+        self.default_model = default_model if default_model is not None else LogPathLossModel()
+        self.models = {}
+        self.monitor_rows = {}
+        self.version = 0  # counts set_model() calls, users that cache rows() compare against it
+        self.table = self.table_row(self.default_model)[None, :]
+        for monitor_mac, model in (models or {}).items():
+            self.set_model(monitor_mac, model)
+
+    @classmethod
+    def load(cls, file_path=DEFAULT_PATH_LOSS_PARAMETERS, model=MODEL_LOG):
+        # parameter file of calibration_pipeline.py, every monitor can have fits of several models
+        with open(file_path, 'r') as f:
+            parameters = json.load(f)
+
+        default_model = None
+        if model in parameters.get('default', {}):
+            default_model = path_loss_model_from_parameters(parameters['default'][model])
+        models = {
+            monitor_mac: path_loss_model_from_parameters(monitor_models[model])
+            for monitor_mac, monitor_models in parameters.get('monitors', {}).items()
+            if model in monitor_models
+        }
+        return cls(default_model, models)
+
+    @classmethod
+    def load_or_default(cls, file_path=DEFAULT_PATH_LOSS_PARAMETERS, model=MODEL_LOG):
+        if not os.path.exists(file_path):
+            return cls()
+        return cls.load(file_path, model)
+
+    def table_row(self, model):
+        # one more column than RSSI values so that the interpolation never reads past the end
+        rssis = np.arange(RSSI_MIN, RSSI_MAX + 2, dtype=np.float64)
+        return np.maximum(model.distance(rssis), MIN_DISTANCE)
+
+    def set_model(self, monitor_mac, model):
+        row = self.monitor_rows.get(monitor_mac)
+        if row is None:
+            row = len(self.table)
+            self.monitor_rows[monitor_mac] = row
+            self.table = np.vstack((self.table, self.table_row(model)))
+        else:
+            self.table[row] = self.table_row(model)
+        self.models[monitor_mac] = model
+        self.version += 1
+
+    def model(self, monitor_mac):
+        return self.models.get(monitor_mac, self.default_model)
+
+    def rows(self, monitor_macs):
+        return np.array([self.monitor_rows.get(monitor_mac, 0) for monitor_mac in monitor_macs], dtype=np.intp)
+
+    @property
+    def num_columns(self):
+        return self.table.shape[1]
+
+    def distances(self, rows, rssis):
+        # distances in m, rows broadcast against rssis; integer RSSIs (raw packets) are a single lookup,
+        # aggregated RSSIs (medians) can be fractional and interpolate linearly between the neighboring dBm values
+        rssis = np.asarray(rssis)
+        flat_table = self.table.ravel()
+        offsets = np.asarray(rows) * self.num_columns
+        if np.issubdtype(rssis.dtype, np.integer):
+            return flat_table[offsets + (np.clip(rssis, RSSI_MIN, RSSI_MAX).astype(np.intp) - RSSI_MIN)]  # int8 input would overflow
+
+        positions = np.clip(rssis.astype(np.float64) - RSSI_MIN, 0.0, RSSI_MAX - RSSI_MIN)
+        lower = positions.astype(np.intp)
+        index = offsets + lower
+        distances = flat_table[index]
+        return distances + (flat_table[index + 1] - distances) * (positions - lower)
+
+    def distance_stds(self, rows, rssis, rssi_std):
+        # std of the distance in m for a std of rssi_std dB around the RSSI: rssi_std * |dd/drssi| of the monitor's model
+        rssis = np.asarray(rssis, dtype=np.float64)
+        return rssi_std * np.abs(self.distances(rows, rssis - 0.5) - self.distances(rows, rssis + 0.5))
+
+    def distance(self, monitor_mac, rssi):
+        return float(self.distances(self.monitor_rows.get(monitor_mac, 0), rssi))
+
+    def expected_rssis(self, rows, distances):
+        # forward model for simulations and likelihoods, distances in m
+        rows = np.broadcast_to(rows, np.shape(distances))
+        models = [self.default_model] + [None] * len(self.monitor_rows)
+        for monitor_mac, row in self.monitor_rows.items():
+            models[row] = self.models[monitor_mac]
+        rssis = np.empty(np.shape(distances))
+        for row in np.unique(rows):
+            selected = rows == row
+            rssis[selected] = models[row].rssi(np.asarray(distances)[selected])
+        return rssis
@@ -55,13 +55,14 @@ def plot_results(anchor_positions_in_m_dict, distances_in_m_dict, target_positio
     
     vis_ax.clear()
     
-    background = get_env_background_image()
+    environment = get_environment()
+    background = environment.background
 
     # Display the image
     vis_ax.imshow(background)
 
     if anchor_positions_in_m is not None:
-        anchor_positions_in_px = [(env_to_px(x), env_to_px(y)) for (x, y) in anchor_positions_in_m]
+        anchor_positions_in_px = environment.to_px(np.array(anchor_positions_in_m, dtype=np.float64).reshape(-1, 2))
         for anchor_position in anchor_positions_in_px:
             # Create a Circle patch
             circle = patches.Circle(anchor_position, 10, linewidth=1, edgecolor='r', facecolor='r')
@@ -70,8 +71,7 @@ def plot_results(anchor_positions_in_m_dict, distances_in_m_dict, target_positio
             vis_ax.add_patch(circle)
     
     if anchor_positions_in_m is not None and distances_in_m is not None:
-        anchor_positions_in_px = [(env_to_px(x), env_to_px(y)) for (x, y) in anchor_positions_in_m]
-        distances_in_px = [env_to_px(dist) for dist in distances_in_m]
+        distances_in_px = environment.to_px(np.array(distances_in_m, dtype=np.float64))
         for (anchor_position, distances) in zip(anchor_positions_in_px, distances_in_px):
             # Create a Circle patch
             circle = patches.Circle(anchor_position, distances, linewidth=2, edgecolor='g', fill=False)
@@ -83,8 +83,8 @@ def plot_results(anchor_positions_in_m_dict, distances_in_m_dict, target_positio
     vis_ax.legend(handles=handles)
 
     if target_positions_in_m is not None:
-        for index, target_position_in_m in enumerate(target_positions_in_m):
-            target_position_in_px = (env_to_px(target_position_in_m[0]), env_to_px(target_position_in_m[1]))
+        target_positions_in_px = environment.to_px(np.array(target_positions_in_m, dtype=np.float64).reshape(-1, 2))
+        for index, target_position_in_px in enumerate(target_positions_in_px):
             
             # Create a Circle patch
             color = 'C' + str(index)
@@ -94,7 +94,7 @@ def plot_results(anchor_positions_in_m_dict, distances_in_m_dict, target_positio
             vis_ax.add_patch(circle)
 
     if gt_position_in_m is not None:
-        gt_position_in_px = (env_to_px(gt_position_in_m[0]), env_to_px(gt_position_in_m[1]))
+        gt_position_in_px = environment.to_px(gt_position_in_m)
         
         # Create a Circle patch
         circle = patches.Circle(gt_position_in_px, 10, linewidth=1, edgecolor='y', facecolor='y')
@@ -147,6 +147,7 @@ class RealtimePlotter:
         self.anchor_distances = []
         self.target_position = []
         self.target_estimation = {}
+        self.tracked_target = None # target mac whose estimates are drawn, None: the last localized target
         self.new_data_available = False
     
     def helper_unpack_coordinates(self, coordinate_list):
@@ -174,7 +175,7 @@ class RealtimePlotter:
             for circle in self.plt_anchor_dists:
                 self.ax.add_patch(circle)
             
-            self.annotations = [self.ax.annotate('annotation', xy=(0,0), xytext=(0,0), ha='center') for _ in range(3)]
+            self.annotations = [self.ax.annotate('annotation', xy=(0,0), xytext=(0,0), ha='center') for _ in range(4)] # one per localizer (tri_ls, tri_wcl, fp, pf)
             
             return self.plt_heatmap, self.plt_anchor_pos, self.plt_target_est, self.plt_target_pos, *self.plt_anchor_dists, *self.annotations
         
@@ -196,7 +197,7 @@ class RealtimePlotter:
                     self.plt_anchor_dists[i].set_center(self.anchor_positions[i])
                     self.plt_anchor_dists[i].set_radius(self.anchor_distances[i])
                 
-                for i, key in enumerate(self.target_estimation.keys()):
+                for i, key in zip(range(len(self.annotations)), self.target_estimation.keys()):
                     self.annotations[i].set_position((self.target_estimation[key][0], self.target_estimation[key][1] - 20))
                     self.annotations[i].set_text(key)
                 
@@ -0,0 +1,214 @@
+import asyncio
+import threading
+import time
+import traceback
+import numpy as np
+from aggregation import *
+from localization_scheduler import *
+from target_table import *
+from target_state import *
+
+DEFAULT_QUEUE_SIZE = 64  # batches between the serial reader and the aggregation
+DEFAULT_ERROR_BACKOFF = 1.0  # s, pause after a failed read so that a broken port does not spin
+DEFAULT_MAX_CONSECUTIVE_ERRORS = 10  # a stage that keeps failing stops the pipeline instead of printing forever
+
+
+class ReceiverPipeline:
+
+    def __init__(
+            self,
+            packet_reader,
+            localizers,
+            target_table=None,
+            scheduler=None,
+            state=None,
+            batch=False,
+            queue_size=DEFAULT_QUEUE_SIZE,
+            max_consecutive_errors=DEFAULT_MAX_CONSECUTIVE_ERRORS
+        ):
+        self.packet_reader = packet_reader
+        self.localizers = localizers
+        self.target_table = target_table if target_table is not None else TargetTable()
+        self.scheduler = scheduler if scheduler is not None else LocalizationScheduler()
+        # one target state store for all localizers (estimates, warm starts, fused track), evicted targets are released in it
+        self.state = state if state is not None else TargetStateStore()
+        for localizer in localizers:
+            if hasattr(localizer, 'state'):
+                localizer.state = self.state
+        self.batch = batch  # localize all due targets with one localize_many() per localizer (no plotting)
+        self.queue_size = queue_size
+        self.max_consecutive_errors = max_consecutive_errors
+
+        self.num_errors = {}            # stage -> errors since the start
+        self.consecutive_errors = {}    # stage -> errors since its last success
+        self.last_error = None
+
+        self.running = False
+        self.loop = None
+        self.tasks = None
+        self.due_timer = None  # wakes the localization up for the rate limited targets
+
+    def report_error(self, stage):
+        # called from the except block of a stage: the whole traceback is printed and the stage continues,
+        # unless it failed max_consecutive_errors times in a row, then the exception ends the pipeline
+        self.num_errors[stage] = self.num_errors.get(stage, 0) + 1
+        self.consecutive_errors[stage] = self.consecutive_errors.get(stage, 0) + 1
+        self.last_error = traceback.format_exc()
+        print("Error " + stage + " (" + str(self.consecutive_errors[stage]) + " in a row):")
+        print(self.last_error, end='')
+        if self.consecutive_errors[stage] >= self.max_consecutive_errors:
+            raise
+
+    def report_success(self, stage):
+        self.consecutive_errors[stage] = 0
+
+    async def read_packets(self, queue):
+        # the blocking serial read runs in a worker thread, the event loop sleeps until a batch arrives
+        while self.running:
+            if getattr(self.packet_reader, 'finished', False):
+                print("End of packet source")
+                return  # the aggregation and localization keep running on what was read
+            try:
+                packets = await self.loop.run_in_executor(None, self.packet_reader.read_packets)
+            except Exception:
+                self.report_error("reading packets")
+                await asyncio.sleep(DEFAULT_ERROR_BACKOFF)
+                continue
+            self.report_success("reading packets")
+            if packets:
+                await queue.put(packets)  # waits if the aggregation falls behind
+
+    def forget(self, target_mac):
+        self.scheduler.forget(target_mac)
+        self.state.forget(target_mac)
+        for localizer in self.localizers:
+            if hasattr(localizer, 'forget'):
+                localizer.forget(target_mac) # per target filters like the particles of a ParticleFilterTracker
+
+    def add_packets(self, packets):
+        # the whole batch goes into the target table (filtered by the allowlist), the pairs that got packets are dirty
+        pairs, evicted = self.target_table.add_packets(packets)
+        for target_mac in evicted:
+            self.forget(target_mac)
+        for target_mac, monitor_mac in pairs:
+            self.scheduler.mark_dirty(target_mac, monitor_mac)
+
+    async def aggregate_packets(self, queue, new_data):
+        while self.running:
+            packets = await queue.get()
+            try:
+                self.add_packets(packets)
+                self.report_success("aggregating packets")
+            except Exception:
+                self.report_error("aggregating packets")
+            new_data.set()
+
+    def localize_target(self, target_mac, now):
+        rssis = self.scheduler.collect_rssis(target_mac, self.target_table[target_mac], now)
+        if rssis is None:
+            return
+
+        for localizer in self.localizers:
+            localizer.localize(rssis, target_mac)
+
+    def localize_due_targets(self, now):
+        # returns the time the next rate limited target becomes due (or None)
+        due_targets, next_due = self.scheduler.due_targets(now)
+        self.state.now = now  # the fixes of this pass update the tracks at this time
+
+        if self.batch:
+            self.localize_targets_batch(due_targets, now)
+        else:
+            for target_mac in due_targets:
+                self.localize_target(target_mac, now)
+
+        return next_due
+
+    def localize_targets_batch(self, target_macs, now):
+        collected = [(target_mac, self.scheduler.collect_rssis(target_mac, self.target_table[target_mac], now)) for target_mac in target_macs]
+        collected = [(target_mac, rssis) for target_mac, rssis in collected if rssis is not None]
+        if not collected:
+            return
+
+        # (targets x monitors) matrix over all monitors that any of the targets sees, NaN where a monitor is missing
+        monitor_macs = sorted(set().union(*(rssis.keys() for _, rssis in collected)))
+        columns = {monitor_mac: column for column, monitor_mac in enumerate(monitor_macs)}
+        matrix = np.full((len(collected), len(monitor_macs)), np.nan)
+        for row, (_, rssis) in enumerate(collected):
+            for monitor_mac, rssi in rssis.items():
+                matrix[row, columns[monitor_mac]] = rssi
+
+        target_macs = [target_mac for target_mac, _ in collected]
+        for localizer in self.localizers:
+            localizer.localize_many(monitor_macs, matrix, target_macs=target_macs)
+
+    async def localize_targets(self, new_data):
+        while self.running:
+            await new_data.wait()
+            new_data.clear()
+
+            now = time.time()
+            try:
+                next_due = self.localize_due_targets(now)
+                self.report_success("localizing targets")
+            except Exception:
+                self.report_error("localizing targets")
+                continue
+
+            # come back for the rate limited targets even if no further packets arrive, one pending timer at most
+            if self.due_timer is not None:
+                self.due_timer.cancel()
+                self.due_timer = None
+            if next_due is not None:
+                self.due_timer = self.loop.call_later(next_due - now, new_data.set)
+
+    def run_offline(self, packet_source):
+        # synchronous run over a finite source (e.g. a playback at max speed), the clock is the packet time
+        now = None
+        for packets in packet_source.batches():
+            self.add_packets(packets)
+            now = packets[-1].timestamp
+            self.localize_due_targets(now)
+            for target_mac in self.target_table.evict_expired(now):
+                self.forget(target_mac)
+        return now
+
+    async def expire_targets(self):
+        while self.running:
+            await asyncio.sleep(self.target_table.ttl / 4.0)
+            for target_mac in self.target_table.evict_expired(time.time()):
+                self.forget(target_mac)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.running = True
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        new_data = asyncio.Event()
+
+        self.tasks = asyncio.gather(
+            self.read_packets(queue),
+            self.aggregate_packets(queue, new_data),
+            self.localize_targets(new_data),
+            self.expire_targets(),
+        )
+        try:
+            await self.tasks
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # a stage gave up, the others are stopped with it
+            self.running = False
+            self.tasks.cancel()
+            raise
+
+    def start(self):
+        # runs the event loop in the background so that the main thread stays free for matplotlib
+        thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+        if self.loop is not None and self.tasks is not None:
+            self.loop.call_soon_threadsafe(self.tasks.cancel)
@@ -1,10 +1,11 @@
 import serial
 import time
-import re
 import pandas as pd
 from datetime import datetime
 import matplotlib.pyplot as plt
 from config import *
+from serial_reader import *
+from recorder import *
 
 from matplotlib.ticker import MultipleLocator
 
@@ -12,10 +13,7 @@ from matplotlib.ticker import MultipleLocator
 
 anchor_macs = ["24a1602ccfab", "d8bfc0117c7d", "a4cf12fdaea9", "483fda467e7a"]
 
-background = get_env_background_image()
-# scale so that 1px = 1cm
-new_size = (int(background.size[0] * env_to_m(100)), int(background.size[1] * env_to_m(100)))
-background = background.resize(new_size, Image.LANCZOS)
+background = get_scaled_env_background_image() # 1px = 1cm
 
 def get_anchor_positions():
     anchor_positions_in_cm = {}
@@ -63,16 +61,15 @@ try:
 except:
     print("Error opening serial port")
 
-pattern = re.compile("^([0-9A-Fa-f]{12})_([0-9A-Fa-f]{12}):(-?[0-9]+\.?[0-9]*)\s*$")
+packet_reader = SerialPacketReader(nodeSerial)
 
-timestamps = []
-monitor_macs = []
-target_macs = []
-rssis = []
-anchor_positions_x = []
-anchor_positions_y = []
-target_positions_x = []
-target_positions_y = []
+export_csv = True # also write the .csv next to the .pkl at the end
+
+filename = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+filepath = "./fingerprint_maps/" + filename
+
+# streamed to disk in chunks, the session directory stays readable with read_session() even after a crash
+recorder = ChunkedRecorder(filepath, FINGERPRINT_COLUMNS)
 
 target_positions = []
 
@@ -105,6 +102,7 @@ try:
             
             # drain the serial port
             nodeSerial.reset_input_buffer()
+            packet_reader.reset()
             
             start_time = time.time()
             timeout = 10 # 10s per measurement
@@ -113,37 +111,27 @@ try:
                 if time.time() > start_time + timeout:
                     break
                 
-                #read data from serial port
-                line = nodeSerial.readline()
-
-                #if there is smth do smth
-                if len(line) >= 1:
+                #read everything available from the serial port
+                for packet in packet_reader.read_packets():
                     try:
-                        timestamp = time.time()
-                        line_decoded = line.decode("utf-8")
-                        print(line_decoded)
-                        match = pattern.match(line_decoded)
-                        if match:
-                            monitor_mac = match.group(1)
-                            target_mac = match.group(2)
-                            rssi = float(match.group(3))
-                            anchor_position_x, anchor_position_y = anchor_positions_in_cm[monitor_mac]
-                            print("Received: " + str(monitor_mac) + " "  + str(target_mac) + " "  + str(rssi))
-                            
-                            timestamps.append(timestamp)
-                            monitor_macs.append(monitor_mac)
-                            target_macs.append(target_mac)
-                            rssis.append(rssi)
-                            anchor_positions_x.append(anchor_position_x)
-                            anchor_positions_y.append(anchor_position_y)
-                            target_positions_x.append(x)
-                            target_positions_y.append(y)
-                        else:
-                            print("No match")
+                        anchor_position_x, anchor_position_y = anchor_positions_in_cm[packet.monitor_mac]
+                        print("Received: " + str(packet.monitor_mac) + " "  + str(packet.target_mac) + " "  + str(packet.rssi))
+                        
+                        recorder.append(
+                            timestamp=packet.timestamp,
+                            monitor_mac=packet.monitor_mac,
+                            target_mac=packet.target_mac,
+                            rssi=packet.rssi,
+                            anchor_position_x=anchor_position_x,
+                            anchor_position_y=anchor_position_y,
+                            target_position_x=x,
+                            target_position_y=y,
+                        )
                     except Exception as e: 
                         print(e)
-                        print("could not decode")
+                        print("could not process packet")
             
+            recorder.flush() # every survey point ends up on disk
             print("Done!")
             plt.close(event.canvas.figure)
         
@@ -155,21 +143,7 @@ try:
         plt.show()
 except KeyboardInterrupt:
     print("Done!")
-    print("Converting to Pandas Dataframe...")
-
-df = pd.DataFrame({
-    'timestamp': timestamps,
-    'monitor_mac': monitor_macs,
-    'target_mac': target_macs,
-    'rssi': rssis,
-    'anchor_position_x': anchor_positions_x,
-    'anchor_position_y': anchor_positions_y,
-    'target_position_x': target_positions_x,
-    'target_position_y': target_positions_y,
-})
-
-filename = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-filepath = "./fingerprint_maps/" + filename
 
-df.to_pickle(filepath + ".pkl")
-df.to_csv(filepath + ".csv", index=False)
\ No newline at end of file
+recorder.close()
+print("Exporting " + str(recorder.total_rows) + " samples...")
+export_session(filepath, filepath, csv=export_csv)
\ No newline at end of file
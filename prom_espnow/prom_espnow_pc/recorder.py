@@ -0,0 +1,204 @@
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+from serial_reader import MAC_LEN
+
+DEFAULT_CHUNK_ROWS = 4096
+DEFAULT_FLUSH_INTERVAL = 5.0  # s, a partially filled chunk is written at least this often
+
+INDEX_FILENAME = "index.json"
+
+MAC_DTYPE = '<U' + str(MAC_LEN)
+RSSI_DTYPE = np.int16  # integer dBm, int8 on the wire; stays an integer in the CSV export
+
+RECORDING_COLUMNS = {
+    'timestamp': np.float64,
+    'monitor_mac': MAC_DTYPE,
+    'target_mac': MAC_DTYPE,
+    'rssi': RSSI_DTYPE,
+    'anchor_position_x': np.float64,
+    'anchor_position_y': np.float64,
+}
+
+CALIBRATION_COLUMNS = {
+    'timestamp': np.float64,
+    'monitor_mac': MAC_DTYPE,
+    'distance': np.float64,
+    'rssi': RSSI_DTYPE,
+}
+
+FINGERPRINT_COLUMNS = {
+    **RECORDING_COLUMNS,
+    'target_position_x': np.float64,
+    'target_position_y': np.float64,
+}
+
+
+class ChunkedRecorder:
+    # appends rows into fixed size columnar buffers, full (or old) buffers are written by a background thread
+    # as one .npy file per column; a chunk is listed in the index only after all of its files are on disk,
+    # so a session that ends in a crash can still be read up to the last flush;
+    # if writing fails the writer stops and the error is raised from the next append / flush / close
+
+    def __init__(self, session_dir, columns, chunk_rows=DEFAULT_CHUNK_ROWS, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.session_dir = session_dir
+        self.columns = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self.mac_columns = [name for name, dtype in self.columns.items() if dtype == np.dtype(MAC_DTYPE)]
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+
+        os.makedirs(session_dir, exist_ok=True)
+        self.index = {
+            'columns': {name: dtype.str for name, dtype in self.columns.items()},
+            'chunks': [],
+        }
+        self.write_index()
+
+        self.lock = threading.Lock()
+        self.buffers = self.new_buffers()
+        self.num_rows = 0        # rows in the current buffers
+        self.num_chunks = 0      # chunks handed to the writer
+        self.total_rows = 0
+        self.error = None        # exception of the writer thread
+
+        self.chunks = queue.Queue()
+        self.writer_thread = threading.Thread(target=self.writer, daemon=True)
+        self.writer_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def new_buffers(self):
+        return {name: np.empty(self.chunk_rows, dtype=dtype) for name, dtype in self.columns.items()}
+
+    def check_macs(self, name, macs):
+        # the fixed width MAC columns would silently truncate longer strings
+        lengths = np.char.str_len(np.asarray(macs, dtype=str))
+        if np.any(lengths != MAC_LEN):
+            raise ValueError("Invalid MAC in column " + name + ": " + str(np.asarray(macs)[lengths != MAC_LEN].ravel()[0]))
+
+    def append(self, **row):
+        self.check_error()
+        for name in self.mac_columns:
+            self.check_macs(name, row[name])
+        with self.lock:
+            for name, buffer in self.buffers.items():
+                buffer[self.num_rows] = row[name]
+            self.num_rows += 1
+            self.total_rows += 1
+            if self.num_rows == self.chunk_rows:
+                self.hand_off()
+
+    def append_rows(self, **columns):
+        # batched append, every column is an array of the same length
+        self.check_error()
+        num_rows = len(next(iter(columns.values())))
+        for name in self.mac_columns:
+            self.check_macs(name, columns[name])
+        start = 0
+        with self.lock:
+            while start < num_rows:
+                count = min(num_rows - start, self.chunk_rows - self.num_rows)
+                for name, buffer in self.buffers.items():
+                    buffer[self.num_rows:self.num_rows + count] = columns[name][start:start + count]
+                self.num_rows += count
+                self.total_rows += count
+                start += count
+                if self.num_rows == self.chunk_rows:
+                    self.hand_off()
+
+    def hand_off(self):
+        # with the lock held: the filled part of the buffers goes to the writer, recording continues in new buffers
+        if self.num_rows == 0:
+            return
+        chunk = {name: buffer[:self.num_rows] for name, buffer in self.buffers.items()}
+        self.chunks.put((self.num_chunks, chunk))
+        self.num_chunks += 1
+        self.buffers = self.new_buffers()
+        self.num_rows = 0
+
+    def flush(self):
+        self.check_error()
+        with self.lock:
+            self.hand_off()
+
+    def writer(self):
+        while True:
+            try:
+                item = self.chunks.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.flush()  # nothing filled up for a while, write what is there
+                continue
+            if item is None:
+                break
+            try:
+                self.write_chunk(*item)
+            except Exception as e:
+                self.error = e  # the chunks after a missing one are not written either
+                break
+
+    def chunk_path(self, chunk_id, name):
+        return os.path.join(self.session_dir, f"{chunk_id:06d}_{name}.npy")
+
+    def write_chunk(self, chunk_id, chunk):
+        for name, values in chunk.items():
+            with open(self.chunk_path(chunk_id, name), 'wb') as f:
+                np.save(f, values)
+                f.flush()
+                os.fsync(f.fileno())
+        self.index['chunks'].append({'id': chunk_id, 'num_rows': int(len(next(iter(chunk.values()))))})
+        self.write_index()
+
+    def write_index(self):
+        tmp_index_path = os.path.join(self.session_dir, INDEX_FILENAME + '.tmp')
+        with open(tmp_index_path, 'w') as f:
+            json.dump(self.index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_index_path, os.path.join(self.session_dir, INDEX_FILENAME))
+
+    def close(self):
+        with self.lock:
+            self.hand_off()
+        self.chunks.put(None)
+        self.writer_thread.join()
+        self.check_error()
+
+
+def read_session_columns(session_dir):
+    # the chunks listed in the index, concatenated per column
+    with open(os.path.join(session_dir, INDEX_FILENAME), 'r') as f:
+        index = json.load(f)
+
+    chunks = sorted(index['chunks'], key=lambda chunk: chunk['id'])
+    columns = {}
+    for name, dtype in index['columns'].items():
+        values = [np.load(os.path.join(session_dir, f"{chunk['id']:06d}_{name}.npy")) for chunk in chunks]
+        columns[name] = np.concatenate(values) if values else np.empty(0, dtype=np.dtype(dtype))
+    return columns
+
+def read_session(session_dir):
+    return pd.DataFrame(read_session_columns(session_dir))
+
+def export_session(session_dir, filepath, csv=True, pickle=True, session=True):
+    # the formats the analysis scripts read, filepath without extension
+    df = read_session(session_dir)
+    if session:
+        from session_format import write_session, SESSION_EXTENSION
+        write_session(filepath + SESSION_EXTENSION, {name: df[name].to_numpy() for name in df.columns})
+    if pickle:
+        df.to_pickle(filepath + ".pkl")
+    if csv:
+        df.to_csv(filepath + ".csv", index=False)
+    return df
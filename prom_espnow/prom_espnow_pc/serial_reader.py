@@ -0,0 +1,230 @@
+import struct
+import time
+from binascii import crc_hqx
+from collections import namedtuple
+
+# one decoded "<monitor_mac>_<target_mac>:<rssi>" line of the main node
+ParsedPacket = namedtuple('ParsedPacket', ['timestamp', 'monitor_mac', 'target_mac', 'rssi'])
+
+MAC_LEN = 12
+MONITOR_MAC_END = MAC_LEN                 # position of the '_' separator
+TARGET_MAC_START = MONITOR_MAC_END + 1
+TARGET_MAC_END = TARGET_MAC_START + MAC_LEN  # position of the ':' separator
+RSSI_START = TARGET_MAC_END + 1
+
+SEPARATOR_MACS = ord('_')
+SEPARATOR_RSSI = ord(':')
+
+HEX_DIGITS = frozenset(b'0123456789abcdefABCDEF')
+RSSI_CHARS = frozenset(b'-.0123456789')
+
+DEFAULT_MAX_BUFFER_SIZE = 64 * 1024  # drop garbage that never contains a newline
+
+
+def parse_line(line, timestamp=None):
+    # fixed-width parsing of "aabbccddeeff_112233445566:-61" (without regex)
+    line = line.strip()
+
+    if len(line) <= RSSI_START:
+        return None
+    if line[MONITOR_MAC_END] != SEPARATOR_MACS or line[TARGET_MAC_END] != SEPARATOR_RSSI:
+        return None
+
+    monitor_mac = line[:MONITOR_MAC_END]
+    target_mac = line[TARGET_MAC_START:TARGET_MAC_END]
+    rssi = line[RSSI_START:]
+
+    if not HEX_DIGITS.issuperset(monitor_mac) or not HEX_DIGITS.issuperset(target_mac):
+        return None
+    if not RSSI_CHARS.issuperset(rssi):
+        return None
+
+    try:
+        rssi = float(rssi)
+    except ValueError:
+        return None
+
+    if timestamp is None:
+        timestamp = time.time()
+
+    return ParsedPacket(timestamp, monitor_mac.decode('ascii'), target_mac.decode('ascii'), rssi)
+
+def parse_lines(lines, timestamp=None):
+    if timestamp is None:
+        timestamp = time.time()
+
+    packets = []
+    num_invalid = 0
+    for line in lines:
+        packet = parse_line(line, timestamp)
+        if packet is None:
+            if line.strip():
+                num_invalid += 1
+            continue
+        packets.append(packet)
+
+    return packets, num_invalid
+
+
+# binary frame sent by the main node (see prom_espnow_main_esp32.ino):
+#   sync (0xA5 0x5A) | length | monitor mac (6) | target mac (6) | rssi (int8) | sequence (uint16) | device timestamp in ms (uint32) | crc16
+# all integers are little endian, the CRC-16/CCITT (init 0xFFFF) covers length and payload
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_PAYLOAD = struct.Struct('<6s6sbHI')
+FRAME_CRC = struct.Struct('<H')
+FRAME_HEADER_LEN = len(FRAME_SYNC) + 1
+FRAME_LEN = FRAME_HEADER_LEN + FRAME_PAYLOAD.size + FRAME_CRC.size
+CRC_INIT = 0xFFFF
+
+
+def crc16(data):
+    return crc_hqx(data, CRC_INIT)
+
+def encode_frame(monitor_mac, target_mac, rssi, sequence, device_timestamp):
+    # mirror of the firmware encoder (e.g. for feeding the decoder from a simulator)
+    payload = FRAME_PAYLOAD.pack(bytes.fromhex(monitor_mac), bytes.fromhex(target_mac), int(rssi), sequence & 0xFFFF, device_timestamp & 0xFFFFFFFF)
+    checked = bytes((FRAME_PAYLOAD.size,)) + payload
+    return FRAME_SYNC + checked + FRAME_CRC.pack(crc16(checked))
+
+
+class BinaryFrameDecoder:
+
+    def __init__(self):
+        self.last_sequence = None
+        self.num_frames = 0
+        self.num_crc_errors = 0
+        self.num_lost_frames = 0
+        self.num_skipped_bytes = 0
+
+    def decode(self, buffer, timestamp=None):
+        # decodes all complete frames and removes the consumed bytes from the bytearray
+        if timestamp is None:
+            timestamp = time.time()
+
+        packets = []
+        pos = 0
+        end = len(buffer)
+
+        while True:
+            start = buffer.find(FRAME_SYNC, pos)
+            if start < 0:
+                # keep a trailing first sync byte, it might be completed by the next read
+                keep_from = end - 1 if end > pos and buffer[end - 1] == FRAME_SYNC[0] else end
+                self.num_skipped_bytes += keep_from - pos
+                pos = keep_from
+                break
+
+            self.num_skipped_bytes += start - pos
+            pos = start
+
+            if end - pos < FRAME_LEN:
+                break
+
+            if buffer[pos + len(FRAME_SYNC)] != FRAME_PAYLOAD.size:
+                # not a frame start, resync behind this sync byte
+                pos += 1
+                self.num_skipped_bytes += 1
+                continue
+
+            checked = bytes(buffer[pos + len(FRAME_SYNC):pos + FRAME_LEN - FRAME_CRC.size])
+            (crc,) = FRAME_CRC.unpack_from(buffer, pos + FRAME_LEN - FRAME_CRC.size)
+            if crc != crc16(checked):
+                self.num_crc_errors += 1
+                pos += 1
+                self.num_skipped_bytes += 1
+                continue
+
+            monitor_mac, target_mac, rssi, sequence, _ = FRAME_PAYLOAD.unpack_from(checked, 1)
+
+            if self.last_sequence is not None:
+                self.num_lost_frames += (sequence - self.last_sequence - 1) & 0xFFFF
+            self.last_sequence = sequence
+            self.num_frames += 1
+
+            packets.append(ParsedPacket(timestamp, monitor_mac.hex(), target_mac.hex(), float(rssi)))
+            pos += FRAME_LEN
+
+        del buffer[:pos]
+        return packets
+
+
+PROTOCOL_TEXT = 'text'
+PROTOCOL_BINARY = 'binary'
+
+
+class SerialPacketReader:
+
+    def __init__(self, source, protocol=None, max_buffer_size=DEFAULT_MAX_BUFFER_SIZE):
+        # source is either a pyserial port (read/in_waiting) or anything with a readline() like the simulator
+        # protocol is detected from the first valid packet if not given
+        self.source = source
+        self.protocol = protocol
+        self.max_buffer_size = max_buffer_size
+        self.buffer = bytearray()
+        self.binary_decoder = BinaryFrameDecoder()
+        self.num_packets = 0
+        self.num_invalid_lines = 0
+
+    def reset(self):
+        self.buffer.clear()
+
+    def read_available(self):
+        if not hasattr(self.source, 'in_waiting'):
+            return self.source.readline()
+
+        # blocks until at least one byte arrived (or the port timeout elapsed), then drains the rest in one call
+        num_bytes = max(1, self.source.in_waiting)
+        return self.source.read(num_bytes)
+
+    def decode_text(self):
+        end = self.buffer.rfind(b'\n')
+        if end < 0:
+            if len(self.buffer) > self.max_buffer_size:
+                self.num_invalid_lines += 1
+                self.buffer.clear()
+            return []
+
+        lines = self.buffer[:end].split(b'\n')
+        del self.buffer[:end + 1]  # keep the incomplete tail for the next read
+
+        packets, num_invalid = parse_lines(lines)
+        self.num_invalid_lines += num_invalid
+        return packets
+
+    def decode_binary(self):
+        return self.binary_decoder.decode(self.buffer)
+
+    def read_packets(self):
+        data = self.read_available()
+        if data:
+            self.buffer += data
+            if self.protocol != PROTOCOL_BINARY and not hasattr(self.source, 'in_waiting') and not data.endswith(b'\n'):
+                self.buffer += b'\n'  # readline() sources strip the line ending
+
+        if self.protocol == PROTOCOL_BINARY:
+            packets = self.decode_binary()
+        elif self.protocol == PROTOCOL_TEXT:
+            packets = self.decode_text()
+        elif FRAME_SYNC in self.buffer:
+            # text lines are plain ASCII and never contain the sync bytes (e.g. the boot message before the first frame)
+            packets = self.decode_binary()
+            if packets:
+                self.protocol = PROTOCOL_BINARY
+        else:
+            packets = self.decode_text()
+            if packets:
+                self.protocol = PROTOCOL_TEXT
+
+        self.num_packets += len(packets)
+        return packets
+
+    @property
+    def finished(self):
+        # only finite sources (playbacks) end
+        return getattr(self.source, 'finished', False) and not self.buffer
+
+    def batches(self):
+        while not self.finished:
+            packets = self.read_packets()
+            if packets:
+                yield packets
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from config import *
+
+# binary session file (.esps): magic, header length (uint64), JSON header, then one column after the other,
+# every column starts at a COLUMN_ALIGNMENT boundary so that it can be memory mapped as it is
+
+SESSION_EXTENSION = ".esps"
+SESSION_MAGIC = b"ESPSESS\x00"
+SESSION_VERSION = 1
+COLUMN_ALIGNMENT = 64
+DEFAULT_SESSION_CACHE_DIR = "./session_cache"  # converted recordings of load_session(), git-ignored
+
+MAC_ID_DTYPE = np.dtype('<u2')  # MACs are stored once in the header, rows refer to them by index
+MAC_COLUMNS = {'monitor_mac': 'monitor_id', 'target_mac': 'target_id'}
+ANCHOR_COLUMNS = ('anchor_position_x', 'anchor_position_y')
+
+COLUMN_DTYPES = {
+    'timestamp': np.dtype('<f8'),
+    'monitor_id': MAC_ID_DTYPE,
+    'target_id': MAC_ID_DTYPE,
+    'rssi': np.dtype('i1'),
+}
+DEFAULT_COLUMN_DTYPE = np.dtype('<f4')  # positions and distances in cm / m
+
+SURVEY_COLUMNS = ['monitor_mac', 'target_position_x', 'target_position_y', 'anchor_position_x', 'anchor_position_y']
+
+
+def aligned(offset):
+    return (offset + COLUMN_ALIGNMENT - 1) // COLUMN_ALIGNMENT * COLUMN_ALIGNMENT
+
+def encode_columns(columns):
+    # dictionary encoding of the MAC columns, per monitor anchors move into the header if they never change,
+    # otherwise the header has no anchors and the anchor columns are stored as they are
+    columns = {name: np.asarray(values) for name, values in columns.items()}
+    mac_columns = [name for name in MAC_COLUMNS if name in columns]
+    macs = np.unique(np.concatenate([columns[name].astype(str) for name in mac_columns])) if mac_columns else np.empty(0, dtype=str)
+    if len(macs) > np.iinfo(MAC_ID_DTYPE).max + 1:
+        raise ValueError("Too many distinct MACs for a session file: " + str(len(macs)))
+
+    encoded = {}
+    for name, values in columns.items():
+        if name in MAC_COLUMNS:
+            encoded[MAC_COLUMNS[name]] = np.searchsorted(macs, values.astype(str)).astype(MAC_ID_DTYPE)
+        elif name == 'rssi':
+            encoded[name] = np.clip(np.rint(values.astype(np.float64)), -128, 127).astype(COLUMN_DTYPES[name])
+        else:
+            encoded[name] = values.astype(COLUMN_DTYPES.get(name, DEFAULT_COLUMN_DTYPE))
+
+    anchors = {}
+    if 'monitor_id' in encoded and all(name in encoded for name in ANCHOR_COLUMNS):
+        monitor_ids = encoded['monitor_id']
+        anchor_positions = np.column_stack([columns[name].astype(np.float64) for name in ANCHOR_COLUMNS])
+        for monitor_id in np.unique(monitor_ids):
+            positions = anchor_positions[monitor_ids == monitor_id]
+            if not np.all(positions == positions[0]):
+                anchors = {}
+                break
+            anchors[str(macs[monitor_id])] = [float(positions[0, 0]), float(positions[0, 1])]
+        else:
+            for name in ANCHOR_COLUMNS:
+                del encoded[name]
+
+    return [str(mac) for mac in macs], anchors, encoded
+
+def write_session(filepath, columns, environment=None):
+    # columns: name -> array as recorded (MAC strings, RSSI in dBm, ...), all of the same length
+    macs, anchors, encoded = encode_columns(columns)
+    num_rows = len(next(iter(encoded.values()))) if encoded else 0
+
+    header = {
+        'version': SESSION_VERSION,
+        'num_rows': int(num_rows),
+        'environment': CURRENT_ENV if environment is None else environment,
+        'macs': macs,
+        'anchors': anchors,
+        'column_names': list(columns.keys()),  # as recorded, the order of to_dataframe()
+        'columns': {},
+    }
+
+    # the offsets depend on the header length and the header contains the offsets, so the header gets a fixed size
+    header['columns'] = {name: {'dtype': values.dtype.str, 'offset': 0} for name, values in encoded.items()}
+    header_size = aligned(len(SESSION_MAGIC) + 8 + len(json.dumps(header).encode('utf-8')) + 32 * len(encoded))
+    offset = header_size
+    for name, values in encoded.items():
+        header['columns'][name]['offset'] = offset
+        offset = aligned(offset + values.nbytes)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (header_size - len(SESSION_MAGIC) - 8 - len(header_bytes))
+
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'wb') as f:
+        f.write(SESSION_MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name, values in encoded.items():
+            f.seek(header['columns'][name]['offset'])
+            f.write(np.ascontiguousarray(values).tobytes())
+        f.truncate(offset)
+    os.replace(tmp_filepath, filepath)
+    return filepath
+
+def read_source(filepath):
+    # the formats the recording scripts write: .pkl, .csv or a ChunkedRecorder session directory
+    if os.path.isdir(filepath):
+        from recorder import read_session
+        return read_session(filepath)
+    if filepath.endswith('.pkl'):
+        return pd.read_pickle(filepath)
+    return pd.read_csv(filepath, index_col=False)
+
+def session_path(filepath):
+    return os.path.splitext(filepath.rstrip('/'))[0] + SESSION_EXTENSION
+
+def cached_session_path(filepath, cache_dir=DEFAULT_SESSION_CACHE_DIR):
+    # recordings of the same name in different directories get different files
+    name = os.path.basename(session_path(filepath))
+    path_key = hashlib.sha256(os.path.abspath(filepath).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, os.path.splitext(name)[0] + '_' + path_key + SESSION_EXTENSION)
+
+def convert_session(source_path, filepath=None, environment=None):
+    filepath = session_path(source_path) if filepath is None else filepath
+    df = read_source(source_path)
+    return write_session(filepath, {name: df[name].to_numpy() for name in df.columns}, environment)
+
+
+class Session:
+    # read only view of a session file, the columns are memory mapped (nothing is read until it is used)
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            magic = f.read(len(SESSION_MAGIC))
+            if magic != SESSION_MAGIC:
+                raise ValueError("Not a session file: " + filepath)
+            header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        if header['version'] != SESSION_VERSION:
+            raise ValueError("Unsupported session file version " + str(header['version']) + ": " + filepath)
+
+        self.num_rows = header['num_rows']
+        self.environment = header['environment']
+        self.macs = np.array(header['macs'], dtype=str)
+        self.anchors = {monitor_mac: tuple(position) for monitor_mac, position in header['anchors'].items()}
+        self.column_names = header['column_names']
+        self.columns = {}
+        for name, column in header['columns'].items():
+            if self.num_rows == 0:
+                self.columns[name] = np.empty(0, dtype=np.dtype(column['dtype']))
+            else:
+                self.columns[name] = np.memmap(filepath, dtype=np.dtype(column['dtype']), mode='r', offset=column['offset'], shape=(self.num_rows,))
+
+    def __len__(self):
+        return self.num_rows
+
+    def __contains__(self, name):
+        return name in self.column_names
+
+    def __getitem__(self, name):
+        # decoded column; the stored columns (ids, int8 RSSI, float32 positions) are available without a copy in self.columns
+        if name in self.columns:
+            return self.columns[name]
+        if name in MAC_COLUMNS:
+            return self.macs[self.columns[MAC_COLUMNS[name]]]
+        if name in ANCHOR_COLUMNS:
+            axis = ANCHOR_COLUMNS.index(name)
+            anchor_positions = np.array([self.anchors.get(mac, (np.nan, np.nan))[axis] for mac in self.macs], dtype=np.float64)
+            return anchor_positions[self.columns['monitor_id']]
+        raise KeyError(name)
+
+    def to_dataframe(self):
+        return pd.DataFrame({name: self[name] for name in self.column_names})
+
+    def get_anchors(self):
+        if self.anchors or not all(name in self.columns for name in ANCHOR_COLUMNS):
+            return dict(self.anchors)
+        # anchors moved during the recording: the first position of every monitor, in the order they appear
+        monitor_ids, first_rows = np.unique(self.columns['monitor_id'], return_index=True)
+        order = np.argsort(first_rows)
+        return {
+            str(self.macs[monitor_ids[idx]]): tuple(float(self.columns[name][first_rows[idx]]) for name in ANCHOR_COLUMNS)
+            for idx in order
+        }
+
+    def survey_medians(self):
+        # median RSSI per monitor and survey point (and anchor position), as the fingerprint scripts compute it;
+        # grouped on the integer ids, the MAC strings are only looked up for the result
+        groups = pd.DataFrame({
+            'monitor_id': self.columns['monitor_id'],
+            'target_position_x': self['target_position_x'].astype(np.float64),
+            'target_position_y': self['target_position_y'].astype(np.float64),
+            'anchor_position_x': self['anchor_position_x'],
+            'anchor_position_y': self['anchor_position_y'],
+            'rssi': self.columns['rssi'].astype(np.float64),
+        })
+        df_mean = groups.groupby(['monitor_id'] + SURVEY_COLUMNS[1:], as_index=False, sort=False)['rssi'].median()
+        df_mean.insert(0, 'monitor_mac', self.macs[df_mean.pop('monitor_id').to_numpy()])
+        df_mean = df_mean.rename(columns={'rssi': 'rssi_median'})
+        return df_mean.sort_values(SURVEY_COLUMNS, kind='stable', ignore_index=True)
+
+def load_session(filepath, cache_dir=None):
+    # a session file directly, or a recording (.csv / .pkl / session directory) through its converted
+    # session file in cache_dir, which is (re)written whenever it is missing or older than the recording;
+    # if cache_dir is not writable (read only checkout) the temporary directory is used instead
+    if filepath.endswith(SESSION_EXTENSION):
+        return Session(filepath)
+
+    cache_dir = cache_dir if cache_dir is not None else DEFAULT_SESSION_CACHE_DIR
+    source_mtime = os.path.getmtime(filepath)
+    for directory in (cache_dir, os.path.join(tempfile.gettempdir(), "prom_espnow_sessions")):
+        converted_path = cached_session_path(filepath, directory)
+        if os.path.exists(converted_path) and os.path.getmtime(converted_path) >= source_mtime:
+            return Session(converted_path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            convert_session(filepath, converted_path)
+            return Session(converted_path)
+        except OSError as e:
+            print("Could not write the session file " + converted_path + ": " + str(e))
+    raise OSError("No writable directory for the session file of " + filepath)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert recordings (.csv, .pkl or session directories) to session files")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--environment', default=None)
+    args = parser.parse_args()
+
+    for source_path in args.files:
+        filepath = convert_session(source_path, environment=args.environment)
+        source_size = sum(os.path.getsize(os.path.join(source_path, name)) for name in os.listdir(source_path)) if os.path.isdir(source_path) else os.path.getsize(source_path)
+        print(f"{source_path} -> {filepath} ({source_size / 1e6:.2f} MB -> {os.path.getsize(filepath) / 1e6:.2f} MB)")
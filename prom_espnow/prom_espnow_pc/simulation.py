@@ -4,6 +4,8 @@ import threading
 import time
 from queue import Queue
 import pandas as pd
+from serial_reader import ParsedPacket
+from session_format import *
 
 def get_test_anchors():
     anchor_positions_in_px = {
@@ -85,49 +87,234 @@ class ESPositionMainNodeSimulator:
         
         self.target_position = (x, y)
 
+TRAJECTORY_RANDOM_WALK = 'random_walk'
+TRAJECTORY_WAYPOINTS = 'waypoints'
+CM_PER_M = 100.0
+
+class ESPositionLoadSimulator:
+    # many targets at once, all RSSIs of a tick are generated in one go
+    # anchors, area and the returned positions are in cm like the anchors of the receiver, the simulation itself runs in m
+
+    def __init__(
+            self,
+            anchors,
+            num_targets=1000,
+            seed=0,
+            trajectory=TRAJECTORY_RANDOM_WALK,
+            area=None,
+            target_speed=1.0,
+            shadowing_std=2.0,
+            packet_loss=0.0,
+            tick_ms=100,
+            round_rssi=True,
+            real_time=False,
+            start_time=None
+        ):
+        self.rng = np.random.default_rng(seed)
+        self.monitor_macs = np.array(list(anchors.keys()))
+        self.anchor_positions = np.array(list(anchors.values()), dtype=np.float64).reshape(-1, 2) / CM_PER_M
+        self.target_macs = np.array([f"{0xaa0000000000 + idx:012x}" for idx in range(num_targets)])
+        self.target_indices = {target_mac: idx for idx, target_mac in enumerate(self.target_macs)}
+        self.trajectory = trajectory
+        self.target_speed = target_speed  # m/s
+        self.shadowing_std = shadowing_std  # dB
+        self.packet_loss = np.broadcast_to(np.asarray(packet_loss, dtype=np.float64), (len(self.monitor_macs),))  # per monitor
+        self.tick_ms = tick_ms
+        self.round_rssi = round_rssi
+        self.real_time = real_time
+
+        if area is None:
+            area = (self.anchor_positions.min(axis=0) * CM_PER_M, self.anchor_positions.max(axis=0) * CM_PER_M)
+        self.area_min = np.asarray(area[0], dtype=np.float64) / CM_PER_M
+        self.area_max = np.asarray(area[1], dtype=np.float64) / CM_PER_M
+
+        self.target_positions = self.random_positions(num_targets)
+        self.waypoints = self.random_positions(num_targets)
+        self.time = time.time() if start_time is None else start_time
+        self.pending_lines = []
+        # positions in cm at the end of the last generated tick, for scoring the estimates of packets read through the reader interface
+        self.ground_truth = self.target_positions * CM_PER_M
+        self.ground_truth_time = self.time
+
+    def random_positions(self, num):
+        return self.rng.uniform(self.area_min, self.area_max, size=(num, 2))
+
+    def move(self, dt):
+        if self.trajectory == TRAJECTORY_WAYPOINTS:
+            direction = self.waypoints - self.target_positions
+            distance = np.linalg.norm(direction, axis=1, keepdims=True)
+            step = np.minimum(distance, self.target_speed * dt)
+            self.target_positions += direction / np.maximum(distance, 1e-9) * step
+
+            reached = distance[:, 0] <= self.target_speed * dt
+            self.waypoints[reached] = self.random_positions(int(reached.sum()))
+        else:
+            self.target_positions += self.rng.normal(0.0, self.target_speed * dt, size=self.target_positions.shape)
+
+            # reflect at the borders of the area
+            self.target_positions = np.where(self.target_positions < self.area_min, 2 * self.area_min - self.target_positions, self.target_positions)
+            self.target_positions = np.where(self.target_positions > self.area_max, 2 * self.area_max - self.target_positions, self.target_positions)
+            self.target_positions = np.clip(self.target_positions, self.area_min, self.area_max)
+
+    def generate_tick(self):
+        # returns the packets of one tick as columns (in timestamp order) and the ground truth positions of all targets in cm
+        dt = self.tick_ms / 1000.0
+        self.move(dt)
+        tick_start = self.time
+        self.time += dt
+
+        distances = np.linalg.norm(self.target_positions[:, None, :] - self.anchor_positions[None, :, :], axis=2)
+        rssis = path_loss_model(np.maximum(distances, 0.1))
+        if self.shadowing_std > 0.0:
+            rssis = rssis + self.rng.normal(0.0, self.shadowing_std, size=rssis.shape)
+        if self.round_rssi:
+            rssis = np.round(rssis)
+
+        received = self.rng.random(rssis.shape) >= self.packet_loss
+        target_ids, monitor_ids = np.nonzero(received)
+        timestamps = tick_start + self.rng.random(len(target_ids)) * dt
+        order = np.argsort(timestamps)
+
+        batch = {
+            'timestamp': timestamps[order],
+            'target_id': target_ids[order],
+            'monitor_id': monitor_ids[order],
+            'rssi': rssis[target_ids, monitor_ids][order],
+        }
+        self.ground_truth = self.target_positions * CM_PER_M
+        self.ground_truth_time = self.time
+        return batch, self.ground_truth
+
+    def read_packets(self):
+        # same interface as SerialPacketReader.read_packets
+        if self.real_time:
+            time.sleep(self.tick_ms / 1000.0)
+
+        batch, _ = self.generate_tick()
+        return list(map(ParsedPacket, batch['timestamp'], self.monitor_macs[batch['monitor_id']], self.target_macs[batch['target_id']], batch['rssi']))
+
+    def get_ground_truth(self, target_mac):
+        # position in cm of the target during the last tick
+        return self.ground_truth[self.target_indices[target_mac]]
+
+    def batches(self, num_ticks=None, with_ground_truth=False):
+        # with_ground_truth: (packets, positions in cm of all targets in the order of target_macs) per tick
+        tick = 0
+        while num_ticks is None or tick < num_ticks:
+            packets = self.read_packets()
+            yield (packets, self.ground_truth) if with_ground_truth else packets
+            tick += 1
+
+    def readline(self):
+        while not self.pending_lines:
+            self.pending_lines = [f"{packet.monitor_mac}_{packet.target_mac}:{packet.rssi}".encode("utf-8") for packet in self.read_packets()]
+            self.pending_lines.reverse()
+        return self.pending_lines.pop()
+
+PLAYBACK_REAL_TIME = 1.0
+PLAYBACK_MAX_SPEED = None
+DEFAULT_PLAYBACK_TICK_MS = 100
+
 class ESPositionMainNodePlayback:
 
-    def __init__(self, target_mac, filepath):
+    def __init__(self, target_mac, filepath, speed=PLAYBACK_REAL_TIME, tick_ms=DEFAULT_PLAYBACK_TICK_MS):
+        # speed: 1.0 real time, N for N times faster, PLAYBACK_MAX_SPEED (None) as fast as possible
+        # every batch covers tick_ms of the recording
         self.target_mac = target_mac
         self.filepath = filepath
-        self.message_queue = Queue(maxsize = 0)
-        
-        message_thread = threading.Thread(target=self.generate_messages_func, args=(filepath,), daemon=True)
-        message_thread.start()
-    
+        self.speed = speed
+        self.tick_ms = tick_ms
+
+        # memory mapped columns of the session file (converted from the .csv / .pkl on first use)
+        self.session = load_session(filepath)
+        self.macs = self.session.macs
+        self.timestamps = self.session['timestamp']
+        self.monitor_ids = self.session['monitor_id']
+        self.target_ids = self.session['target_id']
+        self.rssis = self.session['rssi']
+        if np.any(np.diff(self.timestamps) < 0):
+            order = np.argsort(self.timestamps, kind='stable')
+            self.timestamps = self.timestamps[order]
+            self.monitor_ids = self.monitor_ids[order]
+            self.target_ids = self.target_ids[order]
+            self.rssis = self.rssis[order]
+
+        self.pending_lines = []
+        self.rewind()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def finished(self):
+        return self.cursor >= len(self.timestamps) and not self.pending_lines
+
+    def rewind(self):
+        self.cursor = 0
+        self.start_time = None
+
+    def packets_between(self, start, end, timestamps):
+        # the MAC strings are only looked up for the rows that are played, RSSIs as ints like from the serial port
+        return list(map(ParsedPacket, timestamps, self.macs[self.monitor_ids[start:end]], self.macs[self.target_ids[start:end]], self.rssis[start:end].tolist()))
+
+    def wait_tick(self):
+        if self.speed is not PLAYBACK_MAX_SPEED:
+            time.sleep(self.tick_ms / 1000.0)
+
+    def read_packets(self):
+        # same interface as SerialPacketReader.read_packets, returns the rows that are due since the last call
+        # after the end it behaves like an idle port with a timeout: one tick of waiting, then nothing
+        if self.finished:
+            self.wait_tick()
+            return []
+
+        start = self.cursor
+
+        if self.speed is PLAYBACK_MAX_SPEED:
+            # recorded timestamps are kept, consumers use them as their clock
+            end = int(np.searchsorted(self.timestamps, self.timestamps[start] + self.tick_ms / 1000.0, side='left'))
+            end = max(end, start + 1)
+            self.cursor = end
+            return self.packets_between(start, end, self.timestamps[start:end])
+
+        if self.start_time is None:
+            self.start_time = time.time()
+        else:
+            self.wait_tick()
+
+        # rows up to the current playback position, timestamps are mapped onto the wall clock
+        first_timestamp = self.timestamps[0]
+        playback_position = first_timestamp + (time.time() - self.start_time) * self.speed
+        end = int(np.searchsorted(self.timestamps, playback_position, side='right'))
+        self.cursor = end
+
+        timestamps = self.start_time + (self.timestamps[start:end] - first_timestamp) / self.speed
+        return self.packets_between(start, end, timestamps)
+
+    def batches(self):
+        while not self.finished:
+            packets = self.read_packets()
+            if packets:
+                yield packets
+
+    def replay(self, callback):
+        # hands every batch straight to the callback, e.g. ReceiverPipeline.add_packets
+        num_packets = 0
+        for packets in self.batches():
+            callback(packets)
+            num_packets += len(packets)
+        return num_packets
+
     def readline(self):
-        return self.message_queue.get()
-    
-    def generate_messages_func(self, filepath):
-        df = pd.read_csv(filepath, index_col=False)
-        df_sorted = df.sort_values(by=['timestamp'], ascending=True)
-        from_timestamp = float(df_sorted['timestamp'].iloc[0])
-        last_time = time.time()
-    
-        while True:
-            current_time = time.time()
-            diff_time = current_time - last_time
-            
-            to_timestamp = from_timestamp + diff_time
-            
-            new_rows = df_sorted.loc[(df_sorted['timestamp'] >= from_timestamp) & (df_sorted['timestamp'] < to_timestamp)]
-            for index, row in new_rows.iterrows():
-                message = f"{row['monitor_mac']}_{row['target_mac']}:{row['rssi']}".encode("utf-8")
-                self.message_queue.put(message)
-            
-            
-            from_timestamp = to_timestamp
-            last_time = current_time
-            
-            time.sleep(100.0 / 1000.0)
+        # text line interface of the serial port, blocks until the next line is due
+        while not self.pending_lines:
+            if self.finished:
+                self.wait_tick()
+                return b''
+            self.pending_lines = [f"{packet.monitor_mac}_{packet.target_mac}:{packet.rssi}".encode("utf-8") for packet in self.read_packets()]
+            self.pending_lines.reverse()
+        return self.pending_lines.pop()
     
     def get_anchors(self):
-        df = pd.read_csv(self.filepath, index_col=False)
-        df_unique_monitors = df.drop_duplicates('monitor_mac')
-        
-        anchor_positions = {}
-        
-        for index, row in df_unique_monitors.iterrows():
-            anchor_positions[row['monitor_mac']] = (float(row['anchor_position_x']), float(row['anchor_position_y']))
-        
-        return anchor_positions
\ No newline at end of file
+        # from the session header, the recording is not read again
+        return self.session.get_anchors()
\ No newline at end of file
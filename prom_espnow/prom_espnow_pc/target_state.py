@@ -0,0 +1,212 @@
+import time
+import numpy as np
+from packet_store import MacInterner
+
+DEFAULT_INITIAL_STATES = 64
+DEFAULT_SMOOTHING = 0.01                # weight of a new estimate in the per algorithm moving average
+DEFAULT_ACCELERATION_VARIANCE = 50.0**2 # (cm/s^2)^2, white acceleration of the constant velocity track
+DEFAULT_MEASUREMENT_VARIANCE = 100.0**2 # cm^2 per axis of a single fix
+
+
+class TargetStateStore:
+    # per target state as rows of preallocated arrays, the row of a target is its interned id:
+    # fused track (position, velocity, 4x4 covariance of x, y, vx, vy, last update) and the last estimate of every algorithm
+    # rows of forgotten targets are reused, so the arrays are bounded by the targets alive at the same time
+
+    def __init__(
+            self,
+            initial_targets=DEFAULT_INITIAL_STATES,
+            smoothing=DEFAULT_SMOOTHING,
+            acceleration_variance=DEFAULT_ACCELERATION_VARIANCE,
+            measurement_variance=DEFAULT_MEASUREMENT_VARIANCE
+        ):
+        self.smoothing = smoothing
+        self.acceleration_variance = acceleration_variance
+        self.measurement_variance = measurement_variance
+
+        self.targets = MacInterner()
+        self.positions = np.full((initial_targets, 2), np.nan)
+        self.velocities = np.zeros((initial_targets, 2))
+        self.covariances = np.zeros((initial_targets, 4, 4))
+        self.last_update = np.full(initial_targets, np.nan)
+        self.estimates = {}  # algorithm -> (targets x 2), NaN until the first estimate
+        self.now = None      # time of the current localization pass (packet time in offline runs), wall clock if unset
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __contains__(self, target_mac):
+        return target_mac in self.targets
+
+    @property
+    def capacity(self):
+        return len(self.last_update)
+
+    def ensure_capacity(self, num_targets):
+        capacity = self.capacity
+        if num_targets <= capacity:
+            return
+        while capacity < num_targets:
+            capacity *= 2
+
+        def grow(array, fill):
+            grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self.positions = grow(self.positions, np.nan)
+        self.velocities = grow(self.velocities, 0.0)
+        self.covariances = grow(self.covariances, 0.0)
+        self.last_update = grow(self.last_update, np.nan)
+        self.estimates = {algorithm: grow(estimates, np.nan) for algorithm, estimates in self.estimates.items()}
+
+    def target_id(self, target_mac):
+        target_id = self.targets.intern(target_mac)
+        self.ensure_capacity(target_id + 1)
+        return target_id
+
+    def target_ids(self, target_macs):
+        target_ids = self.targets.intern_many(target_macs)
+        self.ensure_capacity(len(self.targets))
+        return target_ids
+
+    def forget(self, target_mac):
+        # the state is reset and the row is released for the next new target
+        target_id = self.targets.release(target_mac)
+        if target_id is None:
+            return
+        self.positions[target_id] = np.nan
+        self.velocities[target_id] = 0.0
+        self.covariances[target_id] = 0.0
+        self.last_update[target_id] = np.nan
+        for estimates in self.estimates.values():
+            estimates[target_id] = np.nan
+
+    def estimate_array(self, algorithm):
+        estimates = self.estimates.get(algorithm)
+        if estimates is None:
+            estimates = np.full((self.capacity, 2), np.nan)
+            self.estimates[algorithm] = estimates
+        return estimates
+
+    def get_estimate(self, target_mac, algorithm):
+        target_id = self.targets.lookup(target_mac)
+        if target_id is None or algorithm not in self.estimates:
+            return None
+        return self.estimates[algorithm][target_id]
+
+    def set_estimates(self, algorithm, target_ids, positions, smooth=True):
+        # blends the new estimates into the previous ones of the same targets, returns the stored estimates
+        # targets without a previous estimate take the new one, NaN rows (no fix) keep the previous estimate
+        target_ids = np.asarray(target_ids, dtype=np.intp)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        estimates = self.estimate_array(algorithm)
+
+        previous = estimates[target_ids]
+        updated = positions
+        if smooth:
+            updated = np.where(np.isnan(previous), positions, (1.0 - self.smoothing) * previous + self.smoothing * positions)
+        updated = np.where(np.isnan(positions), previous, updated)
+
+        estimates[target_ids] = updated
+        return updated
+
+    def current_time(self):
+        return time.time() if self.now is None else self.now
+
+    def update_tracks(self, target_ids, positions, now=None, measurement_variance=None):
+        # one constant velocity Kalman step per target, all targets at once; NaN positions only predict
+        # the fixes of several localizers at the same time are fused as independent measurements
+        now = self.current_time() if now is None else now
+        target_ids = np.asarray(target_ids, dtype=np.intp)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        measurement_variance = self.measurement_variance if measurement_variance is None else measurement_variance
+        measured = ~np.isnan(positions).any(axis=1)
+
+        # new targets start at their first fix without velocity
+        new = np.isnan(self.last_update[target_ids]) & measured
+        new_ids = target_ids[new]
+        self.positions[new_ids] = positions[new]
+        self.velocities[new_ids] = 0.0
+        self.covariances[new_ids] = np.diag([measurement_variance, measurement_variance, 1e4, 1e4])
+        self.last_update[new_ids] = now
+
+        tracked = ~np.isnan(self.last_update[target_ids]) & ~new
+        ids = target_ids[tracked]
+        if len(ids) == 0:
+            return self.positions[target_ids]
+
+        dts = np.maximum(now - self.last_update[ids], 0.0)
+        F = np.tile(np.eye(4), (len(ids), 1, 1))
+        F[:, 0, 2] = dts
+        F[:, 1, 3] = dts
+        q = self.acceleration_variance
+        Q = np.zeros((len(ids), 4, 4))
+        Q[:, [0, 1], [0, 1]] = (q * dts**4 / 4.0)[:, None]
+        Q[:, [0, 1], [2, 3]] = (q * dts**3 / 2.0)[:, None]
+        Q[:, [2, 3], [0, 1]] = (q * dts**3 / 2.0)[:, None]
+        Q[:, [2, 3], [2, 3]] = (q * dts**2)[:, None]
+
+        states = np.concatenate((self.positions[ids], self.velocities[ids]), axis=1)
+        states = np.einsum('nij,nj->ni', F, states)
+        P = F @ self.covariances[ids] @ np.transpose(F, (0, 2, 1)) + Q
+
+        # measurement of the position only, H = [I 0]
+        z = positions[tracked]
+        update = measured[tracked]
+        S = P[:, :2, :2] + measurement_variance * np.eye(2)
+        K = P[:, :, :2] @ np.linalg.inv(S)
+        innovations = np.where(update[:, None], z - states[:, :2], 0.0)
+        states += np.einsum('nij,nj->ni', K, innovations)
+        P = np.where(update[:, None, None], P - K @ P[:, :2, :], P)
+
+        self.positions[ids] = states[:, :2]
+        self.velocities[ids] = states[:, 2:]
+        self.covariances[ids] = P
+        self.last_update[ids] = now
+        return self.positions[target_ids]
+
+    def update_track(self, target_id, position, now=None):
+        # update_tracks() for a single target in plain floats: x and y are independent (the covariance stays block
+        # diagonal over (x, vx) and (y, vy)), so the 4x4 filter is two 2x2 filters
+        now = self.current_time() if now is None else now
+        (z_x, z_y) = position
+        measured = z_x == z_x and z_y == z_y  # not NaN
+        last_update = self.last_update[target_id]
+        if last_update != last_update:
+            if measured:
+                self.update_tracks([target_id], [position], now)
+            return self.positions[target_id]
+
+        dt = max(now - last_update, 0.0)
+        q = self.acceleration_variance
+        r = self.measurement_variance
+        P = self.covariances[target_id]
+        for axis, z in ((0, z_x), (1, z_y)):
+            velocity_axis = axis + 2
+            p = self.positions[target_id, axis] + self.velocities[target_id, axis] * dt
+            v = self.velocities[target_id, axis]
+            a = P[axis, axis] + 2.0 * dt * P[axis, velocity_axis] + dt * dt * P[velocity_axis, velocity_axis] + q * dt**4 / 4.0
+            b = P[axis, velocity_axis] + dt * P[velocity_axis, velocity_axis] + q * dt**3 / 2.0
+            c = P[velocity_axis, velocity_axis] + q * dt * dt
+            if measured:
+                k_p = a / (a + r)
+                k_v = b / (a + r)
+                innovation = z - p
+                p += k_p * innovation
+                v += k_v * innovation
+                a, b, c = a - k_p * a, b - k_p * b, c - k_v * b
+            self.positions[target_id, axis] = p
+            self.velocities[target_id, axis] = v
+            P[axis, axis] = a
+            P[axis, velocity_axis] = P[velocity_axis, axis] = b
+            P[velocity_axis, velocity_axis] = c
+        self.last_update[target_id] = now
+        return self.positions[target_id]
+
+    def get_track(self, target_mac):
+        # position, velocity and covariance of a target, None if it has no track yet
+        target_id = self.targets.lookup(target_mac)
+        if target_id is None or np.isnan(self.last_update[target_id]):
+            return None
+        return self.positions[target_id], self.velocities[target_id], self.covariances[target_id]
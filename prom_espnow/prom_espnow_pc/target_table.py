@@ -0,0 +1,190 @@
+import time
+from collections import OrderedDict
+import numpy as np
+from aggregation import *
+from packet_store import RingBufferPacketStore
+
+DEFAULT_MAX_TARGETS = 256
+DEFAULT_TARGET_TTL = 60.0  # forget targets that were not seen for a minute
+
+
+class RingBufferWindow:
+    # aggregation interface (get_packet) over the ring of one (target, monitor) pair in the packet store of a TargetTable
+
+    __slots__ = ('table', 'target_id', 'monitor_id')
+
+    def __init__(self, table, target_id, monitor_id):
+        self.table = table
+        self.target_id = target_id
+        self.monitor_id = monitor_id
+
+    def get_packet(self, now=None):
+        now = time.time() if now is None else now
+        rssi = self.table.packet_store.aggregate_window(self.target_id, self.monitor_id, self.table.window_aggregate, self.table.max_age, now)
+        if rssi is None:
+            return None
+        return PacketItem(0, now, rssi)
+
+class RingBufferTarget:
+    # monitor mac -> RingBufferWindow for one target, what TargetTable[target_mac] returns with a packet store
+
+    def __init__(self, table, target_id):
+        self.table = table
+        self.target_id = target_id
+
+    def monitor_ids(self):
+        store = self.table.packet_store
+        return np.flatnonzero(store.counts[self.target_id, :len(store.monitors)] > 0)
+
+    def __len__(self):
+        return len(self.monitor_ids())
+
+    def __contains__(self, monitor_mac):
+        monitor_id = self.table.packet_store.monitors.lookup(monitor_mac)
+        return monitor_id is not None and monitor_id < self.table.packet_store.counts.shape[1] and self.table.packet_store.counts[self.target_id, monitor_id] > 0
+
+    def __getitem__(self, monitor_mac):
+        if monitor_mac not in self:
+            raise KeyError(monitor_mac)
+        return RingBufferWindow(self.table, self.target_id, self.table.packet_store.monitors.lookup(monitor_mac))
+
+    def keys(self):
+        return [self.table.packet_store.monitors.mac(monitor_id) for monitor_id in self.monitor_ids()]
+
+    def items(self):
+        return [(monitor_mac, self[monitor_mac]) for monitor_mac in self.keys()]
+
+
+class TargetTable:
+    # per target the aggregations of its monitors, bounded by an LRU limit and a time to live;
+    # by default the packets go into the rings of a RingBufferPacketStore (window_aggregate over the packets of the
+    # last max_age seconds when the scheduler asks), with an aggregation_factory every (target, monitor) gets its own object
+
+    def __init__(
+            self,
+            aggregation_factory=None,
+            max_targets=DEFAULT_MAX_TARGETS,
+            ttl=DEFAULT_TARGET_TTL,
+            allowlist=None,
+            packet_store=None,
+            window_aggregate=np.median,
+            max_age=DEFAULT_AGGREGATION_MAX_AGE
+        ):
+        self.aggregation_factory = aggregation_factory
+        self.max_targets = max_targets
+        self.ttl = ttl
+        self.allowlist = None if allowlist is None else {mac.lower() for mac in allowlist}
+        self.packet_store = None
+        if aggregation_factory is None:
+            self.packet_store = packet_store if packet_store is not None else RingBufferPacketStore()
+        self.window_aggregate = window_aggregate
+        self.max_age = max_age
+
+        self.targets = OrderedDict()  # target mac -> {monitor mac -> aggregation} or RingBufferTarget, least recently seen first
+        self.last_seen = {}
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __contains__(self, target_mac):
+        return target_mac in self.targets
+
+    def __getitem__(self, target_mac):
+        return self.targets[target_mac]
+
+    def keys(self):
+        return self.targets.keys()
+
+    def items(self):
+        return self.targets.items()
+
+    def is_allowed(self, target_mac):
+        return self.allowlist is None or target_mac.lower() in self.allowlist
+
+    def release(self, target_mac):
+        target_aggregations = self.targets.pop(target_mac)
+        del self.last_seen[target_mac]
+        if self.packet_store is not None:
+            self.packet_store.forget(target_mac)
+        else:
+            for aggregation in target_aggregations.values():
+                aggregation.release()
+
+    def touch(self, target_mac, now):
+        # the entry of a target seen at now (created if it is new) and the targets evicted to make room for it
+        evicted = []
+        entry = self.targets.get(target_mac)
+        if entry is None:
+            while self.targets and len(self.targets) >= self.max_targets:
+                evicted_mac = next(iter(self.targets))
+                self.release(evicted_mac)
+                evicted.append(evicted_mac)
+            if self.packet_store is None:
+                entry = {}
+            else:
+                entry = RingBufferTarget(self, self.packet_store.targets.intern(target_mac))
+            self.targets[target_mac] = entry
+        else:
+            self.targets.move_to_end(target_mac)
+        self.last_seen[target_mac] = now
+        return entry, evicted
+
+    def get_aggregation(self, target_mac, monitor_mac, now):
+        # with an aggregation_factory: returns the aggregation for the packet (None if the target is filtered) and the evicted targets
+        if not self.is_allowed(target_mac):
+            return None, []
+
+        target_aggregations, evicted = self.touch(target_mac, now)
+        aggregation = target_aggregations.get(monitor_mac)
+        if aggregation is None:
+            aggregation = self.aggregation_factory()
+            target_aggregations[monitor_mac] = aggregation
+
+        return aggregation, evicted
+
+    def add_packets(self, packets):
+        # returns the (target mac, monitor mac) pairs that received packets and the evicted targets
+        if self.packet_store is None:
+            pairs = []
+            evicted = []
+            for packet in packets:
+                aggregation, evicted_targets = self.get_aggregation(packet.target_mac, packet.monitor_mac, packet.timestamp)
+                evicted += evicted_targets
+                if aggregation is None:
+                    continue  # not on the allowlist
+                aggregation.add_packet(PacketItem(0, packet.timestamp, packet.rssi))
+                pairs.append((packet.target_mac, packet.monitor_mac))
+            return [pair for pair in dict.fromkeys(pairs) if pair[0] in self.targets], evicted
+
+        if self.allowlist is not None:
+            packets = [packet for packet in packets if self.is_allowed(packet.target_mac)]
+
+        # the LRU order follows the last packet of every target in the batch
+        last_seen = {}
+        for packet in packets:
+            last_seen.pop(packet.target_mac, None)
+            last_seen[packet.target_mac] = packet.timestamp
+        evicted = []
+        for target_mac, timestamp in last_seen.items():
+            evicted += self.touch(target_mac, timestamp)[1]
+        if evicted:
+            packets = [packet for packet in packets if packet.target_mac in self.targets]
+        if not packets:
+            return [], evicted
+
+        target_ids, monitor_ids = self.packet_store.add_packets(packets)
+        num_monitors = self.packet_store.counts.shape[1]
+        pair_ids = np.unique(target_ids * num_monitors + monitor_ids)
+        pairs = [(self.packet_store.targets.mac(target_id), self.packet_store.monitors.mac(monitor_id)) for target_id, monitor_id in zip(*np.divmod(pair_ids, num_monitors))]
+        return pairs, evicted
+
+    def evict_expired(self, now):
+        # the least recently seen targets come first, so stop at the first one that is still alive
+        evicted = []
+        while self.targets:
+            target_mac = next(iter(self.targets))
+            if now - self.last_seen[target_mac] <= self.ttl:
+                break
+            self.release(target_mac)
+            evicted.append(target_mac)
+        return evicted
@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+# the scripts import each other as top-level modules and read their data relative to prom_espnow_pc
+PC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PC_DIR)
+
+import session_format
+
+
+@pytest.fixture(autouse=True, scope='session')
+def session_cache_dir(tmp_path_factory):
+    # converted recordings go to a temporary directory instead of ./session_cache
+    cache_dir = session_format.DEFAULT_SESSION_CACHE_DIR
+    session_format.DEFAULT_SESSION_CACHE_DIR = str(tmp_path_factory.mktemp('session_cache'))
+    yield session_format.DEFAULT_SESSION_CACHE_DIR
+    session_format.DEFAULT_SESSION_CACHE_DIR = cache_dir
@@ -0,0 +1,104 @@
+import random
+import numpy as np
+import pytest
+from scipy.stats import trim_mean
+from aggregation import *
+
+
+def sliding_windows(num_packets, window_size, seed, integer=True):
+    rng = np.random.default_rng(seed)
+    rssis = rng.integers(-95, -30, size=num_packets).astype(float) if integer else rng.normal(-60.0, 8.0, size=num_packets)
+    for i, rssi in enumerate(rssis):
+        yield PacketItem(0, float(i), float(rssi)), rssis[max(0, i + 1 - window_size):i + 1]
+
+def test_skiplist_ranks_and_sums():
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    skiplist = IndexableSkiplist(64)
+    values = []
+    for _ in range(2000):
+        if values and rng.random() < 0.4:
+            value = values.pop(int(rng.integers(len(values))))
+            skiplist.remove(value)
+        else:
+            value = float(rng.integers(-100, -20))
+            values.append(value)
+            skiplist.insert(value)
+        expected = sorted(values)
+        assert len(skiplist) == len(expected)
+        assert list(skiplist) == expected
+        k = int(rng.integers(len(expected) + 1))
+        assert skiplist.prefix_sum(k) == sum(expected[:k])
+    assert [skiplist[i] for i in range(len(values))] == sorted(values)
+
+@pytest.mark.parametrize('window_size', [1, 2, 7, 50])
+def test_sliding_median(window_size):
+    aggregation = SlidingMedianPacketAggregation(window_size)
+    for item, window in sliding_windows(300, window_size, seed=window_size):
+        aggregation.add_packet(item)
+        assert aggregation.get_packet(item.timestamp).rssi == np.median(window)
+
+@pytest.mark.parametrize('percentile', [0.0, 10.0, 25.0, 50.0, 90.0, 100.0])
+def test_sliding_percentile(percentile):
+    aggregation = SlidingPercentilePacketAggregation(percentile, window_size=20)
+    for item, window in sliding_windows(300, 20, seed=1, integer=False):
+        aggregation.add_packet(item)
+        assert aggregation.get_packet(item.timestamp).rssi == pytest.approx(np.percentile(window, percentile))
+
+@pytest.mark.parametrize('trim', [0.0, 0.1, 0.25])
+def test_sliding_trimmed_mean(trim):
+    aggregation = SlidingTrimmedMeanPacketAggregation(trim, window_size=20)
+    for item, window in sliding_windows(300, 20, seed=2, integer=False):
+        aggregation.add_packet(item)
+        assert aggregation.get_packet(item.timestamp).rssi == pytest.approx(trim_mean(window, trim))
+
+def test_max_age_expires_packets():
+    aggregation = SlidingMedianPacketAggregation(10, max_age=2.0)
+    for t, rssi in [(0.0, -90.0), (1.0, -50.0), (2.5, -60.0)]:
+        aggregation.add_packet(PacketItem(0, t, rssi))
+    assert aggregation.get_packet(2.5).rssi == -55.0  # the packet at 0.0 is older than 2 s
+    assert aggregation.get_packet(3.2).rssi == -60.0
+    assert aggregation.get_packet(10.0) is None
+
+def test_kalman_filter_bank_matches_scalar_filters():
+    rng = np.random.default_rng(3)
+    num_streams = 20
+    process_variances = rng.uniform(1e-4, 1e-2, num_streams)
+    measurement_variances = rng.uniform(1.0, 20.0, num_streams)
+    bank = KalmanFilterBank(num_streams=4)  # grows on the way
+    bank.set_variances(np.arange(num_streams), process_variances, measurement_variances)
+    scalar = {}
+
+    for _ in range(50):
+        # batches with several packets of the same stream, applied in batch order
+        stream_ids = rng.integers(0, num_streams, size=int(rng.integers(1, 40)))
+        measurements = rng.normal(-65.0, 8.0, size=len(stream_ids)).round()
+        estimates = bank.update(stream_ids, measurements)
+        for stream_id, measurement in zip(stream_ids, measurements):
+            if stream_id not in scalar:
+                scalar[stream_id] = KalmanFilter(process_variances[stream_id], measurement_variances[stream_id], measurement)
+            scalar[stream_id].update(measurement)
+        np.testing.assert_allclose(estimates, [scalar[stream_id].estimated_measurement for stream_id in stream_ids], rtol=1e-12)
+
+    for stream_id, kalman_filter in scalar.items():
+        assert bank.get_estimates([stream_id])[0] == pytest.approx(kalman_filter.estimated_measurement, rel=1e-12)
+        assert bank.error_estimates[stream_id] == pytest.approx(kalman_filter.error_estimate, rel=1e-12)
+
+def test_kalman_aggregation_starts_at_the_first_rssi_and_shares_the_bank():
+    bank = KalmanFilterBank(num_streams=1)
+    first = KalmanFilterPacketAggregation(bank)
+    second = KalmanFilterPacketAggregation(bank, measurement_variance=2.0)
+    assert first.get_packet(0.0) is None
+
+    reference = KalmanFilter(DEFAULT_PROCESS_VARIANCE, DEFAULT_MEASUREMENT_VARIANCE, -80.0)
+    for rssi in [-80.0, -82.0, -79.0, -85.0]:
+        first.add_packet(PacketItem(0, 0.0, rssi))
+        reference.update(rssi)
+    second.add_packet(PacketItem(0, 0.0, -60.0))
+    assert first.get_packet(1.0).rssi == pytest.approx(reference.estimated_measurement)
+    assert second.get_packet(1.0).rssi == -60.0
+    assert bank.measurement_variances[second.stream_id] == 2.0
+
+    first.release()
+    assert KalmanFilterPacketAggregation(bank).stream_id == first.stream_id
+    assert not bank.initialized[first.stream_id]
@@ -0,0 +1,47 @@
+import os
+import shutil
+import numpy as np
+import pytest
+from conftest import PC_DIR
+from calibration_pipeline import *
+
+CALIBRATIONS = [
+    os.path.join(PC_DIR, "calibrations", "2024_09_17_17_20_23_distance_1_to_4_m.csv"),
+    os.path.join(PC_DIR, "calibrations", "2024_09_22_00_07_58_distance_6m_more_detailed.csv"),
+]
+
+
+def test_weighted_fit_matches_repeated_points():
+    distances = np.array([1.0, 2.0, 3.0, 4.0])
+    means = np.array([-50.0, -56.0, -58.5, -61.0])
+    weights = np.array([2.0, 0.0, 1.0, 3.0])
+    for model in (MODEL_LOG, MODEL_LINEAR):
+        weighted = fit_parameters(model, distances, means[None, :], weights[None, :])
+        repeated = fit_parameters(model, np.repeat(distances, weights.astype(int)), np.repeat(means, weights.astype(int)))
+        for name in weighted:
+            np.testing.assert_allclose(weighted[name], repeated[name])
+
+def test_pooled_intervals_include_the_spread_between_files():
+    # every file alone is exact, only the offset between the files is uncertain
+    distances = [1.0, 2.0, 4.0]
+    statistics = [
+        {'distances': distances, 'counts': [100] * 3, 'means': list(-50.0 + offset - 20.0 * np.log10(distances)), 'stds': [0.0] * 3}
+        for offset in (-3.0, 0.0, 3.0, 1.0)
+    ]
+    fit = pooled_fits(statistics, 500, 0.95)[MODEL_LOG]
+    assert fit['num_files'] == 4
+    assert fit['l0_ci'][1] - fit['l0_ci'][0] > 1.0
+    assert fit['exp'] == pytest.approx(2.0)
+
+def test_changed_confidence_reprocesses_the_files(tmp_path):
+    for file_path in CALIBRATIONS:
+        shutil.copy(file_path, tmp_path)
+    output_path = str(tmp_path / "path_loss_parameters.json")
+
+    first = run_calibration(str(tmp_path), output_path, num_bootstrap=50, confidence=0.95, max_workers=1)
+    assert all(result['confidence'] == 0.95 for result in first['files'].values())
+    second = run_calibration(str(tmp_path), output_path, num_bootstrap=50, confidence=0.5, max_workers=1)
+    assert all(result['confidence'] == 0.5 for result in second['files'].values())
+
+    registry = PathLossRegistry.load(output_path)
+    assert set(registry.models) == set(second['monitors'])
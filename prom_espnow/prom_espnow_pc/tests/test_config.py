@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from conftest import PC_DIR
+import config
+from config import *
+
+
+@pytest.fixture(autouse=True)
+def in_pc_dir(monkeypatch):
+    # the backgrounds are read relative to prom_espnow_pc
+    monkeypatch.chdir(PC_DIR)
+
+def test_px_m_round_trip_of_scalars_and_arrays():
+    environment = get_environment()
+    assert environment.px_per_m == pytest.approx(environment.size_px[0] / ENVIRONMENTS[CURRENT_ENV][1])
+
+    assert env_to_m(env_to_px(2.5)) == pytest.approx(2.5)
+    assert env_to_px(env_to_m(410.0)) == pytest.approx(410.0)
+    assert env_to_px(1.0) == pytest.approx(environment.px_per_m)
+
+    positions = np.array([[0.0, 0.0], [38.18, 746.88], [755.98, 810.25]])
+    np.testing.assert_allclose(env_to_px(env_to_m(positions)), positions)
+    assert env_to_m(positions).shape == positions.shape
+    np.testing.assert_allclose(env_to_m(positions), positions / environment.px_per_m)
+
+def test_get_environment_is_cached(monkeypatch):
+    monkeypatch.setattr(config, 'environments', {})
+    environment = get_environment()
+    assert get_environment() is environment
+    assert get_environment(CURRENT_ENV) is environment
+
+    # the background is read from disk once
+    assert environment.background is environment.background
+    assert get_env_background_image() is environment.background
+    monkeypatch.setattr(config.Image, 'open', None)
+    assert env_to_m(env_to_px(1.0)) == pytest.approx(1.0)
+
+def test_unknown_environment():
+    with pytest.raises(KeyError):
+        get_environment("no such floor")
@@ -0,0 +1,83 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import PC_DIR
+from localization import *
+
+SURVEY = os.path.join(PC_DIR, "fingerprint_maps", "2024_11_06_21_59_36.pkl")
+AREA = (819, 870)
+
+
+@pytest.fixture
+def survey(tmp_path):
+    survey = str(tmp_path / os.path.basename(SURVEY))
+    shutil.copy(SURVEY, survey)
+    return survey
+
+def build(survey, cache_dir, **settings):
+    settings = {'heatmap_resolution': 40.0, **settings}
+    return FingerprintingLocalization(survey, AREA, smooth=False, cache_dir=cache_dir, **settings)
+
+def forbid_rebuild(monkeypatch):
+    def rebuild(*args, **kwargs):
+        raise AssertionError("the maps were interpolated again")
+    monkeypatch.setattr(FingerprintingLocalization, 'generate_interpolated_fingerprints', rebuild)
+
+def test_second_construction_hits_the_cache(survey, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    first = build(survey, cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    forbid_rebuild(monkeypatch)
+    second = build(survey, cache_dir)
+    assert second.monitor_macs == first.monitor_macs
+    np.testing.assert_array_equal(second.fingerprints, first.fingerprints)
+    np.testing.assert_array_equal(second.pos_lookup_x, first.pos_lookup_x)
+    pd.testing.assert_frame_equal(second.fingerprint_medians.reset_index(drop=True), first.fingerprint_medians.reset_index(drop=True), check_dtype=False)
+
+@pytest.mark.parametrize('settings', [{'heatmap_resolution': 50.0}, {'interpolation': 'rbf'}, {'interpolation': IdwInterpolation(power=3.0)}])
+def test_changed_settings_miss_the_cache(survey, tmp_path, settings):
+    cache_dir = str(tmp_path / "cache")
+    build(survey, cache_dir, interpolation=IdwInterpolation())
+    build(survey, cache_dir, **settings)
+    assert len(os.listdir(cache_dir)) == 2
+
+def test_changed_survey_misses_the_cache(survey, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    first = build(survey, cache_dir)
+
+    df = pd.read_pickle(survey)
+    df.loc[df.index[:len(df) // 2], 'rssi'] -= 10.0
+    df.to_pickle(survey)
+    second = build(survey, cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+    assert not np.array_equal(second.fingerprints, first.fingerprints)
+
+def test_entry_without_meta_is_ignored(survey, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    first = build(survey, cache_dir)
+    (entry,) = os.listdir(cache_dir)
+    os.remove(os.path.join(cache_dir, entry, 'meta.json'))  # as if the process died while saving
+    assert FingerprintMapCache(cache_dir).load(entry) is None
+
+    second = build(survey, cache_dir)
+    np.testing.assert_array_equal(second.fingerprints, first.fingerprints)
+    assert os.path.exists(os.path.join(cache_dir, entry, 'meta.json'))
+
+    forbid_rebuild(monkeypatch)
+    build(survey, cache_dir)
+
+def test_cache_key_depends_on_content_and_settings(survey, tmp_path):
+    copy = str(tmp_path / "copy.pkl")
+    shutil.copy(survey, copy)
+    key = fingerprint_cache_key(survey, heatmap_resolution=5.0)
+    assert fingerprint_cache_key(copy, heatmap_resolution=5.0) == key  # the path does not matter
+    assert fingerprint_cache_key(survey, heatmap_resolution=10.0) != key
+
+def test_same_settings_by_name_hit_the_cache(survey, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    build(survey, cache_dir, interpolation=IdwInterpolation())
+    forbid_rebuild(monkeypatch)
+    build(survey, cache_dir, interpolation='idw')
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter
+from fingerprint_search import *
+
+
+def smooth_maps(num_y, num_x, num_monitors, seed, dtype=np.float64):
+    # RSSI like maps: smooth fields between -90 and -40 dBm
+    rng = np.random.default_rng(seed)
+    maps = gaussian_filter(rng.normal(size=(num_y, num_x, num_monitors)), sigma=(6, 6, 0))
+    maps = (maps - maps.min()) / (maps.max() - maps.min())
+    return (-90.0 + 50.0 * maps).astype(dtype)
+
+def full_search(maps, rssis, monitor_indices):
+    costs = np.sum((maps[:, :, monitor_indices].astype(np.float64) - rssis)**2, axis=2)
+    return costs.min()
+
+@pytest.mark.parametrize('shape', [(61, 47), (64, 64), (130, 97), (5, 300)])
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_exact_pyramid_search_matches_full_search(shape, dtype):
+    rng = np.random.default_rng(shape[0] * shape[1])
+    maps = smooth_maps(*shape, num_monitors=4, seed=shape[0], dtype=dtype)
+    search = FingerprintPyramidSearch(maps)
+    assert search.num_levels > 1
+
+    for _ in range(50):
+        monitor_indices = np.sort(rng.choice(4, size=int(rng.integers(1, 5)), replace=False))
+        if rng.random() < 0.5:
+            # queries taken from the map plus noise, and queries far from any cell
+            y, x = rng.integers(shape[0]), rng.integers(shape[1])
+            rssis = maps[y, x, monitor_indices].astype(np.float64) + rng.normal(0.0, 2.0, size=len(monitor_indices))
+        else:
+            rssis = rng.uniform(-100.0, -30.0, size=len(monitor_indices))
+
+        (cell_y, cell_x), distance = search.search(rssis, monitor_indices, SEARCH_EXACT)
+        expected = full_search(maps, rssis, monitor_indices)
+        assert distance**2 == pytest.approx(expected, rel=1e-12, abs=1e-9)
+        assert np.sum((maps[cell_y, cell_x, monitor_indices].astype(np.float64) - rssis)**2) == pytest.approx(expected, rel=1e-12, abs=1e-9)
+
+def test_approximate_search_returns_a_cell_of_the_map():
+    maps = smooth_maps(130, 97, 4, seed=3)
+    search = FingerprintPyramidSearch(maps)
+    (cell_y, cell_x), distance = search.search(maps[40, 50], np.arange(4), SEARCH_APPROXIMATE)
+    assert 0 <= cell_y < 130 and 0 <= cell_x < 97
+    assert distance >= 0.0
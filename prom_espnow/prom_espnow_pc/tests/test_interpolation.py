@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import numpy as np
+import pytest
+from conftest import PC_DIR
+from interpolation import *
+from session_format import load_session
+
+SURVEY = os.path.join(PC_DIR, "fingerprint_maps", "2024_11_06_22_12_16.pkl")  # 12 survey points per monitor
+BACKENDS = [RbfInterpolation(), LocalRbfInterpolation(neighbors=8), IdwInterpolation(), GridLinearInterpolation()]
+
+
+def survey_points(num_points=40, seed=0):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0.0, 800.0, size=(num_points, 2))
+    values = -40.0 - 20.0 * np.log10(1.0 + np.linalg.norm(points - 400.0, axis=1)) + rng.normal(0.0, 2.0, num_points)
+    return points[:, 0], points[:, 1], values
+
+@pytest.mark.parametrize('backend', BACKENDS, ids=lambda backend: backend.name)
+def test_backends_reproduce_the_survey_points(backend):
+    points_x, points_y, values = survey_points()
+    np.testing.assert_allclose(backend.interpolate(points_x, points_y, values, points_x, points_y), values, atol=1e-6)
+
+    # between the points the maps stay within the range of the survey
+    gx, gy = np.meshgrid(np.linspace(100.0, 700.0, 13), np.linspace(100.0, 700.0, 13))
+    interpolated = backend.interpolate(points_x, points_y, values, gx.ravel(), gy.ravel())
+    assert interpolated.shape == (gx.size,)
+    assert np.all(np.isfinite(interpolated))
+    if backend.name in ('idw', 'grid_linear'):
+        assert values.min() - 1e-9 <= interpolated.min() and interpolated.max() <= values.max() + 1e-9
+
+@pytest.mark.parametrize('backend', BACKENDS, ids=lambda backend: backend.name)
+def test_settings_identify_the_backend(backend):
+    settings = backend.settings()
+    assert settings['name'] == backend.name
+    assert INTERPOLATION_BACKENDS[backend.name] is type(backend)
+    assert get_interpolation(backend) is backend
+    assert get_interpolation(backend.name).settings()['name'] == backend.name
+    json.dumps(settings)  # part of the cache key
+
+def test_settings_change_with_the_parameters():
+    assert IdwInterpolation(power=2.0).settings() != IdwInterpolation(power=3.0).settings()
+    assert IdwInterpolation(neighbors=4).settings() != IdwInterpolation(neighbors=8).settings()
+    assert LocalRbfInterpolation(neighbors=16).settings() != LocalRbfInterpolation(neighbors=32).settings()
+    assert LocalRbfInterpolation(kernel='cubic').settings() != LocalRbfInterpolation().settings()
+    assert RbfInterpolation(function='cubic').settings() != RbfInterpolation().settings()
+    assert IdwInterpolation().settings() == get_interpolation('idw').settings()
+
+def test_evaluate_interpolation_on_the_survey(tmp_path):
+    survey = str(tmp_path / os.path.basename(SURVEY))
+    shutil.copy(SURVEY, survey)
+    df_mean = load_session(survey).survey_medians()
+    gx, gy = np.meshgrid(np.arange(0.0, 800.0, 100.0), np.arange(0.0, 800.0, 100.0))
+
+    results = evaluate_interpolation('idw', df_mean, gx.ravel(), gy.ravel(), holdout_fraction=0.2, seed=1)
+    assert set(results) == set(df_mean['monitor_mac'])
+    for monitor_mac, result in results.items():
+        num_points = int((df_mean['monitor_mac'] == monitor_mac).sum())
+        assert result['num_points'] == num_points
+        assert result['num_holdout'] == int(round(0.2 * num_points))
+        assert result['map_time'] >= 0.0
+        if result['num_holdout'] > 0 and num_points - result['num_holdout'] >= 3:
+            assert 0.0 <= result['mae'] <= result['rmse'] < 50.0  # dB, a sanity bound, the survey is sparse
+        else:
+            assert np.isnan(result['rmse']) and np.isnan(result['mae'])
+    assert any(np.isfinite(result['rmse']) for result in results.values())
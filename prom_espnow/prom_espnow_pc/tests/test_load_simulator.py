@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from simulation import ESPositionLoadSimulator, TRAJECTORY_WAYPOINTS
+from localization import TrilaterationLeastSquaresLocalization
+
+ANCHORS = {"000000000001": (0.0, 0.0), "000000000002": (800.0, 0.0), "000000000003": (0.0, 800.0), "000000000004": (800.0, 800.0)}
+
+
+def packet_tuples(packets):
+    return [(packet.timestamp, packet.monitor_mac, packet.target_mac, packet.rssi) for packet in packets]
+
+@pytest.mark.parametrize('trajectory', ['random_walk', TRAJECTORY_WAYPOINTS])
+def test_same_seed_gives_the_same_packets_and_ground_truth(trajectory):
+    first = ESPositionLoadSimulator(ANCHORS, num_targets=20, seed=5, trajectory=trajectory, packet_loss=0.3, start_time=100.0)
+    second = ESPositionLoadSimulator(ANCHORS, num_targets=20, seed=5, trajectory=trajectory, packet_loss=0.3, start_time=100.0)
+    for (first_packets, first_truth), (second_packets, second_truth) in zip(first.batches(10, with_ground_truth=True), second.batches(10, with_ground_truth=True)):
+        assert packet_tuples(first_packets) == packet_tuples(second_packets)
+        np.testing.assert_array_equal(first_truth, second_truth)
+
+    other = ESPositionLoadSimulator(ANCHORS, num_targets=20, seed=6, trajectory=trajectory, start_time=100.0)
+    assert packet_tuples(other.read_packets()) != packet_tuples(ESPositionLoadSimulator(ANCHORS, num_targets=20, seed=5, trajectory=trajectory, start_time=100.0).read_packets())
+
+def test_packet_rate_follows_targets_monitors_and_loss():
+    num_targets, num_ticks, tick_ms = 50, 40, 100
+    simulator = ESPositionLoadSimulator(ANCHORS, num_targets=num_targets, packet_loss=[0.0, 0.0, 0.5, 1.0], tick_ms=tick_ms, start_time=0.0)
+    batches = list(simulator.batches(num_ticks))
+
+    timestamps = np.array([packet.timestamp for packets in batches for packet in packets])
+    assert np.all(np.diff(timestamps) >= 0.0)
+    assert timestamps.min() >= 0.0 and timestamps.max() < num_ticks * tick_ms / 1000.0
+    expected_rate = num_targets * (1.0 + 1.0 + 0.5 + 0.0) / (tick_ms / 1000.0)
+    assert len(timestamps) / (num_ticks * tick_ms / 1000.0) == pytest.approx(expected_rate, rel=0.05)
+
+    per_monitor = {monitor_mac: sum(packet.monitor_mac == monitor_mac for packets in batches for packet in packets) for monitor_mac in ANCHORS}
+    assert per_monitor["000000000001"] == per_monitor["000000000002"] == num_targets * num_ticks
+    assert per_monitor["000000000004"] == 0
+
+def test_ground_truth_scores_the_packets_of_the_reader_interface():
+    # without noise a trilateration of the last tick hits the recorded ground truth
+    simulator = ESPositionLoadSimulator(ANCHORS, num_targets=5, shadowing_std=0.0, round_rssi=False, target_speed=0.0, area=((100.0, 100.0), (700.0, 700.0)), start_time=0.0)
+    packets = simulator.read_packets()
+    localizer = TrilaterationLeastSquaresLocalization(ANCHORS, smooth=False)
+    for target_mac in simulator.target_macs:
+        rssis = {packet.monitor_mac: packet.rssi for packet in packets if packet.target_mac == target_mac}
+        position = localizer.localize(rssis)
+        np.testing.assert_allclose(position, simulator.get_ground_truth(target_mac), atol=1.0)
+    assert simulator.ground_truth_time == pytest.approx(0.1)
@@ -0,0 +1,232 @@
+import os
+import shutil
+import numpy as np
+import pytest
+from conftest import PC_DIR
+from localization import *
+
+ANCHORS = {
+    "24a1602ccfab": (38.18080724876424, 746.8789126853377),
+    "a4cf12fdaea9": (755.9783772652386, 810.2518533772651),
+    "d8bfc0117c7d": (38.18080724876424, 30.0),
+    "483fda467e7a": (580.0, 500.0),
+}
+SURVEY = os.path.join(PC_DIR, "fingerprint_maps", "2024_11_06_21_59_36.pkl")
+
+
+def random_rssis(num_targets, monitor_macs, seed, missing=0.2):
+    rng = np.random.default_rng(seed)
+    rssis = rng.uniform(-85.0, -45.0, size=(num_targets, len(monitor_macs)))
+    rssis[rng.random(rssis.shape) < missing] = np.nan
+    return rssis
+
+def single_results(localizer, monitor_macs, rssis):
+    results = []
+    for row in rssis:
+        visible = {monitor_mac: rssi for monitor_mac, rssi in zip(monitor_macs, row) if not np.isnan(rssi)}
+        results.append(np.array(localizer.localize(visible), dtype=np.float64))
+    return np.array(results)
+
+@pytest.fixture(scope='module')
+def fingerprinting(tmp_path_factory):
+    survey = str(tmp_path_factory.mktemp('survey') / os.path.basename(SURVEY))
+    shutil.copy(SURVEY, survey)
+    return FingerprintingLocalization(survey, (819, 870), heatmap_resolution=20.0, smooth=False, cache_dir=None)
+
+@pytest.mark.parametrize('localizer_class', [
+    TrilaterationLeastSquaresLocalization,
+    TrilaterationWeightedCentroidLocalization,
+    GaussNewtonMultilaterationLocalization,
+])
+def test_localize_many_matches_localize(localizer_class):
+    # every visible subset has at least 3 anchors, so all targets get a fix
+    monitor_macs = list(ANCHORS.keys())
+    rssis = random_rssis(50, monitor_macs, seed=0, missing=0.0)
+    rssis[::3, 0] = np.nan
+
+    batched = localizer_class(ANCHORS, smooth=False).localize_many(monitor_macs, rssis)
+    single = single_results(localizer_class(ANCHORS, smooth=False), monitor_macs, rssis)
+    np.testing.assert_allclose(batched, single, atol=1e-6)
+
+def test_least_squares_reference_anchor_is_deterministic():
+    # the reference anchor follows the anchor order, not the order of the RSSI dict
+    rssis = {"483fda467e7a": -60.0, "24a1602ccfab": -70.0, "d8bfc0117c7d": -65.0, "a4cf12fdaea9": -75.0}
+    reversed_rssis = dict(reversed(list(rssis.items())))
+    first = TrilaterationLeastSquaresLocalization(ANCHORS, smooth=False).localize(rssis)
+    second = TrilaterationLeastSquaresLocalization(ANCHORS, smooth=False).localize(reversed_rssis)
+    np.testing.assert_array_equal(first, second)
+
+def test_fingerprinting_localize_many_matches_localize(fingerprinting, monkeypatch):
+    # the batched search reads the cached (cells x monitors) tensor, the per monitor maps are never stacked again
+    def no_restacking(self):
+        raise AssertionError("the fingerprint maps were rebuilt")
+    monkeypatch.setattr(FingerprintingLocalization, 'interpolated_fingerprints', property(no_restacking))
+
+    monitor_macs = fingerprinting.monitor_macs
+    rssis = random_rssis(40, monitor_macs, seed=1)
+    rssis[0] = np.nan
+    batched = fingerprinting.localize_many(monitor_macs, rssis)
+
+    single = single_results(fingerprinting, monitor_macs, rssis[1:])
+    assert np.isnan(batched[0]).all()
+
+    # compared by RSSI distance: with few visible monitors, cells can tie within float32 rounding
+    def rssi_distances(positions, rssis):
+        cells = np.searchsorted(fingerprinting.pos_lookup_y, positions[:, 1]) * len(fingerprinting.pos_lookup_x) + np.searchsorted(fingerprinting.pos_lookup_x, positions[:, 0])
+        diff = fingerprinting.fingerprints[cells].astype(np.float64) - rssis
+        return np.nansum(diff**2, axis=1)
+    np.testing.assert_allclose(rssi_distances(batched[1:], rssis[1:]), rssi_distances(single, rssis[1:]), atol=1e-2)
+    assert np.mean(np.all(batched[1:] == single, axis=1)) > 0.9
+
+def test_quantized_fingerprints_agree_with_float_fingerprints(fingerprinting, tmp_path):
+    survey = str(tmp_path / os.path.basename(SURVEY))
+    shutil.copy(SURVEY, survey)
+    quantized = FingerprintingLocalization(survey, (819, 870), heatmap_resolution=20.0, smooth=False, cache_dir=None, quantize=True)
+    assert quantized.fingerprints.dtype == np.int8
+
+    fingerprints = fingerprinting.fingerprints.astype(np.float64)
+    monitor_macs = fingerprinting.monitor_macs
+    (num_y, num_x) = fingerprinting.interpolated_fingerprints_shape
+    def cells(positions):
+        return np.searchsorted(fingerprinting.pos_lookup_y, positions[:, 1]) * num_x + np.searchsorted(fingerprinting.pos_lookup_x, positions[:, 0])
+
+    # the int8 maps are off by at most half a step per monitor, so the RSSI distance of the cell they pick
+    # is at most sqrt(monitors) steps above the best one (with few survey points, far apart cells can be that close)
+    rng = np.random.default_rng(2)
+    rssis = fingerprints + rng.normal(0.0, 2.0, size=fingerprints.shape)
+    distances = np.sqrt(((fingerprints[None, :, :] - rssis[:, None, :])**2).sum(axis=2))
+    picked = distances[np.arange(len(rssis)), cells(quantized.localize_many(monitor_macs, rssis))]
+    assert np.all(picked <= distances.min(axis=1) + np.sqrt(len(monitor_macs)) * quantized.fingerprint_scale + 1e-3)
+
+    # where every cell beyond the neighbours is further than that from the fingerprint of a cell, both pick the same cell within one
+    (cell_y, cell_x) = np.unravel_index(np.arange(len(fingerprints)), (num_y, num_x))
+    far = (np.abs(cell_y[:, None] - cell_y[None, :]) > 1) | (np.abs(cell_x[:, None] - cell_x[None, :]) > 1)
+    separation = np.where(far, ((fingerprints[:, None, :] - fingerprints[None, :, :])**2).sum(axis=2), np.inf).min(axis=1)
+    separated = np.flatnonzero(separation > len(monitor_macs) * quantized.fingerprint_scale**2)
+    assert len(separated) >= 20
+    float_positions = fingerprinting.localize_many(monitor_macs, fingerprints[separated])
+    quantized_positions = quantized.localize_many(monitor_macs, fingerprints[separated])
+    assert np.all(np.abs(quantized_positions - float_positions) <= 20.0)
+
+def test_least_squares_anchors_are_read_only():
+    localizer = TrilaterationLeastSquaresLocalization(ANCHORS, smooth=False)
+    with pytest.raises(TypeError):
+        localizer.anchor_positions["000000000001"] = (0.0, 0.0)
+
+    localizer.set_anchor_position("000000000001", (400.0, 400.0))
+    assert localizer.anchor_macs[-1] == "000000000001"
+    np.testing.assert_array_equal(localizer.anchor_array[-1], (400.0, 400.0))
+    assert "000000000001" not in ANCHORS
+
+@pytest.mark.parametrize('visible', [[], ["24a1602ccfab"], ["24a1602ccfab", "a4cf12fdaea9"]])
+def test_least_squares_without_enough_anchors_keeps_the_position(visible):
+    localizer = TrilaterationLeastSquaresLocalization(ANCHORS, smooth=False)
+    previous = localizer.localize({monitor_mac: -60.0 for monitor_mac in ANCHORS}, "t").copy()
+
+    assert np.array_equal(localizer.localize({monitor_mac: -60.0 for monitor_mac in visible}, "t"), previous)
+    assert np.isnan(localizer.localize_many(visible, np.full((1, len(visible)), -60.0))).all()
+
+def test_gauss_newton_warm_starts_per_target():
+    monitor_macs = list(ANCHORS.keys())
+    rssis = random_rssis(20, monitor_macs, seed=3, missing=0.0)
+    target_macs = [f"{idx:012x}" for idx in range(len(rssis))]
+
+    batched = GaussNewtonMultilaterationLocalization(ANCHORS, smooth=False)
+    single = GaussNewtonMultilaterationLocalization(ANCHORS, smooth=False)
+    for _ in range(2):
+        batched_positions = batched.localize_many(monitor_macs, rssis, target_macs=target_macs)
+        single_positions = np.array([single.localize(dict(zip(monitor_macs, row)), target_mac) for row, target_mac in zip(rssis, target_macs)])
+        np.testing.assert_allclose(batched_positions, single_positions, atol=1e-6)
+
+    # a target that briefly sees too few monitors gets no fix and keeps its warm start for the next solve
+    starts = batched.state.estimate_array(batched.start_key)[batched.state.target_ids(target_macs)].copy()
+    blind = rssis.copy()
+    blind[0, :2] = np.nan
+    previous_position = batched_positions[0]
+    batched_positions = batched.localize_many(monitor_macs, blind, target_macs=target_macs)
+    np.testing.assert_array_equal(batched_positions[0], previous_position)
+    np.testing.assert_array_equal(batched.state.estimate_array(batched.start_key)[batched.state.target_ids(target_macs[:1])], starts[:1])
+    for row, target_mac in zip(blind, target_macs):
+        single.localize({monitor_mac: rssi for monitor_mac, rssi in zip(monitor_macs, row) if not np.isnan(rssi)}, target_mac)
+
+    batched_positions = batched.localize_many(monitor_macs, rssis, target_macs=target_macs)
+    single_positions = np.array([single.localize(dict(zip(monitor_macs, row)), target_mac) for row, target_mac in zip(rssis, target_macs)])
+    np.testing.assert_allclose(batched_positions, single_positions, atol=1e-6)
+
+def test_least_squares_follows_path_loss_registry_changes():
+    # a model set after the localizer was created has to be used, like in a localizer created afterwards
+    rssis = {"483fda467e7a": -60.0, "24a1602ccfab": -70.0, "d8bfc0117c7d": -65.0, "a4cf12fdaea9": -75.0}
+    path_loss = PathLossRegistry()
+    localizer = TrilaterationLeastSquaresLocalization(ANCHORS, smooth=False, path_loss=path_loss)
+    before = localizer.localize(rssis)
+
+    path_loss.set_model("483fda467e7a", LogPathLossModel(l0=-40.0, exp=2.5))
+    after = localizer.localize(rssis)
+    fresh = TrilaterationLeastSquaresLocalization(ANCHORS, smooth=False, path_loss=path_loss).localize(rssis)
+    np.testing.assert_allclose(after, fresh)
+    assert not np.allclose(after, before)
+
+def write_survey_csv(filepath, fingerprints):
+    # fingerprints: (x, y) -> {monitor mac -> integer rssi}, three packets per monitor and survey point with that median
+    rows = []
+    for (x, y), rssis in fingerprints.items():
+        for monitor_mac, rssi in rssis.items():
+            for offset in (-1.0, 0.0, 1.0):
+                rows.append((1.7e9 + len(rows), monitor_mac, "da9ec7f55beb", rssi + offset, *ANCHORS[monitor_mac], x, y))
+    pd.DataFrame(rows, columns=['timestamp', 'monitor_mac', 'target_mac', 'rssi', 'anchor_position_x', 'anchor_position_y', 'target_position_x', 'target_position_y']).to_csv(filepath, index=False)
+
+def brute_force_wknn(fingerprints, monitor_macs, rssis, k, min_common_monitors):
+    # distance over the monitors that the query and the survey point both have, RMS over them
+    positions = []
+    for row in rssis:
+        visible = {monitor_mac: rssi for monitor_mac, rssi in zip(monitor_macs, row) if not np.isnan(rssi)}
+        candidates = []
+        for position, survey_rssis in fingerprints:
+            common = [monitor_mac for monitor_mac in visible if monitor_mac in survey_rssis]
+            if not common or len(common) < min(min_common_monitors, len(visible)):
+                continue
+            distance = np.sqrt(np.mean([(visible[monitor_mac] - survey_rssis[monitor_mac]) ** 2 for monitor_mac in common]))
+            candidates.append((distance, position))
+        if not candidates:
+            positions.append((np.nan, np.nan))
+            continue
+        candidates.sort(key=lambda candidate: candidate[0])
+        weights = np.array([1.0 / max(distance, 1e-6) for distance, _ in candidates[:k]])
+        points = np.array([position for _, position in candidates[:k]])
+        positions.append(weights @ points / np.sum(weights))
+    return np.array(positions)
+
+def test_wknn_matches_brute_force_over_all_surveys(tmp_path):
+    rng = np.random.default_rng(3)
+    monitor_macs = list(ANCHORS.keys())
+    surveys = []
+    # distinct survey RSSIs per monitor, so that no two survey points tie for a query
+    survey_rssis = {monitor_mac: iter(rng.permutation(np.arange(-85, -45))) for monitor_mac in monitor_macs}
+    for survey in range(2):
+        fingerprints = {}
+        for _ in range(8):
+            position = tuple(rng.uniform(0.0, 800.0, size=2))
+            # a survey point without some of the monitors, the second survey never saw the last monitor
+            seen = [monitor_mac for monitor_mac in monitor_macs[:4 - survey] if rng.random() > 0.25]
+            fingerprints[position] = {monitor_mac: float(next(survey_rssis[monitor_mac])) for monitor_mac in seen}
+        write_survey_csv(tmp_path / ("survey_" + str(survey) + ".csv"), fingerprints)
+        surveys += [(position, rssis) for position, rssis in fingerprints.items() if rssis]
+
+    localizer = WKNNFingerprintingLocalization(str(tmp_path / "*.csv"), k=3, smooth=False)
+    assert len(localizer.file_paths) == 2
+    assert len(localizer.survey_positions) == len(surveys)
+
+    rssis = random_rssis(60, monitor_macs, seed=4, missing=0.3)
+    expected = brute_force_wknn(surveys, monitor_macs, rssis, 3, DEFAULT_WKNN_MIN_COMMON_MONITORS)
+    np.testing.assert_allclose(localizer.localize_many(monitor_macs, rssis), expected, atol=1e-3)
+
+    # the single target path gives the same positions (None where nothing is visible)
+    single = WKNNFingerprintingLocalization([str(path) for path in sorted(tmp_path.glob("*.csv"))], k=3, smooth=False)
+    for row, position in zip(rssis, expected):
+        visible = {monitor_mac: rssi for monitor_mac, rssi in zip(monitor_macs, row) if not np.isnan(rssi)}
+        single.position = None
+        result = single.localize(visible)
+        if np.isnan(position).any():
+            assert result is None
+        else:
+            np.testing.assert_allclose(result, position, atol=1e-3)
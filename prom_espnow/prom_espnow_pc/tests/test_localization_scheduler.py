@@ -0,0 +1,84 @@
+from localization_scheduler import *
+from aggregation import PacketItem, DEFAULT_AGGREGATION_MAX_AGE
+
+MONITORS = ["000000000001", "000000000002", "000000000003", "000000000004"]
+
+
+class FixedAggregation:
+    def __init__(self, rssi):
+        self.rssi = rssi
+
+    def get_packet(self, now=None):
+        return None if self.rssi is None else PacketItem(0, now, self.rssi)
+
+
+def test_max_age_defaults_to_the_aggregation_window():
+    assert LocalizationScheduler().max_age == DEFAULT_AGGREGATION_MAX_AGE
+
+def test_repeated_packets_coalesce_into_one_dirty_entry():
+    scheduler = LocalizationScheduler(min_monitors=2)
+    for _ in range(100):
+        scheduler.mark_dirty("t", MONITORS[0])
+        scheduler.mark_dirty("t", MONITORS[1])
+    assert scheduler.dirty == {"t": set(MONITORS[:2])}
+    assert scheduler.due_targets(0.0) == (["t"], None)
+
+def test_incomplete_targets_wait_until_enough_monitors_report():
+    scheduler = LocalizationScheduler(min_monitors=3)
+    scheduler.mark_dirty("t", MONITORS[0])
+    scheduler.mark_dirty("t", MONITORS[1])
+
+    assert scheduler.due_targets(0.0) == ([], None)
+    assert "t" not in scheduler.dirty and scheduler.waiting == {"t": set(MONITORS[:2])}
+
+    scheduler.mark_dirty("t", MONITORS[1])  # still two monitors, stays parked
+    assert "t" not in scheduler.dirty
+    scheduler.mark_dirty("t", MONITORS[2])
+    assert not scheduler.waiting and scheduler.dirty["t"] == set(MONITORS[:3])
+    assert scheduler.due_targets(0.0) == (["t"], None)
+
+    aggregations = {monitor_mac: FixedAggregation(-60.0) for monitor_mac in MONITORS}
+    assert scheduler.collect_rssis("t", aggregations, 0.0) == {monitor_mac: -60.0 for monitor_mac in MONITORS[:3]}
+    assert not scheduler.dirty
+
+def test_rate_limited_targets_report_when_they_are_due():
+    scheduler = LocalizationScheduler(min_monitors=1, min_localization_interval=0.5)
+    aggregations = {MONITORS[0]: FixedAggregation(-60.0)}
+    scheduler.mark_dirty("t", MONITORS[0])
+    scheduler.collect_rssis("t", aggregations, 10.0)
+
+    scheduler.mark_dirty("t", MONITORS[0])
+    assert scheduler.due_targets(10.2) == ([], 10.5)
+    assert scheduler.due_targets(10.5) == (["t"], None)
+
+def test_expired_rssis_are_dropped():
+    scheduler = LocalizationScheduler(min_monitors=3, max_age=2.0)
+    aggregations = {monitor_mac: FixedAggregation(-60.0) for monitor_mac in MONITORS}
+    for monitor_mac in MONITORS:
+        scheduler.mark_dirty("t", monitor_mac)
+    assert len(scheduler.collect_rssis("t", aggregations, 0.0)) == 4
+
+    # only two monitors keep reporting, the RSSIs of the others are not reused past max_age
+    for now in (1.0, 1.5):
+        for monitor_mac in MONITORS[:2]:
+            scheduler.mark_dirty("t", monitor_mac)
+        assert len(scheduler.collect_rssis("t", aggregations, now)) == 4
+    for monitor_mac in MONITORS[:2]:
+        scheduler.mark_dirty("t", monitor_mac)
+    assert scheduler.collect_rssis("t", aggregations, 2.5) is None
+    assert set(scheduler.rssis["t"]) == set(MONITORS[:2])
+
+    # an aggregation that has nothing recent left removes its monitor as well
+    aggregations[MONITORS[1]].rssi = None
+    scheduler.mark_dirty("t", MONITORS[1])
+    scheduler.collect_rssis("t", aggregations, 3.0)
+    assert set(scheduler.rssis["t"]) == {MONITORS[0]}
+
+def test_without_max_age_rssis_are_kept():
+    scheduler = LocalizationScheduler(min_monitors=2, max_age=None)
+    aggregations = {monitor_mac: FixedAggregation(-60.0) for monitor_mac in MONITORS[:2]}
+    for monitor_mac in MONITORS[:2]:
+        scheduler.mark_dirty("t", monitor_mac)
+    scheduler.collect_rssis("t", aggregations, 0.0)
+    scheduler.mark_dirty("t", MONITORS[0])
+    assert len(scheduler.collect_rssis("t", aggregations, 100.0)) == 2
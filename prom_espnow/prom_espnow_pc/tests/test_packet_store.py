@@ -0,0 +1,87 @@
+import numpy as np
+from packet_store import *
+from target_table import TargetTable
+from aggregation import SlidingMedianPacketAggregation
+from serial_reader import ParsedPacket
+
+TARGETS = ["aa0000000001", "aa0000000002", "aa0000000003"]
+MONITORS = ["000000000001", "000000000002", "000000000003", "000000000004"]
+
+
+def sorted_window(store, target_mac, monitor_mac):
+    timestamps, rssis = store.window(store.targets.lookup(target_mac), store.monitors.lookup(monitor_mac))
+    order = np.argsort(timestamps)
+    return timestamps[order], rssis[order]
+
+def test_ring_wraps_around():
+    store = RingBufferPacketStore(window_size=5)
+    for idx in range(12):
+        store.add_packet(TARGETS[0], MONITORS[0], float(idx), -40.0 - idx)
+    timestamps, rssis = sorted_window(store, TARGETS[0], MONITORS[0])
+    np.testing.assert_array_equal(timestamps, [7.0, 8.0, 9.0, 10.0, 11.0])
+    np.testing.assert_array_equal(rssis, [-47.0, -48.0, -49.0, -50.0, -51.0])
+    assert store.counts[0, 0] == 12
+
+def test_batches_across_the_ring_end_match_single_packets():
+    rng = np.random.default_rng(0)
+    batched = RingBufferPacketStore(window_size=7, initial_targets=1, initial_monitors=1)
+    single = RingBufferPacketStore(window_size=7)
+    timestamp = 0.0
+    for batch_size in [3, 5, 1, 20, 6, 0, 11]:  # some batches hold more than a window per pair
+        packets = []
+        for _ in range(batch_size):
+            timestamp += 1.0
+            packets.append(ParsedPacket(timestamp, str(rng.choice(MONITORS)), str(rng.choice(TARGETS)), float(rng.integers(-90, -30))))
+        batched.add_packets(packets)
+        for packet in packets:
+            single.add_packet(packet.target_mac, packet.monitor_mac, packet.timestamp, packet.rssi)
+
+    for target_mac in TARGETS:
+        for monitor_mac in MONITORS:
+            for expected, actual in zip(sorted_window(single, target_mac, monitor_mac), sorted_window(batched, target_mac, monitor_mac)):
+                np.testing.assert_array_equal(actual, expected)
+
+def test_aggregate_drops_old_packets():
+    store = RingBufferPacketStore(window_size=10)
+    for idx in range(6):
+        store.add_packet(TARGETS[0], MONITORS[0], float(idx), -40.0 - idx)
+    store.add_packet(TARGETS[1], MONITORS[1], 1.0, -70.0)
+
+    medians = store.aggregate(max_age=2.0, now=5.0)
+    assert medians[0, 0] == np.median([-43.0, -44.0, -45.0])
+    assert np.isnan(medians[1, 1]) and np.isnan(medians[0, 1])
+    assert store.aggregate()[1, 1] == -70.0
+    assert store.aggregate_window(0, 0, max_age=2.0, now=5.0) == medians[0, 0]
+    assert store.aggregate_window(1, 1, max_age=2.0, now=5.0) is None
+
+def test_forgotten_targets_release_their_rings():
+    store = RingBufferPacketStore(window_size=4, initial_targets=2)
+    for target_mac in TARGETS[:2]:
+        store.add_packet(target_mac, MONITORS[0], 1.0, -50.0)
+    released = store.forget(TARGETS[0])
+    assert store.add_packet(TARGETS[2], MONITORS[1], 2.0, -60.0) == (released, 1)
+    assert store.counts[released, 0] == 0
+    assert store.counts.shape[0] == 2
+    assert store.get_rssis(TARGETS[2]) == {MONITORS[1]: -60.0}
+
+def test_target_table_on_the_ring_matches_the_median_aggregations():
+    rng = np.random.default_rng(1)
+    ring = TargetTable(packet_store=RingBufferPacketStore(window_size=8), max_age=1.5)
+    objects = TargetTable(lambda: SlidingMedianPacketAggregation(8, max_age=1.5))
+    timestamp = 0.0
+    for _ in range(30):
+        packets = []
+        for _ in range(int(rng.integers(1, 15))):
+            timestamp += float(rng.uniform(0.0, 0.1))
+            packets.append(ParsedPacket(timestamp, str(rng.choice(MONITORS)), str(rng.choice(TARGETS)), float(rng.integers(-90, -30))))
+        ring_pairs, _ = ring.add_packets(packets)
+        object_pairs, _ = objects.add_packets(packets)
+        assert sorted(ring_pairs) == sorted(object_pairs)
+
+        now = timestamp  # the clock of the sliding aggregations only moves forward
+        for target_mac in objects.keys():
+            assert sorted(ring[target_mac].keys()) == sorted(objects[target_mac].keys())
+            for monitor_mac, aggregation in objects[target_mac].items():
+                expected = aggregation.get_packet(now)
+                actual = ring[target_mac][monitor_mac].get_packet(now)
+                assert (expected is None and actual is None) or expected.rssi == actual.rssi
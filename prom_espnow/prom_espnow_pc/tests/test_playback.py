@@ -0,0 +1,82 @@
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from conftest import PC_DIR
+from simulation import *
+from serial_reader import SerialPacketReader
+from receiver_pipeline import ReceiverPipeline
+from localization_scheduler import LocalizationScheduler
+
+RECORDING = os.path.join(PC_DIR, "recordings", "2024_09_05_17_50_22_walk_through_flat.pkl")
+TARGET_MAC = "342eb61ec446"
+
+
+def copy_recording(tmp_path):
+    filepath = str(tmp_path / os.path.basename(RECORDING))
+    shutil.copy(RECORDING, filepath)
+    return filepath
+
+class CountingLocalization:
+    name = "count"
+
+    def __init__(self):
+        self.num_localizations = 0
+
+    def localize(self, rssis, target_mac=None):
+        self.num_localizations += 1
+
+def test_max_speed_replays_the_recording_in_order(tmp_path):
+    df = pd.read_pickle(RECORDING).sort_values('timestamp', kind='stable')
+    playback = ESPositionMainNodePlayback(TARGET_MAC, copy_recording(tmp_path), speed=PLAYBACK_MAX_SPEED)
+
+    packets = [packet for batch in playback.batches() for packet in batch]
+    assert [packet.timestamp for packet in packets] == df['timestamp'].tolist()
+    assert [packet.monitor_mac for packet in packets] == df['monitor_mac'].tolist()
+    assert [packet.rssi for packet in packets] == df['rssi'].astype(int).tolist()
+    assert playback.get_anchors() == {
+        monitor_mac: (rows['anchor_position_x'].iloc[0], rows['anchor_position_y'].iloc[0]) for monitor_mac, rows in df.groupby('monitor_mac')
+    }
+
+def test_max_speed_pipeline_replay_is_fast(tmp_path):
+    playback = ESPositionMainNodePlayback(TARGET_MAC, copy_recording(tmp_path), speed=PLAYBACK_MAX_SPEED)
+    localizer = CountingLocalization()
+    pipeline = ReceiverPipeline(playback, [localizer], scheduler=LocalizationScheduler(min_monitors=3))
+
+    start = time.perf_counter()
+    pipeline.run_offline(playback)
+    elapsed = time.perf_counter() - start
+
+    assert playback.finished
+    assert localizer.num_localizations > 0
+    assert elapsed < 0.5  # about 50 ms for the 3600 packets, with a lot of headroom for slow machines
+
+def test_finished_playback_does_not_spin(tmp_path):
+    playback = ESPositionMainNodePlayback(TARGET_MAC, copy_recording(tmp_path), speed=1000.0, tick_ms=20)
+    playback.cursor = len(playback)
+
+    start = time.perf_counter()
+    assert playback.read_packets() == []
+    assert playback.readline() == b''
+    assert time.perf_counter() - start >= 0.035  # one tick per call, like an idle port
+
+    reader = SerialPacketReader(playback)
+    assert reader.finished
+    assert list(reader.batches()) == []
+
+def test_line_interface_delivers_every_packet(tmp_path):
+    playback = ESPositionMainNodePlayback(TARGET_MAC, copy_recording(tmp_path), speed=PLAYBACK_MAX_SPEED)
+    reader = SerialPacketReader(playback)
+    assert sum(len(batch) for batch in reader.batches()) == len(playback)
+
+def test_empty_recording(tmp_path):
+    filepath = str(tmp_path / "empty.csv")
+    pd.DataFrame(columns=['timestamp', 'monitor_mac', 'target_mac', 'rssi', 'anchor_position_x', 'anchor_position_y']).to_csv(filepath, index=False)
+
+    playback = ESPositionMainNodePlayback(TARGET_MAC, filepath, speed=PLAYBACK_REAL_TIME, tick_ms=1)
+    assert len(playback) == 0
+    assert playback.finished
+    assert playback.read_packets() == []
+    assert list(playback.batches()) == []
+    assert playback.get_anchors() == {}
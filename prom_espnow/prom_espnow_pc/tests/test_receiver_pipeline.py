@@ -0,0 +1,99 @@
+import asyncio
+import time
+import numpy as np
+import pytest
+from receiver_pipeline import *
+from localization import *
+from serial_reader import ParsedPacket
+
+ANCHORS = {"000000000001": (0.0, 0.0), "000000000002": (800.0, 0.0), "000000000003": (0.0, 800.0), "000000000004": (800.0, 800.0)}
+TARGETS = ["aa0000000001", "aa0000000002"]
+
+
+class ListReader:
+    # packet reader over prepared batches, the timestamps are set when a batch is read
+    def __init__(self, batches, interval=0.0):
+        self.batches = list(batches)
+        self.interval = interval
+
+    @property
+    def finished(self):
+        return not self.batches
+
+    def read_packets(self):
+        time.sleep(self.interval)
+        now = time.time()
+        return [ParsedPacket(now, monitor_mac, target_mac, rssi) for monitor_mac, target_mac, rssi in self.batches.pop(0)]
+
+class RecordingLocalizer:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def localize(self, rssis, target_mac=None):
+        if self.fail:
+            raise RuntimeError("localization failed")
+        self.calls.append((time.time(), target_mac, dict(rssis)))
+
+    def localize_many(self, monitor_macs, rssis, mask=None, target_macs=None):
+        for target_mac, row in zip(target_macs, rssis):
+            self.localize(dict(zip(monitor_macs, row)), target_mac)
+
+def full_batch(rssi=-60.0):
+    return [(monitor_mac, target_mac, rssi) for target_mac in TARGETS for monitor_mac in ANCHORS]
+
+def run_for(pipeline, seconds):
+    async def main():
+        task = asyncio.create_task(pipeline.run())
+        await asyncio.wait([task], timeout=seconds)
+        pipeline.stop()
+        await task
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_packets_flow_from_the_reader_to_the_localizers(batch):
+    localizer = TrilaterationLeastSquaresLocalization(ANCHORS, smooth=False)
+    reader = ListReader([full_batch(-55.0 - i) for i in range(5)], interval=0.02)
+    pipeline = ReceiverPipeline(reader, [localizer], scheduler=LocalizationScheduler(min_monitors=3, min_localization_interval=0.0), batch=batch)
+    run_for(pipeline, 0.5)
+
+    assert set(pipeline.target_table.keys()) == set(TARGETS)
+    for target_mac in TARGETS:
+        assert np.isfinite(pipeline.state.get_estimate(target_mac, localizer.name)).all()
+        assert pipeline.state.get_track(target_mac) is not None
+    assert not pipeline.num_errors
+
+def test_due_timer_localizes_rate_limited_targets():
+    # the second batch arrives within the interval, only the timer brings the localization back
+    localizer = RecordingLocalizer()
+    reader = ListReader([full_batch(-60.0), full_batch(-70.0)])
+    pipeline = ReceiverPipeline(reader, [localizer], scheduler=LocalizationScheduler(min_monitors=3, min_localization_interval=0.2))
+    run_for(pipeline, 0.6)
+
+    for target_mac in TARGETS:
+        calls = [call for call in localizer.calls if call[1] == target_mac]
+        assert len(calls) == 2
+        assert calls[1][0] - calls[0][0] >= 0.2
+        assert all(rssi == -65.0 for rssi in calls[1][2].values())  # median of both packets
+    assert pipeline.due_timer is None or pipeline.due_timer.cancelled() or pipeline.due_timer.when() <= pipeline.loop.time()
+
+def test_expired_targets_are_forgotten():
+    localizer = RecordingLocalizer()
+    reader = ListReader([full_batch()])
+    pipeline = ReceiverPipeline(reader, [localizer], target_table=TargetTable(ttl=0.1), scheduler=LocalizationScheduler(min_monitors=3))
+    run_for(pipeline, 0.5)
+
+    assert len(localizer.calls) == len(TARGETS)
+    assert len(pipeline.target_table) == 0
+    assert not pipeline.scheduler.rssis and not pipeline.scheduler.last_localization
+    assert all(target_mac not in pipeline.state for target_mac in TARGETS)
+
+def test_failing_stage_is_reported_and_stops_the_pipeline():
+    reader = ListReader([full_batch() for _ in range(5)], interval=0.02)
+    pipeline = ReceiverPipeline(reader, [RecordingLocalizer(fail=True)], scheduler=LocalizationScheduler(min_monitors=3, min_localization_interval=0.0), max_consecutive_errors=2)
+    with pytest.raises(RuntimeError, match="localization failed"):
+        run_for(pipeline, 2.0)
+    assert pipeline.num_errors == {"localizing targets": 2}
+    assert "localization failed" in pipeline.last_error
+    assert not pipeline.running
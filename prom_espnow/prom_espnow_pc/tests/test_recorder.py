@@ -0,0 +1,94 @@
+import shutil
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from recorder import *
+
+
+def test_csv_export_keeps_integer_rssis(tmp_path):
+    session_dir = str(tmp_path / "session")
+    with ChunkedRecorder(session_dir, CALIBRATION_COLUMNS, chunk_rows=3) as recorder:
+        recorder.append(timestamp=1.0, monitor_mac="24a1602ccfab", distance=1.5, rssi=-61.0)
+        recorder.append_rows(
+            timestamp=np.array([2.0, 3.0, 4.0]),
+            monitor_mac=np.array(["24a1602ccfab", "a4cf12fdaea9", "d8bfc0117c7d"]),
+            distance=np.array([1.5, 2.0, 2.0]),
+            rssi=np.array([-70.0, -55.0, -90.0]),
+        )
+
+    export_session(session_dir, str(tmp_path / "export"), pickle=False, session=False)
+    with open(tmp_path / "export.csv") as f:
+        lines = f.read().splitlines()
+    assert [line.rsplit(',', 1)[1] for line in lines[1:]] == ["-61", "-70", "-55", "-90"]
+    assert pd.read_csv(tmp_path / "export.csv")['rssi'].dtype.kind == 'i'
+
+@pytest.mark.parametrize('mac', ["24a1602ccfab0", "24a1602ccf"])
+def test_invalid_macs_are_rejected(tmp_path, mac):
+    with ChunkedRecorder(str(tmp_path / "session"), RECORDING_COLUMNS) as recorder:
+        with pytest.raises(ValueError):
+            recorder.append(timestamp=1.0, monitor_mac=mac, target_mac="342eb61ec446", rssi=-60, anchor_position_x=0.0, anchor_position_y=0.0)
+        with pytest.raises(ValueError):
+            recorder.append_rows(
+                timestamp=np.array([1.0, 2.0]),
+                monitor_mac=np.array(["24a1602ccfab", "24a1602ccfab"]),
+                target_mac=np.array(["342eb61ec446", mac]),
+                rssi=np.array([-60, -61]),
+                anchor_position_x=np.zeros(2),
+                anchor_position_y=np.zeros(2),
+            )
+        assert recorder.total_rows == 0
+
+def calibration_rows(num_rows, start=0):
+    return dict(
+        timestamp=np.arange(start, start + num_rows, dtype=np.float64),
+        monitor_mac=np.array(["24a1602ccfab"] * num_rows),
+        distance=np.full(num_rows, 1.5),
+        rssi=-np.arange(start, start + num_rows) - 40,
+    )
+
+def wait_for_rows(session_dir, num_rows, timeout=5.0):
+    # the writer thread lists a chunk in the index once all of its files are written
+    deadline = time.time() + timeout
+    while True:
+        columns = read_session_columns(session_dir)
+        if len(columns['timestamp']) >= num_rows or time.time() > deadline:
+            return columns
+        time.sleep(0.01)
+
+def test_session_that_was_not_closed_can_be_read_up_to_the_last_flush(tmp_path):
+    session_dir = str(tmp_path / "session")
+    recorder = ChunkedRecorder(session_dir, CALIBRATION_COLUMNS, chunk_rows=4, flush_interval=60.0)
+    recorder.append_rows(**calibration_rows(6))  # one full chunk, two rows left in the buffers
+    recorder.flush()
+    recorder.append_rows(**calibration_rows(3, start=6))  # never flushed
+
+    columns = wait_for_rows(session_dir, 6)
+    np.testing.assert_array_equal(columns['timestamp'], np.arange(6.0))
+    np.testing.assert_array_equal(columns['rssi'], -np.arange(6) - 40)
+    assert list(columns['monitor_mac']) == ["24a1602ccfab"] * 6
+    assert columns['rssi'].dtype == RSSI_DTYPE
+
+def test_partial_chunk_is_written_after_the_flush_interval(tmp_path):
+    session_dir = str(tmp_path / "session")
+    with ChunkedRecorder(session_dir, CALIBRATION_COLUMNS, chunk_rows=1000, flush_interval=0.05) as recorder:
+        recorder.append_rows(**calibration_rows(3))
+        columns = wait_for_rows(session_dir, 3)
+        np.testing.assert_array_equal(columns['timestamp'], np.arange(3.0))
+
+def test_writer_errors_are_raised_to_the_caller(tmp_path):
+    session_dir = str(tmp_path / "session")
+    recorder = ChunkedRecorder(session_dir, CALIBRATION_COLUMNS, chunk_rows=2, flush_interval=60.0)
+    shutil.rmtree(session_dir)  # e.g. the disk went away
+    recorder.append_rows(**calibration_rows(2))
+    recorder.writer_thread.join(timeout=5.0)
+    assert not recorder.writer_thread.is_alive()
+
+    with pytest.raises(FileNotFoundError):
+        recorder.append_rows(**calibration_rows(2))
+    with pytest.raises(FileNotFoundError):
+        recorder.append(timestamp=1.0, monitor_mac="24a1602ccfab", distance=1.5, rssi=-61)
+    with pytest.raises(FileNotFoundError):
+        recorder.flush()
+    with pytest.raises(FileNotFoundError):
+        recorder.close()
@@ -0,0 +1,93 @@
+from serial_reader import *
+
+MONITOR_MAC = "24a1602ccfab"
+TARGET_MAC = "342eb61ec446"
+
+
+def frames(num_frames, first_sequence=0):
+    return [encode_frame(MONITOR_MAC, TARGET_MAC, -40 - i, first_sequence + i, 1000 * i) for i in range(num_frames)]
+
+def test_decode_frames():
+    decoder = BinaryFrameDecoder()
+    buffer = bytearray(b''.join(frames(3)))
+    packets = decoder.decode(buffer, timestamp=1.0)
+    assert [packet.rssi for packet in packets] == [-40.0, -41.0, -42.0]
+    assert packets[0] == ParsedPacket(1.0, MONITOR_MAC, TARGET_MAC, -40.0)
+    assert len(buffer) == 0
+    assert decoder.num_lost_frames == 0
+
+def test_resync_after_crc_error():
+    decoder = BinaryFrameDecoder()
+    encoded = frames(4)
+    corrupted = bytearray(encoded[1])
+    corrupted[FRAME_HEADER_LEN + 3] ^= 0xFF  # a flipped payload byte
+    buffer = bytearray(b'boot message\r\n' + encoded[0] + bytes(corrupted) + encoded[2] + encoded[3])
+
+    packets = decoder.decode(buffer, timestamp=1.0)
+    assert [packet.rssi for packet in packets] == [-40.0, -42.0, -43.0]
+    assert decoder.num_crc_errors == 1
+    assert decoder.num_lost_frames == 1  # the sequence number of the corrupted frame is missing
+    assert len(buffer) == 0
+
+def test_frames_split_across_reads():
+    decoder = BinaryFrameDecoder()
+    data = b'\x00\xa5' + b''.join(frames(3))  # garbage with a lone sync byte in front
+    buffer = bytearray()
+    packets = []
+    for start in range(0, len(data), 7):
+        buffer += data[start:start + 7]
+        packets += decoder.decode(buffer, timestamp=1.0)
+    assert [packet.rssi for packet in packets] == [-40.0, -41.0, -42.0]
+    assert decoder.num_crc_errors == 0
+
+class FakePort:
+    # pyserial like port that returns the given chunks one read() at a time
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, num_bytes):
+        return self.chunks.pop(0) if self.chunks else b''
+
+def test_parse_valid_lines():
+    assert parse_line(b"24a1602ccfab_342eb61ec446:-61", timestamp=2.0) == ParsedPacket(2.0, MONITOR_MAC, TARGET_MAC, -61.0)
+    assert parse_line(b"24A1602CCFAB_342eb61ec446:-61.5\r\n", timestamp=2.0).rssi == -61.5
+    assert parse_line(b"24a1602ccfab_342eb61ec446:7", timestamp=2.0).rssi == 7.0
+
+def test_parse_malformed_lines():
+    for line in [
+        b"",
+        b"\r\n",
+        b"24a1602ccfab_342eb61ec446:",           # no RSSI
+        b"24a1602ccfab_342eb61ec4",              # truncated
+        b"24a1602ccfab-342eb61ec446:-61",        # wrong separator
+        b"24a1602ccfab_342eb61ec446;-61",
+        b"24a1602ccfxb_342eb61ec446:-61",        # not hex
+        b"24a1602ccfab_342eb61ec446:-6a",
+        b"24a1602ccfab_342eb61ec446:--",         # only RSSI characters, but no number
+        b"Monitor node started",
+    ]:
+        assert parse_line(line, timestamp=1.0) is None, line
+
+def test_parse_lines_counts_invalid_lines():
+    packets, num_invalid = parse_lines([b"24a1602ccfab_342eb61ec446:-61\r", b"", b"garbage", b"24a1602ccfab_342eb61ec446:-62"], timestamp=1.0)
+    assert [packet.rssi for packet in packets] == [-61.0, -62.0]
+    assert num_invalid == 1  # empty lines are not counted
+
+def test_text_line_split_across_reads():
+    reader = SerialPacketReader(FakePort([b"24a1602ccfab_342eb61ec446:-61\r\n24a1602cc", b"fab_342eb61ec446:-6", b"2.5\r\n"]))
+    assert [packet.rssi for packet in reader.read_packets()] == [-61.0]
+    assert reader.protocol == PROTOCOL_TEXT
+    assert reader.read_packets() == []
+    packets = reader.read_packets()
+    assert [(packet.monitor_mac, packet.target_mac, packet.rssi) for packet in packets] == [(MONITOR_MAC, TARGET_MAC, -62.5)]
+    assert reader.num_invalid_lines == 0 and not reader.buffer
+
+def test_text_garbage_without_newline_is_dropped():
+    reader = SerialPacketReader(FakePort([b"x" * 100, b"24a1602ccfab_342eb61ec446:-61\n"]), max_buffer_size=50)
+    assert reader.read_packets() == []
+    assert reader.num_invalid_lines == 1 and not reader.buffer
+    assert [packet.rssi for packet in reader.read_packets()] == [-61.0]
@@ -0,0 +1,67 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from conftest import PC_DIR
+from session_format import *
+
+RECORDING = os.path.join(PC_DIR, "recordings", "2024_09_05_17_50_22_walk_through_flat.csv")
+
+
+def test_round_trip_matches_read_csv(tmp_path, session_cache_dir):
+    recording = str(tmp_path / os.path.basename(RECORDING))
+    shutil.copy(RECORDING, recording)
+    expected = pd.read_csv(recording, index_col=False)
+
+    session = load_session(recording)
+    df = session.to_dataframe()
+    assert list(df.columns) == list(expected.columns)
+    assert len(session) == len(expected)
+    for name in expected.columns:
+        if pd.api.types.is_numeric_dtype(expected[name]):
+            np.testing.assert_allclose(df[name].to_numpy(np.float64), expected[name].to_numpy(np.float64), rtol=1e-6)
+        else:
+            assert (df[name].astype(str).to_numpy() == expected[name].astype(str).to_numpy()).all()
+
+    # converted into the cache, nothing is written next to the recording
+    assert os.listdir(tmp_path) == [os.path.basename(RECORDING)]
+    assert os.path.dirname(session.filepath) == session_cache_dir
+
+def test_unwritable_cache_dir_falls_back_to_the_temporary_directory(tmp_path):
+    recording = str(tmp_path / os.path.basename(RECORDING))
+    shutil.copy(RECORDING, recording)
+    (tmp_path / "not_a_directory").write_text("")
+
+    session = load_session(recording, cache_dir=str(tmp_path / "not_a_directory" / "cache"))
+    assert len(session) == len(pd.read_csv(recording, index_col=False))
+
+def test_moving_anchors_are_kept_per_row(tmp_path):
+    columns = {
+        'timestamp': np.array([0.0, 1.0, 2.0, 3.0]),
+        'monitor_mac': np.array(["d8bfc0117c7d", "24a1602ccfab", "24a1602ccfab", "d8bfc0117c7d"]),
+        'target_mac': np.array(["342eb61ec446"] * 4),
+        'rssi': np.array([-60.0, -61.0, -62.0, -63.0]),
+        'anchor_position_x': np.array([10.0, 20.0, 25.0, 10.0]),
+        'anchor_position_y': np.array([0.0, 5.0, 5.0, 0.0]),
+    }
+    session = Session(write_session(str(tmp_path / "moving.esps"), columns))
+
+    assert session.anchors == {}
+    np.testing.assert_array_equal(session['anchor_position_x'], columns['anchor_position_x'])
+    np.testing.assert_array_equal(session['anchor_position_y'], columns['anchor_position_y'])
+    assert session.get_anchors() == {"d8bfc0117c7d": (10.0, 0.0), "24a1602ccfab": (20.0, 5.0)}
+    assert list(session.get_anchors()) == ["d8bfc0117c7d", "24a1602ccfab"]
+
+def test_constant_anchors_move_into_the_header(tmp_path):
+    columns = {
+        'timestamp': np.array([0.0, 1.0]),
+        'monitor_mac': np.array(["d8bfc0117c7d", "24a1602ccfab"]),
+        'rssi': np.array([-60.0, -61.0]),
+        'anchor_position_x': np.array([10.0, 20.0]),
+        'anchor_position_y': np.array([0.0, 5.0]),
+    }
+    session = Session(write_session(str(tmp_path / "constant.esps"), columns))
+
+    assert 'anchor_position_x' not in session.columns
+    assert session.anchors == {"d8bfc0117c7d": (10.0, 0.0), "24a1602ccfab": (20.0, 5.0)}
+    np.testing.assert_array_equal(session['anchor_position_x'], columns['anchor_position_x'])
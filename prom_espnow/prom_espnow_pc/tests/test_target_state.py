@@ -0,0 +1,62 @@
+import os
+import shutil
+import numpy as np
+from conftest import PC_DIR
+from target_state import *
+from localization import *
+from receiver_pipeline import ReceiverPipeline
+from localization_scheduler import LocalizationScheduler
+from target_table import TargetTable
+from simulation import ESPositionMainNodePlayback, PLAYBACK_MAX_SPEED
+
+RECORDING = os.path.join(PC_DIR, "recordings", "2024_09_05_17_50_22_walk_through_flat.pkl")
+
+
+def test_forgotten_rows_are_reused():
+    state = TargetStateStore(initial_targets=4)
+    for idx in range(1000):
+        target_mac = f"{idx:012x}"
+        target_id = state.target_id(target_mac)
+        assert np.isnan(state.positions[target_id]).all()
+        assert state.get_estimate(target_mac, "tri_ls") is None or np.isnan(state.get_estimate(target_mac, "tri_ls")).all()
+        state.set_estimates("tri_ls", [target_id], [(idx, idx)])
+        state.update_tracks([target_id], [(idx, idx)], now=float(idx))
+        if idx >= 2:
+            state.forget(f"{idx - 2:012x}")  # at most three targets alive at once
+    assert state.capacity == 4
+    assert len(state.targets.ids) == 2
+
+def test_single_track_update_matches_batched():
+    rng = np.random.default_rng(0)
+    single = TargetStateStore()
+    batched = TargetStateStore()
+    now = 0.0
+    for step in range(200):
+        now += rng.uniform(0.05, 0.3)
+        position = (rng.normal(100.0 + 50.0 * now, 80.0), rng.normal(300.0 - 20.0 * now, 80.0)) if step % 7 else (np.nan, np.nan)
+        single.update_track(single.target_id("t"), position, now)
+        batched.update_tracks(batched.target_ids(["t"]), [position], now)
+
+    for single_value, batched_value in zip(single.get_track("t"), batched.get_track("t")):
+        np.testing.assert_allclose(single_value, batched_value, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(single.velocities[0], (50.0, -20.0), atol=15.0)
+
+def test_pipeline_shares_one_store_and_tracks_targets(tmp_path):
+    recording = str(tmp_path / os.path.basename(RECORDING))
+    shutil.copy(RECORDING, recording)
+    playback = ESPositionMainNodePlayback("342eb61ec446", recording, speed=PLAYBACK_MAX_SPEED)
+    anchors = playback.get_anchors()
+
+    localizers = [TrilaterationLeastSquaresLocalization(anchors), TrilaterationWeightedCentroidLocalization(anchors)]
+    pipeline = ReceiverPipeline(playback, localizers, scheduler=LocalizationScheduler(min_monitors=3))
+    assert all(localizer.state is pipeline.state for localizer in localizers)
+
+    end = pipeline.run_offline(playback)
+    position, velocity, covariance = pipeline.state.get_track("342eb61ec446")
+    assert np.isfinite(position).all() and np.isfinite(velocity).all()
+    assert pipeline.state.last_update[pipeline.state.targets.lookup("342eb61ec446")] <= end
+
+    # eviction releases the row
+    pipeline.forget("342eb61ec446")
+    assert "342eb61ec446" not in pipeline.state
+    assert pipeline.state.get_track("342eb61ec446") is None
@@ -0,0 +1,58 @@
+import pytest
+from target_table import *
+from serial_reader import ParsedPacket
+
+MONITOR = "000000000001"
+
+
+def ring_table(**kwargs):
+    return TargetTable(**kwargs)
+
+def object_table(**kwargs):
+    return TargetTable(lambda: SlidingMedianPacketAggregation(10), **kwargs)
+
+def packets(*targets_and_times):
+    return [ParsedPacket(timestamp, MONITOR, target_mac, -60.0) for target_mac, timestamp in targets_and_times]
+
+
+@pytest.mark.parametrize('make_table', [ring_table, object_table])
+def test_capacity_evicts_the_least_recently_seen_targets(make_table):
+    table = make_table(max_targets=3)
+    table.add_packets(packets(("a", 1.0), ("b", 2.0), ("c", 3.0)))
+    table.add_packets(packets(("a", 4.0)))  # a is the most recent one now
+
+    _, evicted = table.add_packets(packets(("d", 5.0)))
+    assert evicted == ["b"]
+    _, evicted = table.add_packets(packets(("e", 6.0), ("f", 7.0)))
+    assert evicted == ["c", "a"]
+    assert list(table.keys()) == ["d", "e", "f"]
+    assert all(table[target_mac][MONITOR].get_packet(7.0).rssi == -60.0 for target_mac in table.keys())
+
+@pytest.mark.parametrize('make_table', [ring_table, object_table])
+def test_targets_expire_after_the_ttl(make_table):
+    table = make_table(ttl=10.0)
+    table.add_packets(packets(("a", 0.0), ("b", 5.0), ("c", 8.0)))
+    table.add_packets(packets(("a", 9.0)))
+
+    assert table.evict_expired(10.0) == []
+    assert table.evict_expired(15.5) == ["b"]
+    assert table.evict_expired(18.5) == ["c"]
+    assert list(table.keys()) == ["a"] and "b" not in table
+
+def test_targets_outside_the_allowlist_are_rejected():
+    table = TargetTable(allowlist=["AA0000000001"])
+    pairs, evicted = table.add_packets(packets(("aa0000000001", 1.0), ("aa0000000002", 1.0)))
+    assert pairs == [("aa0000000001", MONITOR)] and evicted == []
+    assert list(table.keys()) == ["aa0000000001"]
+    assert table.packet_store.targets.lookup("aa0000000002") is None
+
+    objects = object_table(allowlist=["aa0000000001"])
+    assert objects.get_aggregation("aa0000000002", MONITOR, 1.0) == (None, [])
+    assert len(objects) == 0
+
+def test_evicted_targets_are_not_stored_when_the_batch_exceeds_the_capacity():
+    table = TargetTable(max_targets=2)
+    pairs, evicted = table.add_packets(packets(("a", 1.0), ("b", 2.0), ("c", 3.0)))
+    assert evicted == ["a"]
+    assert sorted(pairs) == [("b", MONITOR), ("c", MONITOR)]
+    assert table.packet_store.targets.lookup("a") is None
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from tracking import *
+from receiver_pipeline import ReceiverPipeline
+from localization_scheduler import LocalizationScheduler
+from simulation import ESPositionLoadSimulator
+
+ANCHORS = {"000000000001": (0.0, 0.0), "000000000002": (1000.0, 0.0), "000000000003": (0.0, 1000.0)}
+
+
+def test_predict_noise_of_the_constant_velocity_model():
+    # over dt: position += v dt + a dt^2 / 2, velocity += a dt; so std(position) = std(a) dt^2 / 2
+    tracker = ParticleFilterTracker(PathLossLikelihood(ANCHORS, (1e6, 1e6)), acceleration_std=10.0, max_speed=1e9, seed=0)
+    particles = np.zeros((200000, 4))
+    particles[:, :2] = 5e5
+    particles[:, 2] = 30.0
+    dt = 2.0
+
+    tracker.predict(particles, np.full(len(particles), dt))
+
+    assert np.mean(particles[:, 0] - 5e5) == pytest.approx(30.0 * dt, abs=0.2)
+    assert np.std(particles[:, :2] - 5e5, axis=0) == pytest.approx([0.5 * 10.0 * dt**2] * 2, rel=0.01)
+    assert np.std(particles[:, 3]) == pytest.approx(10.0 * dt, rel=0.01)
+
+def test_path_loss_likelihood_follows_registry_changes():
+    path_loss = PathLossRegistry()
+    likelihood = PathLossLikelihood(ANCHORS, (1000.0, 1000.0), path_loss=path_loss)
+    positions = np.array([[300.0, 400.0], [700.0, 100.0]])
+    columns = likelihood.columns(list(ANCHORS.keys()))
+
+    path_loss.set_model("000000000002", LinearPathLossModel())
+    expected = PathLossLikelihood(ANCHORS, (1000.0, 1000.0), path_loss=path_loss).expected_rssis(positions, columns)
+    np.testing.assert_allclose(likelihood.expected_rssis(positions, columns), expected)
+
+def expected_rssis(likelihood, positions):
+    return likelihood.expected_rssis(np.asarray(positions, dtype=np.float64), likelihood.columns(list(ANCHORS.keys())))
+
+def test_update_many_converges_on_static_targets():
+    likelihood = PathLossLikelihood(ANCHORS, (1000.0, 1000.0))
+    tracker = ParticleFilterTracker(likelihood, seed=0)
+    targets = ["0000000000aa", "0000000000bb"]
+    positions = np.array([[300.0, 400.0], [700.0, 200.0]])
+    rssis = expected_rssis(likelihood, positions)
+
+    tracker.update_many(targets, list(ANCHORS.keys()), rssis, now=0.0)
+    first_spreads = np.array([tracker.spreads[target_mac] for target_mac in targets])
+    for tick in range(1, 20):
+        estimates = tracker.update_many(targets, list(ANCHORS.keys()), rssis, now=0.1 * tick)
+
+    # the spread shrinks down to what the random acceleration of the motion model keeps up
+    np.testing.assert_allclose(estimates, positions, atol=30.0)
+    assert np.all(np.array([tracker.spreads[target_mac] for target_mac in targets]) < 0.6 * first_spreads)
+
+def test_resamples_only_when_the_effective_sample_size_is_low():
+    likelihood = PathLossLikelihood(ANCHORS, (1000.0, 1000.0))
+    tracker = ParticleFilterTracker(likelihood, min_particles=512, max_particles=512, seed=0)
+    monitor_macs = list(ANCHORS.keys())
+
+    # nothing visible: the weights stay uniform, the particles are only moved
+    tracker.update_many(["0000000000aa"], monitor_macs, np.full((1, 3), np.nan), now=0.0)
+    before = tracker.particles["0000000000aa"].copy()
+    tracker.update_many(["0000000000aa"], monitor_macs, np.full((1, 3), np.nan), now=0.0)
+    np.testing.assert_array_equal(tracker.particles["0000000000aa"], before)
+
+    # a measurement concentrates the weights on a few particles, which are drawn several times
+    tracker.update_many(["0000000000aa"], monitor_macs, expected_rssis(likelihood, [[300.0, 400.0]]), now=0.0)
+    particles = tracker.particles["0000000000aa"]
+    assert len(np.unique(particles, axis=0)) < len(particles) // 2
+    np.testing.assert_allclose(tracker.weights["0000000000aa"], 1.0 / 512)
+
+def test_particle_count_follows_the_spread():
+    likelihood = PathLossLikelihood(ANCHORS, (1000.0, 1000.0))
+    tracker = ParticleFilterTracker(likelihood, seed=0)
+    monitor_macs = list(ANCHORS.keys())
+    rssis = np.vstack((expected_rssis(likelihood, [[300.0, 400.0]]), np.full((1, 3), np.nan)))
+
+    for tick in range(20):
+        tracker.update_many(["0000000000aa", "0000000000bb"], monitor_macs, rssis, now=0.1 * tick)
+
+    # the located target needs fewer particles, the one without measurements stays spread over the area
+    assert DEFAULT_MIN_PARTICLES <= len(tracker.weights["0000000000aa"]) < DEFAULT_MAX_PARTICLES // 4
+    assert len(tracker.weights["0000000000bb"]) == DEFAULT_MAX_PARTICLES
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_receiver_pipeline_localizes_with_the_particle_filter(batch):
+    simulator = ESPositionLoadSimulator(ANCHORS, num_targets=3, shadowing_std=0.0, round_rssi=False, target_speed=0.0, area=((200.0, 200.0), (800.0, 800.0)), start_time=0.0)
+    tracker = ParticleFilterTracker(PathLossLikelihood(ANCHORS, (1000.0, 1000.0)), seed=0)
+    pipeline = ReceiverPipeline(None, [tracker], scheduler=LocalizationScheduler(min_monitors=3, min_localization_interval=0.0), batch=batch)
+    assert tracker.state is pipeline.state
+
+    for packets in simulator.batches(20):
+        pipeline.add_packets(packets)
+        pipeline.localize_due_targets(packets[-1].timestamp)
+
+    target_macs = list(simulator.target_macs)
+    estimates = pipeline.state.estimate_array("pf")[pipeline.state.target_ids(target_macs)]
+    np.testing.assert_allclose(estimates, [simulator.get_ground_truth(target_mac) for target_mac in target_macs], atol=30.0)
+
+    # an evicted target is dropped from the filter as well
+    pipeline.forget(target_macs[0])
+    assert target_macs[0] not in tracker
+    assert target_macs[1] in tracker
+
+def test_localize_many_without_targets_keeps_nothing():
+    likelihood = PathLossLikelihood(ANCHORS, (1000.0, 1000.0))
+    tracker = ParticleFilterTracker(likelihood, seed=0)
+    estimates = tracker.localize_many(list(ANCHORS.keys()), expected_rssis(likelihood, [[300.0, 400.0], [700.0, 200.0]]))
+    assert estimates.shape == (2, 2)
+    assert not tracker.particles
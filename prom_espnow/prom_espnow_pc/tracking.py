@@ -0,0 +1,264 @@
+import time
+import numpy as np
+from util import *
+from path_loss import *
+
+DEFAULT_MIN_PARTICLES = 256
+DEFAULT_MAX_PARTICLES = 4096
+DEFAULT_PARTICLE_DENSITY = 0.02     # particles per cm^2 of the 2 sigma ellipse of the estimate
+DEFAULT_ACCELERATION_STD = 50.0     # cm/s^2, random acceleration of the constant velocity motion model
+DEFAULT_MAX_SPEED = 300.0           # cm/s
+DEFAULT_RSSI_STD = 4.0              # dB, measurement noise of the likelihood
+DEFAULT_RESAMPLE_THRESHOLD = 0.5    # resample once the effective sample size drops below this fraction
+
+
+class FingerprintLikelihood:
+    # expected RSSIs from the interpolated fingerprint maps of a FingerprintingLocalization, looked up at the particle cells
+
+    def __init__(self, fingerprint_localization, rssi_std=DEFAULT_RSSI_STD):
+        self.rssi_std = rssi_std
+        self.pos_lookup_x = fingerprint_localization.pos_lookup_x
+        self.pos_lookup_y = fingerprint_localization.pos_lookup_y
+        self.resolution_x = self.pos_lookup_x[1] - self.pos_lookup_x[0]
+        self.resolution_y = self.pos_lookup_y[1] - self.pos_lookup_y[0]
+
+        self.monitor_indices = fingerprint_localization.monitor_indices
+        # the (cells x monitors) tensor of the localization, shared and possibly int8 quantized
+        self.fingerprints = fingerprint_localization.fingerprints
+        self.scale = fingerprint_localization.fingerprint_scale
+        self.offset = fingerprint_localization.fingerprint_offset
+
+    @property
+    def area(self):
+        return (self.pos_lookup_x[-1], self.pos_lookup_y[-1])
+
+    def columns(self, monitor_macs):
+        # index of every monitor in the maps, -1 for monitors without a map
+        return np.array([self.monitor_indices.get(monitor_mac, -1) for monitor_mac in monitor_macs], dtype=np.intp)
+
+    def expected_rssis(self, positions, columns):
+        cells_x = np.clip(np.rint(positions[:, 0] / self.resolution_x).astype(np.intp), 0, len(self.pos_lookup_x) - 1)
+        cells_y = np.clip(np.rint(positions[:, 1] / self.resolution_y).astype(np.intp), 0, len(self.pos_lookup_y) - 1)
+        values = self.fingerprints[cells_y * len(self.pos_lookup_x) + cells_x][:, np.maximum(columns, 0)]
+        return values.astype(np.float32) * self.scale + self.offset
+
+class PathLossLikelihood:
+    # expected RSSIs from the path loss models of the anchors
+
+    def __init__(self, anchor_positions, area, rssi_std=DEFAULT_RSSI_STD, path_loss=None):
+        self.area = area  # (width, height) in cm
+        self.rssi_std = rssi_std
+        self.path_loss = path_loss if path_loss is not None else PathLossRegistry()
+        self.monitor_indices = {monitor_mac: idx for idx, monitor_mac in enumerate(anchor_positions.keys())}
+        self.anchor_array = np.array(list(anchor_positions.values()), dtype=np.float64).reshape(-1, 2)
+        self.anchor_macs = list(anchor_positions.keys())
+        self.anchor_rows_key = None
+
+    @property
+    def anchor_rows(self):
+        # table rows of the anchors, looked up again once the registry got a model for a new monitor
+        key = (self.path_loss, self.path_loss.version)
+        if self.anchor_rows_key != key:
+            self._anchor_rows = self.path_loss.rows(self.anchor_macs)
+            self.anchor_rows_key = key
+        return self._anchor_rows
+
+    def columns(self, monitor_macs):
+        return np.array([self.monitor_indices.get(monitor_mac, -1) for monitor_mac in monitor_macs], dtype=np.intp)
+
+    def expected_rssis(self, positions, columns):
+        anchors = self.anchor_array[np.maximum(columns, 0)]
+        distances = np.linalg.norm(positions[:, None, :] - anchors[None, :, :], axis=2)
+        return self.path_loss.expected_rssis(self.anchor_rows[np.maximum(columns, 0)][None, :], np.maximum(distances, 1.0) / 100.0) # cm to m
+
+class ParticleFilterTracker:
+    # one particle set (x, y, vx, vy) per target, all targets of an update are processed as one flat array
+    # with contiguous segments, so the cost per update does not depend on the number of python calls per target;
+    # localize() / localize_many() / forget() make it a localizer of the ReceiverPipeline like the others
+
+    name = "pf" # key of the estimates in the target state store and the plotter
+
+    def __init__(
+            self,
+            likelihood,
+            area=None,
+            min_particles=DEFAULT_MIN_PARTICLES,
+            max_particles=DEFAULT_MAX_PARTICLES,
+            particle_density=DEFAULT_PARTICLE_DENSITY,
+            acceleration_std=DEFAULT_ACCELERATION_STD,
+            max_speed=DEFAULT_MAX_SPEED,
+            resample_threshold=DEFAULT_RESAMPLE_THRESHOLD,
+            plotter=None,
+            state=None,
+            seed=None
+        ):
+        self.likelihood = likelihood
+        self.area = area if area is not None else likelihood.area
+        self.min_particles = min_particles
+        self.max_particles = max_particles
+        self.particle_density = particle_density
+        self.acceleration_std = acceleration_std
+        self.max_speed = max_speed
+        self.resample_threshold = resample_threshold
+        self.plotter = plotter
+        self.state = state  # optional TargetStateStore that receives the "pf" estimates
+        self.rng = np.random.default_rng(seed)
+
+        self.particles = {}    # target mac -> (n x 4) float64
+        self.weights = {}      # target mac -> (n,) normalized
+        self.last_update = {}
+        self.estimates = {}    # target mac -> weighted mean position
+        self.spreads = {}      # target mac -> weighted std in x and y
+
+    def __contains__(self, target_mac):
+        return target_mac in self.particles
+
+    def current_time(self):
+        # the time of the localization pass if a pipeline shares its state store, the clock otherwise
+        return self.state.current_time() if self.state is not None else time.time()
+
+    def forget(self, target_mac):
+        self.particles.pop(target_mac, None)
+        self.weights.pop(target_mac, None)
+        self.last_update.pop(target_mac, None)
+        self.estimates.pop(target_mac, None)
+        self.spreads.pop(target_mac, None)
+
+    def init_target(self, target_mac, now):
+        # nothing is known about a new target, spread the maximum number of particles over the whole area
+        particles = np.zeros((self.max_particles, 4))
+        particles[:, 0] = self.rng.uniform(0.0, self.area[0], self.max_particles)
+        particles[:, 1] = self.rng.uniform(0.0, self.area[1], self.max_particles)
+        self.particles[target_mac] = particles
+        self.weights[target_mac] = np.full(self.max_particles, 1.0 / self.max_particles)
+        self.last_update[target_mac] = now
+
+    def localize(self, rssis, target_mac=None):
+        return self.update(target_mac, rssis)
+
+    def localize_many(self, monitor_macs, rssis, mask=None, target_macs=None):
+        if target_macs is not None:
+            return self.update_many(target_macs, monitor_macs, rssis, mask)
+
+        # without targets every row is a one-off estimate from the uniform prior, nothing is kept
+        rows = [("row", idx) for idx in range(len(np.atleast_2d(rssis)))]
+        estimates = self.filter_step(rows, monitor_macs, rssis, mask, self.current_time())
+        for row in rows:
+            self.forget(row)
+        return estimates
+
+    def update(self, target_mac, rssis, now=None):
+        monitor_macs = list(rssis.keys())
+        positions = self.update_many([target_mac], monitor_macs, np.array([[rssis[monitor_mac] for monitor_mac in monitor_macs]]), now=now)
+        position = positions[0]
+
+        if self.plotter is not None and self.plotter.tracked_target in (None, target_mac):
+            self.plotter.target_estimation["pf"] = position
+            self.plotter.new_data_available = True
+
+        return position
+
+    def update_many(self, target_macs, monitor_macs, rssis, mask=None, now=None):
+        # rssis: (n_targets x n_monitors) with the columns in the order of monitor_macs, returns the (n_targets x 2) estimates;
+        # with a state store the estimates are stored under "pf" and go into the fused tracks like the fixes of the localizers
+        now = self.current_time() if now is None else now
+        estimates = self.filter_step(target_macs, monitor_macs, rssis, mask, now)
+
+        if self.state is not None:
+            target_ids = self.state.target_ids(target_macs)
+            self.state.update_tracks(target_ids, estimates, now)
+            self.state.set_estimates(self.name, target_ids, estimates, smooth=False)
+
+        return estimates
+
+    def filter_step(self, target_macs, monitor_macs, rssis, mask, now):
+        rssis = np.atleast_2d(np.asarray(rssis, dtype=np.float64))
+        if mask is None:
+            mask = ~np.isnan(rssis)
+        columns = self.likelihood.columns(monitor_macs)
+        mask = np.asarray(mask, dtype=bool) & (columns >= 0)[None, :]
+        rssis = np.where(mask, rssis, 0.0)
+
+        for target_mac in target_macs:
+            if target_mac not in self.particles:
+                self.init_target(target_mac, now)
+
+        # flat layout: the particles of target s are rows offsets[s]:offsets[s + 1]
+        counts = np.array([len(self.weights[target_mac]) for target_mac in target_macs], dtype=np.intp)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        segments = np.repeat(np.arange(len(target_macs)), counts)
+        particles = np.concatenate([self.particles[target_mac] for target_mac in target_macs])
+        log_weights = np.log(np.concatenate([self.weights[target_mac] for target_mac in target_macs]))
+        dts = np.array([max(now - self.last_update[target_mac], 0.0) for target_mac in target_macs])
+
+        self.predict(particles, dts[segments])
+
+        # measurement update in the log domain, normalized per target
+        expected = self.likelihood.expected_rssis(particles[:, :2], columns)
+        residuals = np.where(mask[segments], expected - rssis[segments], 0.0)
+        log_weights += -0.5 * np.sum(residuals**2, axis=1) / self.likelihood.rssi_std**2
+        log_weights -= np.maximum.reduceat(log_weights, offsets[:-1])[segments]
+        weights = np.exp(log_weights)
+        weights /= np.add.reduceat(weights, offsets[:-1])[segments]
+
+        # weighted mean and spread per target
+        estimates = np.column_stack((
+            np.add.reduceat(weights * particles[:, 0], offsets[:-1]),
+            np.add.reduceat(weights * particles[:, 1], offsets[:-1]),
+        ))
+        deviations = particles[:, :2] - estimates[segments]
+        spreads = np.sqrt(np.column_stack((
+            np.add.reduceat(weights * deviations[:, 0]**2, offsets[:-1]),
+            np.add.reduceat(weights * deviations[:, 1]**2, offsets[:-1]),
+        )))
+
+        # fewer particles once the estimate is tight, more while it is uncertain
+        ellipse_areas = np.pi * 4.0 * spreads[:, 0] * spreads[:, 1]
+        new_counts = np.clip(np.rint(self.particle_density * ellipse_areas), self.min_particles, self.max_particles).astype(np.intp)
+        effective_sizes = 1.0 / np.add.reduceat(weights**2, offsets[:-1])
+        resample = (effective_sizes < self.resample_threshold * counts) | (new_counts != counts)
+        new_counts = np.where(resample, new_counts, counts)
+
+        indices = self.resample_indices(weights, segments, offsets, new_counts, resample)
+        particles = particles[indices]
+        new_offsets = np.concatenate(([0], np.cumsum(new_counts)))
+        new_segments = np.repeat(np.arange(len(target_macs)), new_counts)
+        weights = np.where(resample[new_segments], 1.0 / new_counts[new_segments], weights[indices])
+
+        for s, target_mac in enumerate(target_macs):
+            self.particles[target_mac] = particles[new_offsets[s]:new_offsets[s + 1]]
+            self.weights[target_mac] = weights[new_offsets[s]:new_offsets[s + 1]]
+            self.last_update[target_mac] = now
+            self.estimates[target_mac] = estimates[s]
+            self.spreads[target_mac] = spreads[s]
+
+        return estimates
+
+    def predict(self, particles, dts):
+        # constant velocity with random acceleration, kept inside the area
+        # position from the velocity at the start of the step, then the velocity update
+        accelerations = self.rng.normal(0.0, self.acceleration_std, size=(len(particles), 2))
+        particles[:, :2] += particles[:, 2:] * dts[:, None] + 0.5 * accelerations * dts[:, None]**2
+        particles[:, 2:] += accelerations * dts[:, None]
+        speeds = np.linalg.norm(particles[:, 2:], axis=1)
+        too_fast = speeds > self.max_speed
+        particles[too_fast, 2:] *= (self.max_speed / speeds[too_fast])[:, None]
+        np.clip(particles[:, 0], 0.0, self.area[0], out=particles[:, 0])
+        np.clip(particles[:, 1], 0.0, self.area[1], out=particles[:, 1])
+
+    def resample_indices(self, weights, segments, offsets, new_counts, resample):
+        # systematic resampling of all segments at once: the per target cumulative weights end at 1,
+        # so shifting segment s by s makes one global cumulative sum that a single searchsorted can use
+        cumulative = np.cumsum(weights)
+        cumulative += segments - (cumulative[offsets[:-1]] - weights[offsets[:-1]])[segments]
+        new_offsets = np.concatenate(([0], np.cumsum(new_counts)))
+        new_segments = np.repeat(np.arange(len(new_counts)), new_counts)
+        ranks = np.arange(new_offsets[-1]) - new_offsets[:-1][new_segments]
+
+        starts = self.rng.uniform(0.0, 1.0, len(new_counts))
+        queries = new_segments + (ranks + starts[new_segments]) / new_counts[new_segments]
+        indices = np.searchsorted(cumulative, queries, side='right')
+        indices = np.clip(indices, offsets[:-1][new_segments], offsets[1:][new_segments] - 1)
+
+        # segments without resampling keep their particles
+        return np.where(resample[new_segments], indices, offsets[:-1][new_segments] + ranks)